@@ -0,0 +1,38 @@
+"""
+Compares the row wise, compiled and columnar batch transforms on a
+synthetic export.
+
+    python -m benchmarks.bench_batch
+"""
+import json
+
+from timeit import repeat
+
+from buggy.batch import batch_transform_data
+from buggy.compiler import compile_transformers
+from buggy.transform import BUGGY_TRANSFORMERS, transform_data
+
+from .bench_compile import Identifier
+from .synthetic import make_submissions
+
+def main(entries: int=100000, repeats: int=3) -> dict:
+    data = make_submissions(entries)
+    identifier = Identifier()
+    compiled = compile_transformers(BUGGY_TRANSFORMERS)
+    assert batch_transform_data(data, BUGGY_TRANSFORMERS, identifier=identifier) == \
+        transform_data(data, BUGGY_TRANSFORMERS, identifier=identifier)
+
+    runs = {
+        "row_wise": lambda: transform_data(data, BUGGY_TRANSFORMERS, identifier=identifier),
+        "compiled": lambda: transform_data(data, compiled, identifier=identifier),
+        "batch": lambda: batch_transform_data(data, BUGGY_TRANSFORMERS, identifier=identifier)
+    }
+    results = {}
+    for name, run in runs.items():
+        seconds = min(repeat(run, number=1, repeat=repeats))
+        results[name] = {"seconds": seconds, "entries_per_second": entries / seconds}
+    results["speedup"] = results["row_wise"]["seconds"] / results["batch"]["seconds"]
+    return results
+
+if __name__ == "__main__":
+    print(json.dumps(main(), indent=4))
@@ -0,0 +1,39 @@
+"""
+Compares transforming entries through BUGGY_TRANSFORMERS as a list of
+partials against the compiled plan.
+
+    python -m benchmarks.bench_compile
+"""
+import json
+
+from timeit import repeat
+
+from buggy.compiler import compile_transformers
+from buggy.transform import BUGGY_TRANSFORMERS, transform_data
+
+from .synthetic import make_submissions
+
+class Identifier(object):
+    @staticmethod
+    def get_identifier(user_id):
+        return "AX12"
+
+def main(entries: int=10000, repeats: int=5) -> dict:
+    data = make_submissions(entries)
+    identifier = Identifier()
+    compiled = compile_transformers(BUGGY_TRANSFORMERS)
+    assert transform_data(data, compiled, identifier=identifier) == \
+        transform_data(data, BUGGY_TRANSFORMERS, identifier=identifier)
+
+    results = {}
+    for name, transformers in [("partials", BUGGY_TRANSFORMERS), ("compiled", compiled)]:
+        seconds = min(repeat(
+            lambda: transform_data(data, transformers, identifier=identifier),
+            number=1, repeat=repeats
+        ))
+        results[name] = {"seconds": seconds, "entries_per_second": entries / seconds}
+    results["speedup"] = results["partials"]["seconds"] / results["compiled"]["seconds"]
+    return results
+
+if __name__ == "__main__":
+    print(json.dumps(main(), indent=4))
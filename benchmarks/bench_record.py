@@ -0,0 +1,43 @@
+"""
+Compares the memory held by a synthetic batch of transformed records as
+dicts and as Observations.
+
+    python -m benchmarks.bench_record
+"""
+import gc
+import json
+import tracemalloc
+
+from buggy.transform import BUGGY_TRANSFORMERS, transform_data
+
+from .bench_compile import Identifier
+from .synthetic import make_submissions
+
+def _held(build) -> int:
+    # bytes still allocated once build's result is all that is left
+    gc.collect()
+    tracemalloc.start()
+    records = build()
+    gc.collect()
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return held
+
+def main(entries: int=100000) -> dict:
+    data = make_submissions(entries)
+    identifier = Identifier()
+    # hand out the observer codes up front so neither run is charged for them
+    transform_data(data, BUGGY_TRANSFORMERS, identifier=identifier)
+
+    results = {
+        "dict_bytes": _held(lambda: transform_data(data, BUGGY_TRANSFORMERS, identifier=identifier)),
+        "observation_bytes": _held(lambda: transform_data(data, BUGGY_TRANSFORMERS, identifier=identifier, compact=True))
+    }
+    results["dict_bytes_per_record"] = results["dict_bytes"] / entries
+    results["observation_bytes_per_record"] = results["observation_bytes"] / entries
+    results["reduction"] = 1 - results["observation_bytes"] / results["dict_bytes"]
+    return results
+
+if __name__ == "__main__":
+    print(json.dumps(main(), indent=4))
@@ -0,0 +1,179 @@
+"""
+Benchmarks pull_and_transform_data and upload_data against local stand-in
+Kobo and iNaturalist servers and prints the results as JSON.
+
+    python -m benchmarks.run --submissions 20000 --latency 0.05 --output results.json
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+
+from functools import partial
+from time import perf_counter
+
+from buggy.batch import batch_transform_data
+from buggy.compiler import compile_transformers
+from buggy.inaturalist import iNaturalist
+from buggy.kobo import Kobo
+from buggy.pipeline import Pipeline
+from buggy.session import make_session
+from buggy.transform import (
+    APPROVED,
+    BUGGY_FIELDS,
+    BUGGY_TRANSFORMERS,
+    pull_and_transform_data,
+    stream_and_transform_data,
+    transform_data
+)
+from buggy.upload import upload_data, upload_record
+
+from .bench_compile import Identifier
+from .servers import StandInServer
+from .synthetic import make_submissions
+
+UID = "aBenchmarkAssetUid"
+
+def _timed(run) -> tuple:
+    start = perf_counter()
+    result = run()
+    return perf_counter() - start, result
+
+def _rate(count: int, seconds: float) -> dict:
+    return {"count": count, "seconds": seconds, "per_second": count / seconds if seconds else None}
+
+def _percentiles(samples: list) -> dict:
+    samples = sorted(samples)
+    return {
+        "p50": statistics.median(samples),
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "max": samples[-1]
+    }
+
+def bench_transform(submissions: list, server: StandInServer, page_size: int) -> dict:
+    session = make_session()
+    kobo = Kobo("user", "password", url=server.url, session=session)
+    identifier = Identifier()
+    count = len(submissions)
+    results = {}
+
+    seconds, _ = _timed(lambda: pull_and_transform_data(kobo, UID, BUGGY_TRANSFORMERS, identifier=identifier))
+    results["pull_and_transform_data"] = _rate(count, seconds)
+
+    seconds, (transformed, _) = _timed(lambda: pull_and_transform_data(
+        kobo, UID, BUGGY_TRANSFORMERS, statuses=APPROVED, fields=BUGGY_FIELDS, identifier=identifier
+    ))
+    results["pull_and_transform_data_approved_only"] = dict(_rate(count, seconds), approved=len(transformed))
+
+    first = {}
+    def stream():
+        start = perf_counter()
+        for i, _ in enumerate(stream_and_transform_data(
+            kobo, UID, BUGGY_TRANSFORMERS, page_size=page_size, identifier=identifier
+        )):
+            if i == 0:
+                first["seconds"] = perf_counter() - start
+    seconds, _ = _timed(stream)
+    results["stream_and_transform_data"] = dict(_rate(count, seconds), first_record_seconds=first.get("seconds"))
+
+    compiled = compile_transformers(BUGGY_TRANSFORMERS)
+    for name, run in [
+        ("transform_data", lambda: transform_data(submissions, BUGGY_TRANSFORMERS, identifier=identifier)),
+        ("compiled", lambda: transform_data(submissions, compiled, identifier=identifier)),
+        ("batch", lambda: batch_transform_data(submissions, BUGGY_TRANSFORMERS, identifier=identifier))
+    ]:
+        seconds, _ = _timed(run)
+        results[name] = _rate(count, seconds)
+    return results
+
+def bench_upload(records: list, server: StandInServer, workers: list, latency_samples: int) -> dict:
+    session = make_session(pool_size=max(workers) * 4)
+    kobo = Kobo("user", "password", url=server.url, session=session)
+    inaturalist = iNaturalist(
+        "id", "secret", "user", "password",
+        url=server.url, api_url=server.api_url, session=session
+    )
+    valid = [record for record in records if record["is_valid"]]
+    results = {}
+
+    latencies = []
+    for record in valid[:latency_samples]:
+        seconds, _ = _timed(partial(upload_record, record, UID, inaturalist, kobo, in_memory=True))
+        latencies.append(seconds)
+    results["record_latency_seconds"] = _percentiles(latencies)
+
+    for count in workers:
+        seconds, _ = _timed(lambda: upload_data(valid, UID, inaturalist, kobo, workers=count, in_memory=True))
+        results[f"upload_data_workers_{count}"] = _rate(len(valid), seconds)
+
+    seconds, _ = _timed(lambda: upload_data(
+        valid, UID, inaturalist, kobo, workers=max(workers), in_memory=True, embed_fields=True
+    ))
+    results[f"upload_data_workers_{max(workers)}_embed_fields"] = _rate(len(valid), seconds)
+    return results
+
+def bench_pipeline(submissions: list, server: StandInServer, workers: int, page_size: int) -> dict:
+    session = make_session(pool_size=workers * 4)
+    kobo = Kobo("user", "password", url=server.url, session=session)
+    inaturalist = iNaturalist(
+        "id", "secret", "user", "password",
+        url=server.url, api_url=server.api_url, session=session
+    )
+    ids = [submission["_id"] for submission in submissions]
+    pipeline = Pipeline(
+        kobo, inaturalist, UID, BUGGY_TRANSFORMERS,
+        page_size=page_size, query={"_id": {"$in": ids}}, fetch_workers=2,
+        create_workers=workers, prefetch_workers=2 * workers, attach_workers=4 * workers,
+        in_memory=True, identifier=Identifier()
+    )
+    seconds, summary = _timed(pipeline.run)
+    return dict(_rate(summary["uploaded"], seconds), **summary)
+
+def _revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv: list=None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--submissions", type=int, default=5000)
+    parser.add_argument("--uploads", type=int, default=200, help="submissions to upload")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every stand-in response")
+    parser.add_argument("--image-bytes", type=int, default=200 * 1024)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--latency-samples", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON here as well as to stdout")
+    args = parser.parse_args(argv)
+
+    submissions = make_submissions(args.submissions, seed=args.seed)
+    results = {
+        "revision": _revision(),
+        "python": platform.python_version(),
+        "parameters": vars(args),
+    }
+    with StandInServer(submissions, latency=args.latency, image_bytes=args.image_bytes) as server:
+        results["transform"] = bench_transform(submissions, server, args.page_size)
+        records, _ = transform_data(
+            submissions[:args.uploads], BUGGY_TRANSFORMERS, identifier=Identifier()
+        )
+        results["upload"] = bench_upload(records, server, args.workers, args.latency_samples)
+        results["pipeline"] = bench_pipeline(
+            submissions[:args.uploads], server, max(args.workers), min(args.page_size, 50)
+        )
+        results["requests"] = dict(server.counts)
+
+    output = json.dumps(results, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(output)
+    print(output)
+    return results
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+A local stand-in for the Kobo and iNaturalist APIs with configurable
+latency, for benchmarking without touching the real services.
+"""
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from urllib.parse import parse_qs, urlencode, urlparse
+
+def _matches(submission: dict, query: dict) -> bool:
+    # the handful of mongo operators buggy sends
+    for key, condition in query.items():
+        if key == "$and":
+            if not all(_matches(submission, part) for part in condition):
+                return False
+            continue
+        value = submission
+        for part in key.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, operand in condition.items():
+            if operator == "$eq" and value != operand:
+                return False
+            if operator == "$gt" and not (value is not None and value > operand):
+                return False
+            if operator == "$in" and value not in operand:
+                return False
+    return True
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes
+    disable_nagle_algorithm = True
+
+    def _reply(self, body, status: int=200, content_type: str="application/json") -> None:
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _count(self, name: str) -> None:
+        with self.server.lock:
+            self.server.counts[name] = self.server.counts.get(name, 0) + 1
+
+    def do_GET(self):
+        sleep(self.server.latency)
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path == "/token":
+            self._count("kobo.token")
+            return self._reply({"token": "stand-in"})
+        if url.path == "/users/api_token":
+            self._count("inaturalist.auth")
+            return self._reply({"api_token": "stand-in"})
+        if url.path.endswith("/data.json"):
+            self._count("kobo.data")
+            return self._data(url.path, params)
+        if "/attachments/" in url.path:
+            self._count("kobo.attachments")
+            return self._reply(self.server.image, content_type="image/jpeg")
+        self._reply({"detail": "not found"}, status=404)
+
+    def _data(self, path: str, params: dict) -> None:
+        query = json.loads(params.get("query", ["{}"])[0])
+        fields = json.loads(params.get("fields", ["null"])[0])
+        start = int(params.get("start", ["0"])[0])
+        limit = int(params.get("limit", [str(self.server.max_page)])[0])
+        matches = [s for s in self.server.submissions if _matches(s, query)]
+        results = matches[start:start + limit]
+        if fields is not None:
+            results = [{key: s[key] for key in fields if key in s} for s in results]
+        body = {"count": len(matches), "next": None, "previous": None, "results": results}
+        if start + limit < len(matches):
+            next_params = {key: values[0] for key, values in params.items()}
+            next_params.update({"start": start + limit, "limit": limit})
+            body["next"] = f"{self.server.url}{path}?{urlencode(next_params)}"
+        self._reply(body)
+
+    def do_POST(self):
+        sleep(self.server.latency)
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        url = urlparse(self.path)
+        if url.path == "/oauth/token":
+            self._count("inaturalist.auth")
+            return self._reply({"access_token": "stand-in"})
+        name = url.path.rstrip("/").split("/")[-1]
+        self._count(f"inaturalist.{name}")
+        with self.server.lock:
+            self.server.next_id += 1
+            return self._reply({"id": self.server.next_id})
+
+    def log_message(self, *args):
+        pass
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 resets connections under a busy pipeline
+    request_queue_size = 128
+
+    def __init__(self, submissions: list=None, latency: float=0.0, image_bytes: int=500 * 1024, max_page: int=30000) -> None:
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.submissions = submissions or []
+        self.latency = latency
+        self.image = b"\xff" * image_bytes
+        self.max_page = max_page
+        self.counts = {}
+        self.next_id = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    @property
+    def api_url(self) -> str:
+        return f"{self.url}/v1"
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.shutdown()
+        self.server_close()
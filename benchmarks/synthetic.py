@@ -0,0 +1,91 @@
+"""
+Synthetic Kobo submissions shaped like the buggy survey form.
+"""
+import random
+
+from datetime import datetime, timedelta
+
+SURVEY_METHODS = ["incidental", "walking", "transect_survey", "area", "other"]
+STAGES = ["adult", "egg", "larva", "pupa", "nymph", "other"]
+ACTIVITIES = ["mating", "moving", "foraging", "feeding", "resting", "predator", "prey", "guarding", "tending", "other"]
+PHENOLOGIES = ["initial", "breaking", "increasing", "flowers", "fruiting", "mature", "other"]
+ARTHROPOD_GROUPS = [
+    "anisoptera", "aphidomorpha", "araneae", "blattodea", "cicadomorpha", "coleoptera",
+    "diptera", "hemiptera", "hymenoptera_1", "hymenoptera_2", "lepidoptera", "opiliones",
+    "trichoptera", "other", "unidentified"
+]
+HOST_GROUPS = ["angiospermae", "bryophyta", "fungi", "pinopsida", "poales", "polypodiopsida"]
+VALIDATION_STATUSES = [
+    "validation_status_approved",
+    "validation_status_not_approved",
+    "validation_status_on_hold"
+]
+PHOTO_FIELDS = [
+    "arthropod_documentation/arthropod_photo_1",
+    "arthropod_documentation/arthropod_photo_2",
+    "arthropod_documentation/arthropod_photo_3",
+    "host_documentation/host_photo"
+]
+NOTE_FIELDS = [
+    "session_info/survey_method_other",
+    "arthropod_documentation/arthropod_group_other",
+    "arthropod_documentation/developmental_stage_other",
+    "arthropod_documentation/activity_other",
+    "arthropod_documentation/arthropod_more",
+    "host_documentation/host_group_other",
+    "host_documentation/host_phenology_other",
+    "host_documentation/host_more"
+]
+
+def make_submission(_id: int, rng: random.Random, observers: int=200, approved: float=0.5) -> dict:
+    latitude = rng.uniform(55.0, 65.0)
+    longitude = rng.uniform(-160.0, -140.0)
+    accuracy = round(rng.uniform(3.0, 30.0), 1)
+    ts = datetime(2022, 4, 1) + timedelta(seconds=rng.randrange(180 * 24 * 3600))
+    status = (
+        VALIDATION_STATUSES[0] if rng.random() < approved
+        else rng.choice(VALIDATION_STATUSES[1:])
+    )
+
+    submission = {
+        "_id": _id,
+        "_uuid": f"{_id:08x}-0000-4000-8000-{rng.getrandbits(48):012x}",
+        "_submission_time": (ts + timedelta(hours=1)).isoformat(),
+        "_version": "vdkRfLPZ4tvVktFAGzmxDm",
+        "_geolocation": [latitude, longitude],
+        "_validation_status": {"uid": status, "label": status.split("_")[-1].title()},
+        "session_info/location": f"{latitude} {longitude} {rng.uniform(0, 500):.1f} {accuracy}",
+        "session_info/survey_method": rng.choice(SURVEY_METHODS),
+        "session_info/Survey_duration": str(rng.randrange(5, 120)),
+        "session_info/survey_ts": ts.isoformat(),
+        "session_info/input_email": f"volunteer{rng.randrange(observers)}@geemail.com",
+        "arthropod_documentation/arthropod_group": rng.choice(ARTHROPOD_GROUPS),
+        "arthropod_documentation/developmental_stage": rng.choice(STAGES),
+        "arthropod_documentation/activity": rng.choice(ACTIVITIES),
+        "arthropod_documentation/quantity": str(rng.randrange(1, 20)),
+        "arthropod_documentation/length": f"{rng.uniform(0.1, 8.0):.1f}",
+        "host_documentation/host_group": rng.choice(HOST_GROUPS),
+        "host_documentation/host_phenology": rng.choice(PHENOLOGIES),
+        "host_documentation/wet_support": rng.choice(["yes", "no"]),
+        "_attachments": []
+    }
+    for field in rng.sample(NOTE_FIELDS, rng.randrange(0, 3)):
+        submission[field] = "Lorem ipsum dolor sit amet, " * rng.randrange(1, 4)
+
+    photos = rng.sample(PHOTO_FIELDS[:3], rng.randrange(1, 4)) + PHOTO_FIELDS[3:]
+    for i, field in enumerate(photos):
+        filename = f"{field.split('/')[-1]}-{_id}.jpg"
+        submission[field] = filename
+        submission["_attachments"].append({
+            "download_url": f"https://kc.kobotoolbox.org/media/original?media_file=user/attachments/{filename}",
+            "mimetype": "image/jpeg",
+            "filename": f"user/attachments/{submission['_uuid']}/{filename}",
+            "instance": _id,
+            "xform": 1,
+            "id": _id * 10 + i
+        })
+    return submission
+
+def make_submissions(count: int, seed: int=0, **kwargs) -> list:
+    rng = random.Random(seed)
+    return [make_submission(_id, rng, **kwargs) for _id in range(1, count + 1)]
@@ -0,0 +1,153 @@
+from functools import partial
+from itertools import repeat
+
+from .compiler import _compile_notes
+from .transform import (
+    mapping_transform,
+    convert_key_transform,
+    identifier_transform,
+    observation_field_transformer,
+    image_transformer,
+    longitude_transform,
+    latitude_transform,
+    accuracy_transform,
+    notes_transform,
+    is_valid_transform
+)
+
+def _kernels(transformer, kwargs: dict) -> tuple:
+    # (output key, whole column function, single entry function) where a
+    # key of None means the single entry function returns (key, value)
+    func = transformer.func if isinstance(transformer, partial) else transformer
+    args = transformer.args if isinstance(transformer, partial) else ()
+    if isinstance(transformer, partial) and transformer.keywords:
+        func = None
+
+    if func is mapping_transform and len(args) == 4:
+        entry_key, output_key, mapping, default = args
+        return (
+            output_key,
+            lambda entries: list(map(mapping.get, [entry.get(entry_key) for entry in entries], repeat(default))),
+            lambda entry: mapping.get(entry.get(entry_key), default)
+        )
+    if func is convert_key_transform and len(args) == 4:
+        entry_key, output_key, type, default = args
+        return (
+            output_key,
+            lambda entries: list(map(type, [entry.get(entry_key, default) for entry in entries])),
+            lambda entry: type(entry.get(entry_key, default))
+        )
+    if func is longitude_transform and not args:
+        return (
+            "longitude",
+            lambda entries: [entry["_geolocation"][1] for entry in entries],
+            lambda entry: entry["_geolocation"][1]
+        )
+    if func is latitude_transform and not args:
+        return (
+            "latitude",
+            lambda entries: [entry["_geolocation"][0] for entry in entries],
+            lambda entry: entry["_geolocation"][0]
+        )
+    if func is accuracy_transform and not args:
+        return (
+            "positional_accuracy",
+            lambda entries: list(map(float, [
+                entry["session_info/location"].strip().split(" ")[-1]
+                for entry in entries
+            ])),
+            lambda entry: float(entry["session_info/location"].strip().split(" ")[-1])
+        )
+    if func is is_valid_transform and not args:
+        return (
+            "is_valid",
+            lambda entries: [
+                entry.get("_validation_status", {}).get("uid") == "validation_status_approved"
+                for entry in entries
+            ],
+            lambda entry: entry.get("_validation_status", {}).get("uid") == "validation_status_approved"
+        )
+    if func is notes_transform and len(args) == 2:
+        notes = _compile_notes(*args)
+        return "notes", lambda entries: list(map(notes, entries)), notes
+    if func is image_transformer and len(args) == 1:
+        image_fields = args[0]
+        single = lambda entry: image_transformer(image_fields, entry)[1]
+        return "images", lambda entries: list(map(single, entries)), single
+    if func is identifier_transform and len(args) == 2:
+        # called one entry at a time, in order, like the row wise path
+        single = lambda entry: transformer(entry, **kwargs)[1]
+        return args[1], None, single
+    return None, None, lambda entry: transformer(entry, **kwargs)
+
+def _columns(entries: list, transformers: list, mask: list, kwargs: dict) -> list:
+    columns = []
+    for transformer in transformers:
+        rows = [i for i, alive in enumerate(mask) if alive]
+        values = [None] * len(entries)
+
+        if (
+            isinstance(transformer, partial)
+            and transformer.func is observation_field_transformer
+            and len(transformer.args) == 1
+            and not transformer.keywords
+        ):
+            nested = _columns(entries, transformer.args[0], mask, kwargs)
+            columns.append(("observation_fields", _assemble(nested, mask)))
+            continue
+
+        key, column, single = _kernels(transformer, kwargs)
+        computed = None
+        if column is not None:
+            try:
+                computed = column([entries[i] for i in rows])
+            except Exception:
+                # some entry in the column is bad, find it one entry at a time
+                computed = None
+        if computed is not None:
+            for i, value in zip(rows, computed):
+                values[i] = value
+        else:
+            for i in rows:
+                try:
+                    values[i] = single(entries[i])
+                except Exception:
+                    mask[i] = False
+        columns.append((key, values))
+    return columns
+
+def _assemble(columns: list, mask: list) -> list:
+    # one dict per entry, None wherever mask is False
+    keys = [key for key, _ in columns]
+    if None not in keys and len(set(keys)) == len(keys):
+        # every output key is known, zip the columns straight into rows
+        return [
+            dict(zip(keys, row)) if alive else None
+            for alive, row in zip(mask, zip(*[values for _, values in columns]))
+        ] if columns else [{} if alive else None for alive in mask]
+
+    records = [{} if alive else None for alive in mask]
+    for key, values in columns:
+        for transformed, value in zip(records, values):
+            if transformed is None:
+                continue
+            if key is None:
+                transformed[value[0]] = value[1]
+            else:
+                transformed[key] = value
+    return records
+
+def transform_batch(entries: list, transformers: list, **kwargs) -> tuple:
+    # records[i] is None wherever mask[i] is False
+    mask = [True] * len(entries)
+    columns = _columns(entries, transformers, mask, kwargs)
+    return _assemble(columns, mask), mask
+
+def batch_transform_data(data: list, transformers: list, batch_size: int=10000, **kwargs) -> tuple:
+    transformed_data = []
+    failed = 0
+    for start in range(0, len(data), batch_size):
+        records, mask = transform_batch(data[start:start + batch_size], transformers, **kwargs)
+        transformed_data.extend(record for record, alive in zip(records, mask) if alive)
+        failed += mask.count(False)
+    return transformed_data, failed
@@ -0,0 +1,186 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import NamedTemporaryFile
+from time import time
+
+from tqdm import tqdm
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    key TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    mtime INTEGER
+);
+CREATE INDEX IF NOT EXISTS images_last_used ON images (last_used);
+"""
+
+# Kobo attachments on disk, stored by content hash and evicted least
+# recently used first once the cache grows past max_bytes
+class ImageCache(object):
+    def __init__(self, directory: str, max_bytes: int=2 * 1024 ** 3, verify: bool=True) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.verify = verify
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self.connection = sqlite3.connect(
+            os.path.join(directory, "index.sqlite"),
+            check_same_thread=False
+        )
+        self.connection.executescript(SCHEMA)
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(images)")]
+        if "mtime" not in columns:
+            # caches made before mtime was kept are hashed once more instead
+            with self.connection:
+                self.connection.execute("ALTER TABLE images ADD COLUMN mtime INTEGER")
+
+    @staticmethod
+    def _key(uid: str, instance: int, image: int) -> str:
+        return f"{uid}/{instance}/{image}"
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "objects", digest[:2], digest)
+
+    @staticmethod
+    def _digest(path: str) -> str:
+        sha = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def _drop(self, key: str) -> None:
+        row = self.connection.execute(
+            "SELECT digest FROM images WHERE key = ?", (key,)
+        ).fetchone()
+        self.connection.execute("DELETE FROM images WHERE key = ?", (key,))
+        if row is None:
+            return
+        # the same photo can be attached under more than one key
+        shared = self.connection.execute(
+            "SELECT 1 FROM images WHERE digest = ?", (row[0],)
+        ).fetchone()
+        if not shared and os.path.exists(self._object_path(row[0])):
+            os.remove(self._object_path(row[0]))
+
+    def _get(self, key: str) -> str:
+        # with the lock held; a file whose size or mtime changed since it was
+        # stored is dropped, only files from older caches are hashed again
+        row = self.connection.execute(
+            "SELECT digest, size, mtime FROM images WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        digest, size, mtime = row
+        path = self._object_path(digest)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            stat = None
+        with self.connection:
+            if stat is None or (self.verify and (
+                stat.st_size != size
+                or (mtime is not None and stat.st_mtime_ns != mtime)
+                or (mtime is None and self._digest(path) != digest)
+            )):
+                self._drop(key)
+                return None
+            self.connection.execute(
+                "UPDATE images SET last_used = ?, mtime = ? WHERE key = ?",
+                (time(), stat.st_mtime_ns, key)
+            )
+        return path
+
+    def get(self, uid: str, instance: int, image: int) -> str:
+        # the file may be evicted by another thread once this returns, use
+        # open when other threads share the cache
+        with self.lock:
+            return self._get(self._key(uid, instance, image))
+
+    def _put(self, key: str, source: str) -> str:
+        digest = self._digest(source)
+        path = self._object_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(source, path)
+        stat = os.stat(path)
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO images (key, digest, size, last_used, mtime) VALUES (?, ?, ?, ?, ?)",
+                (key, digest, stat.st_size, time(), stat.st_mtime_ns)
+            )
+            # other keys with the same photo now point at the replaced file
+            self.connection.execute(
+                "UPDATE images SET mtime = ? WHERE digest = ?", (stat.st_mtime_ns, digest)
+            )
+            self._evict(keep=path)
+        return path
+
+    def put(self, uid: str, instance: int, image: int, source: str) -> str:
+        # moves the file at source into the cache
+        with self.lock:
+            return self._put(self._key(uid, instance, image), source)
+
+    def _evict(self, keep: str) -> None:
+        total, = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM images"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        for key, digest, size in self.connection.execute(
+            "SELECT key, digest, size FROM images ORDER BY last_used"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            if self._object_path(digest) == keep:
+                continue
+            self._drop(key)
+            total -= size
+
+    def _download(self, kobo_client, uid: str, instance: int, image: int, use):
+        key = self._key(uid, instance, image)
+        with self.lock:
+            path = self._get(key)
+            if path is not None:
+                return use(path)
+        with NamedTemporaryFile(dir=self.directory, delete=False) as fh:
+            download = fh.name
+        try:
+            kobo_client.pull_image(download, uid, instance, image)
+            with self.lock:
+                return use(self._put(key, download))
+        finally:
+            if os.path.exists(download):
+                os.remove(download)
+
+    def fetch(self, kobo_client, uid: str, instance: int, image: int) -> str:
+        return self._download(kobo_client, uid, instance, image, lambda path: path)
+
+    def open(self, kobo_client, uid: str, instance: int, image: int):
+        # opened with the lock held, so the photo stays readable even if
+        # another upload worker evicts it right after
+        return self._download(kobo_client, uid, instance, image, lambda path: open(path, "rb"))
+
+    def close(self) -> None:
+        self.connection.close()
+
+def prefetch_images(data: list, uid: str, kobo_client, cache: ImageCache, workers: int=8) -> None:
+    # warm the cache with every image upload_data is going to need
+    images = [
+        (record['instance'], image)
+        for record in data
+        if record['is_valid']
+        for image in record['images']
+    ]
+    with ThreadPoolExecutor(workers) as executor:
+        futures = [
+            executor.submit(cache.fetch, kobo_client, uid, instance, image)
+            for instance, image in images
+        ]
+        for future in tqdm(futures):
+            future.result()
@@ -0,0 +1,325 @@
+"""
+buggy moves survey submissions from kobo to iNaturalist.
+
+Credentials come from the environment: KOBO_USERNAME, KOBO_PASSWORD,
+INATURALIST_CLIENT_ID, INATURALIST_CLIENT_SECRET, INATURALIST_USERNAME and
+INATURALIST_PASSWORD (passwords are prompted for when unset).
+"""
+import argparse
+import os
+import sys
+
+# Only the standard library is imported up here so `buggy --help` starts
+# fast; every command imports what it needs when it runs.
+
+def _credential(name: str, secret: bool=False) -> str:
+    value = os.environ.get(name)
+    if value is None and secret:
+        from getpass import getpass
+        value = getpass(f"{name}: ")
+    if value is None:
+        sys.exit(f"buggy: set {name}")
+    return value
+
+def _clients(args, inaturalist: bool=False) -> tuple:
+    from .kobo import Kobo
+    from .ratelimit import Scheduler
+    from .session import make_session
+
+    session = make_session(pool_size=max(16, 4 * getattr(args, "workers", 1)))
+    scheduler = Scheduler()
+    kobo = Kobo(
+        _credential("KOBO_USERNAME"), _credential("KOBO_PASSWORD", secret=True),
+        session=session, scheduler=scheduler
+    )
+    if not inaturalist:
+        return kobo, None
+
+    from .inaturalist import iNaturalist
+    return kobo, iNaturalist(
+        _credential("INATURALIST_CLIENT_ID"),
+        _credential("INATURALIST_CLIENT_SECRET", secret=True),
+        _credential("INATURALIST_USERNAME"),
+        _credential("INATURALIST_PASSWORD", secret=True),
+        session=session, scheduler=scheduler
+    )
+
+def _pushdown(args) -> dict:
+    # kobo filters out unapproved submissions and unused fields for us
+    if not args.approved_only:
+        return {}
+    from .transform import APPROVED, BUGGY_FIELDS
+    return {"statuses": APPROVED, "fields": BUGGY_FIELDS}
+
+def _watermarks(args):
+    if not getattr(args, "watermarks", None):
+        return None
+    from .watermark import Watermarks
+    return Watermarks(args.watermarks)
+
+def _transform(args, kobo, watermarks=None) -> list:
+    from .deadletter import DeadLetterStore
+    from .identifier import FANIdentifier
+    from .transform import BUGGY_TRANSFORMERS, transform_data
+
+    identifier = FANIdentifier(args.db, lease_size=args.lease_size)
+    dead_letters = DeadLetterStore(args.dead_letters) if args.dead_letters else None
+    cache = None
+    if args.cache:
+        from .resultcache import TransformCache
+        cache = TransformCache(args.cache)
+    try:
+        if args.input:
+            from .records import RecordFile
+            with RecordFile(args.input) as raw:
+                if cache is not None:
+                    from .transform import cached_transform_data
+                    return cached_transform_data(
+                        raw, args.uid, BUGGY_TRANSFORMERS, cache,
+                        dead_letters=dead_letters, identifier=identifier
+                    )
+                return transform_data(
+                    raw, BUGGY_TRANSFORMERS,
+                    dead_letters=dead_letters, identifier=identifier
+                )
+        if watermarks is not None:
+            from .transform import pull_and_transform_new_data
+            return pull_and_transform_new_data(
+                kobo, args.uid, BUGGY_TRANSFORMERS, watermarks,
+                dead_letters=dead_letters, cache=cache, identifier=identifier,
+                **_pushdown(args)
+            )
+        from .transform import pull_and_transform_data
+        return pull_and_transform_data(
+            kobo, args.uid, BUGGY_TRANSFORMERS,
+            dead_letters=dead_letters, cache=cache, identifier=identifier,
+            **_pushdown(args)
+        )
+    finally:
+        if dead_letters is not None:
+            dead_letters.close()
+        if cache is not None:
+            cache.close()
+        identifier.close()
+
+def _upload(args, kobo, inaturalist, records) -> None:
+    from .upload import upload_data
+
+    ledger = image_cache = None
+    try:
+        if args.ledger:
+            from .ledger import UploadLedger
+            ledger = UploadLedger(args.ledger)
+        if args.image_cache:
+            from .cache import ImageCache
+            image_cache = ImageCache(args.image_cache)
+        if args.drop_duplicates:
+            from .dedup import DuplicateIndex, deduplicate
+            index = DuplicateIndex(distance=args.duplicate_distance, window=args.duplicate_window)
+            if ledger is not None:
+                index.add_history(ledger)
+            records = deduplicate(records, args.uid, index)
+        upload_data(
+            records, args.uid, inaturalist, kobo,
+            workers=args.workers, ledger=ledger, in_memory=args.in_memory,
+            image_cache=image_cache, embed_fields=args.embed_fields
+        )
+    finally:
+        if ledger is not None:
+            ledger.close()
+        if image_cache is not None:
+            image_cache.close()
+
+def pull(args) -> None:
+    from .records import write_records
+
+    kobo, _ = _clients(args)
+    pushdown = _pushdown(args)
+    if pushdown:
+        from .transform import validation_query
+        entries = kobo.iter_data(
+            args.uid, page_size=args.page_size,
+            query=validation_query(pushdown["statuses"]), fields=pushdown["fields"]
+        )
+    else:
+        entries = kobo.iter_data(args.uid, page_size=args.page_size)
+    count = write_records(entries, args.output)
+    print(f"{count} submissions written to {args.output}")
+
+def transform(args) -> None:
+    from .records import write_records
+
+    kobo = None if args.input else _clients(args)[0]
+    watermarks = None if args.input else _watermarks(args)
+    transformed, failed = _transform(args, kobo, watermarks)
+    write_records(transformed, args.output)
+    if watermarks is not None:
+        watermarks.commit()
+    print(f"{len(transformed)} records written to {args.output}, {failed} failed")
+
+def upload(args) -> None:
+    from .records import RecordFile
+
+    kobo, inaturalist = _clients(args, inaturalist=True)
+    with RecordFile(args.input) as records:
+        _upload(args, kobo, inaturalist, records)
+
+def prefetch(args) -> None:
+    from .cache import ImageCache, prefetch_images
+    from .records import RecordFile
+
+    kobo, _ = _clients(args)
+    image_cache = ImageCache(args.image_cache)
+    try:
+        with RecordFile(args.input) as records:
+            prefetch_images(records, args.uid, kobo, image_cache, workers=args.workers)
+    finally:
+        image_cache.close()
+
+def _run_pipeline(args, kobo, inaturalist) -> None:
+    from .deadletter import DeadLetterStore
+    from .identifier import FANIdentifier
+    from .ledger import UploadLedger
+    from .pipeline import Pipeline
+    from .transform import BUGGY_TRANSFORMERS
+
+    identifier = FANIdentifier(args.db, lease_size=args.lease_size)
+    dead_letters = ledger = image_cache = duplicates = None
+    try:
+        if args.dead_letters:
+            dead_letters = DeadLetterStore(args.dead_letters)
+        if args.ledger:
+            ledger = UploadLedger(args.ledger)
+        if args.image_cache:
+            from .cache import ImageCache
+            image_cache = ImageCache(args.image_cache)
+        if args.drop_duplicates:
+            from .dedup import DuplicateIndex
+            duplicates = DuplicateIndex(distance=args.duplicate_distance, window=args.duplicate_window)
+            if ledger is not None:
+                duplicates.add_history(ledger)
+        summary = Pipeline(
+            kobo, inaturalist, args.uid, BUGGY_TRANSFORMERS,
+            create_workers=args.workers, attach_workers=4 * args.workers,
+            prefetch_workers=2 * args.workers, ledger=ledger,
+            in_memory=args.in_memory, image_cache=image_cache,
+            embed_fields=args.embed_fields, dead_letters=dead_letters,
+            duplicates=duplicates, identifier=identifier, **_pushdown(args)
+        ).run()
+    finally:
+        for resource in (ledger, dead_letters, image_cache, identifier):
+            if resource is not None:
+                resource.close()
+    print(summary)
+
+def run(args) -> None:
+    kobo, inaturalist = _clients(args, inaturalist=True)
+    if args.pipeline:
+        return _run_pipeline(args, kobo, inaturalist)
+    watermarks = _watermarks(args)
+    transformed, failed = _transform(args, kobo, watermarks)
+    print(f"{len(transformed)} records transformed, {failed} failed")
+    if args.output:
+        from .records import write_records
+        write_records(transformed, args.output)
+    _upload(args, kobo, inaturalist, transformed)
+    # only now are the pulled submissions safely on iNaturalist
+    if watermarks is not None:
+        watermarks.commit()
+
+def _add_transform_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--db", default="db.json", help="observer identifier database")
+    parser.add_argument("--lease-size", type=int, help="lease observer codes in blocks of this many, for several runs sharing --db")
+    parser.add_argument("--dead-letters", help="keep failed submissions in this file")
+    parser.add_argument("--cache", help="transform result cache")
+    # a submission approved after the watermark moved past it would never be pulled
+    pull = parser.add_mutually_exclusive_group()
+    pull.add_argument("--watermarks", help="only pull submissions newer than the last run")
+    pull.add_argument("--approved-only", action="store_true", help="only pull approved submissions, and only the fields buggy uses")
+
+def _add_upload_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--ledger", help="upload ledger, makes reruns resume")
+    parser.add_argument("--image-cache", help="directory to keep kobo photos in")
+    parser.add_argument("--in-memory", action="store_true", help="never write photos to disk")
+    parser.add_argument("--embed-fields", action="store_true", help="send field values with the observation")
+    parser.add_argument("--drop-duplicates", action="store_true", help="skip observations close to one already seen or uploaded")
+    parser.add_argument("--duplicate-distance", type=float, default=10.0, help="meters, on top of positional accuracy")
+    parser.add_argument("--duplicate-window", type=float, default=3600.0, help="seconds")
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="buggy", description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--timings", help="write per phase timings to this JSON file")
+    commands = parser.add_subparsers(dest="command")
+
+    command = commands.add_parser("pull", help="pull raw submissions to NDJSON")
+    command.add_argument("uid", help="kobo asset uid")
+    command.add_argument("-o", "--output", required=True)
+    command.add_argument("--page-size", type=int, default=1000)
+    command.add_argument("--approved-only", action="store_true", help="only pull approved submissions, and only the fields buggy uses")
+    command.set_defaults(run=pull)
+
+    command = commands.add_parser("transform", help="pull and transform submissions to NDJSON")
+    command.add_argument("uid", help="kobo asset uid")
+    command.add_argument("-o", "--output", required=True)
+    command.add_argument("-i", "--input", help="raw submissions from `buggy pull` instead of kobo")
+    _add_transform_arguments(command)
+    command.set_defaults(run=transform)
+
+    command = commands.add_parser("upload", help="upload transformed NDJSON records to iNaturalist")
+    command.add_argument("uid", help="kobo asset uid")
+    command.add_argument("-i", "--input", required=True)
+    _add_upload_arguments(command)
+    command.set_defaults(run=upload)
+
+    command = commands.add_parser("prefetch", help="download the photos of transformed NDJSON records into an image cache")
+    command.add_argument("uid", help="kobo asset uid")
+    command.add_argument("-i", "--input", required=True)
+    command.add_argument("--image-cache", required=True, help="directory to keep kobo photos in")
+    command.add_argument("--workers", type=int, default=8)
+    command.set_defaults(run=prefetch)
+
+    command = commands.add_parser("run", help="pull, transform and upload")
+    command.add_argument("uid", help="kobo asset uid")
+    command.add_argument("-o", "--output", help="also keep the transformed records here")
+    command.add_argument("--pipeline", action="store_true", help="upload while still pulling (stops cleanly on SIGTERM)")
+    command.set_defaults(input=None)
+    _add_transform_arguments(command)
+    _add_upload_arguments(command)
+    command.set_defaults(run=run)
+    return parser
+
+def main(argv: list=None) -> int:
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 0
+    if getattr(args, "pipeline", False):
+        # the pipeline pulls everything, transforms without a cache and
+        # keeps nothing but the ledger
+        unsupported = [
+            flag for flag, value in [
+                ("--watermarks", args.watermarks), ("--cache", args.cache), ("--output", args.output)
+            ] if value
+        ]
+        if unsupported:
+            parser.error(f"--pipeline cannot be combined with {', '.join(unsupported)}")
+
+    instrumentation = None
+    if args.timings:
+        from . import instrument
+        instrumentation = instrument.enable()
+    try:
+        args.run(args)
+    finally:
+        if instrumentation is not None:
+            instrument.disable()
+            instrumentation.to_json(args.timings)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
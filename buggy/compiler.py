@@ -0,0 +1,145 @@
+from functools import partial
+
+from .transform import (
+    mapping_transform,
+    convert_key_transform,
+    identifier_transform,
+    observation_field_transformer,
+    image_transformer,
+    longitude_transform,
+    latitude_transform,
+    accuracy_transform,
+    notes_transform,
+    is_valid_transform
+)
+
+def _compile_notes(sections: dict, order: list):
+    # validated once here instead of on every entry
+    if set(sections) != set(order):
+        raise ValueError(f"notes sections {sorted(sections)} do not match order {sorted(order)}")
+    headers = [(field, sections[field]) for field in order]
+
+    def notes(entry: dict) -> str:
+        notes = ""
+        for field, header in headers:
+            if field in entry:
+                notes += "\n".join([
+                    header,
+                    entry[field],
+                    "", ""
+                ])
+        return notes.strip()
+    return notes
+
+def _value(transformer):
+    # a function of (entry, kwargs) giving the value of a transformer whose
+    # output key is known up front, None if it has to be called as is
+    func = transformer.func if isinstance(transformer, partial) else transformer
+    args = transformer.args if isinstance(transformer, partial) else ()
+    if isinstance(transformer, partial) and transformer.keywords:
+        return None
+    if func is mapping_transform and len(args) == 4:
+        entry_key, _, mapping, default = args
+        def mapped(entry: dict, kwargs: dict):
+            return mapping.get(entry.get(entry_key), default)
+        return mapped
+    if func is convert_key_transform and len(args) == 4:
+        entry_key, _, type, default = args
+        def converted(entry: dict, kwargs: dict):
+            return type(entry.get(entry_key, default))
+        return converted
+    if func is identifier_transform and len(args) == 2:
+        entry_key = args[0]
+        def identified(entry: dict, kwargs: dict):
+            identifier = kwargs["identifier"]
+            if entry_key in entry:
+                return identifier.get_identifier(entry[entry_key])
+            return None
+        return identified
+    if func is image_transformer and len(args) == 1:
+        image_keys = args[0]
+        def images(entry: dict, kwargs: dict):
+            return image_transformer(image_keys, entry)[1]
+        return images
+    if func is longitude_transform and not args:
+        def longitude(entry: dict, kwargs: dict):
+            return entry["_geolocation"][1]
+        return longitude
+    if func is latitude_transform and not args:
+        def latitude(entry: dict, kwargs: dict):
+            return entry["_geolocation"][0]
+        return latitude
+    if func is accuracy_transform and not args:
+        def accuracy(entry: dict, kwargs: dict):
+            return float(entry["session_info/location"].strip().split(" ")[-1])
+        return accuracy
+    if func is notes_transform and len(args) == 2:
+        notes = _compile_notes(*args)
+        def compiled_notes(entry: dict, kwargs: dict):
+            return notes(entry)
+        return compiled_notes
+    if func is is_valid_transform and not args:
+        def is_valid(entry: dict, kwargs: dict):
+            return entry.get("_validation_status", {}).get("uid") == "validation_status_approved"
+        return is_valid
+    return None
+
+def _key(transformer) -> str:
+    args = transformer.args if isinstance(transformer, partial) else ()
+    func = transformer.func if isinstance(transformer, partial) else transformer
+    if func in (mapping_transform, convert_key_transform, identifier_transform):
+        return args[1]
+    return {
+        observation_field_transformer: "observation_fields",
+        image_transformer: "images",
+        longitude_transform: "longitude",
+        latitude_transform: "latitude",
+        accuracy_transform: "positional_accuracy",
+        notes_transform: "notes",
+        is_valid_transform: "is_valid"
+    }[func]
+
+def _plan(transformers: list):
+    # (key, value function) per transformer, with a key of None for the
+    # ones that are called as they are and name their own key
+    steps = []
+    for transformer in transformers:
+        if (
+            isinstance(transformer, partial)
+            and transformer.func is observation_field_transformer
+            and len(transformer.args) == 1
+            and not transformer.keywords
+        ):
+            steps.append(("observation_fields", _plan(transformer.args[0])))
+            continue
+        value = _value(transformer)
+        if value is None:
+            steps.append((None, transformer))
+        else:
+            steps.append((_key(transformer), value))
+    steps = tuple(steps)
+
+    def compiled(entry: dict, kwargs: dict) -> dict:
+        transformed = {}
+        for key, value in steps:
+            if key is None:
+                key, transformed_value = value(entry, **kwargs)
+                transformed[key] = transformed_value
+            else:
+                transformed[key] = value(entry, kwargs)
+        return transformed
+    return compiled
+
+def compile_transformers(transformers: list):
+    return CompiledTransformers(transformers, _plan(transformers))
+
+# A transformer list plus one function doing all of its work without the
+# per entry dispatch through partials
+class CompiledTransformers(list):
+    def __init__(self, transformers: list, compiled) -> None:
+        super().__init__(transformers)
+        self.compiled = compiled
+
+    def __reduce__(self):
+        # the plan is made of closures, so recompile instead
+        return compile_transformers, (list(self),)
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import threading
+
+from .ledger import drop_torn_write
+
+# Append only log of submissions that failed to transform, keyed by asset
+# uid and submission _id, so they can be rerun once the transformer is fixed
+class DeadLetterStore(object):
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.content = {}
+        if os.path.exists(path):
+            with open(path, "r") as fh:
+                for line in fh:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        # a write torn by a crash
+                        continue
+                    self._apply(event)
+            drop_torn_write(path)
+        self.fh = open(path, "a")
+
+    @staticmethod
+    def key(uid: str, entry: dict) -> str:
+        # a submission without an _id is known by its content instead
+        _id = entry.get("_id")
+        if _id is None:
+            _id = "sha256:" + hashlib.sha256(
+                json.dumps(entry, sort_keys=True, default=str).encode()
+            ).hexdigest()
+        return f"{uid}/{_id}"
+
+    def _apply(self, event: dict) -> None:
+        # logs from before letters had a key were keyed by _id alone
+        key = event["key"] if "key" in event else f"None/{event['_id']}"
+        if event["step"] == "failed":
+            self.content[key] = {
+                "uid": event.get("uid"),
+                "_id": event["entry"].get("_id"),
+                "entry": event["entry"],
+                "transformer": event["transformer"],
+                "traceback": event["traceback"]
+            }
+        elif event["step"] == "resolved":
+            self.content.pop(key, None)
+
+    def _record(self, event: dict) -> None:
+        with self.lock:
+            self._apply(event)
+            self.fh.write(json.dumps(event) + "\n")
+            self.fh.flush()
+
+    def add(self, failure, uid: str=None) -> None:
+        # failure is a buggy.transform.TransformFailure
+        self._record({
+            "step": "failed",
+            "key": self.key(uid, failure.entry),
+            "uid": uid,
+            "_id": failure.entry.get("_id"),
+            "entry": failure.entry,
+            "transformer": failure.transformer,
+            "traceback": failure.traceback
+        })
+
+    def resolve(self, key: str) -> None:
+        self._record({"step": "resolved", "key": key})
+
+    def get(self, key: str) -> dict:
+        with self.lock:
+            return self.content.get(key)
+
+    def failures(self) -> list:
+        with self.lock:
+            return [dict(letter, key=key) for key, letter in self.content.items()]
+
+    def __len__(self) -> int:
+        return len(self.content)
+
+    def compact(self) -> None:
+        # rewrite the log with only the outstanding failures
+        with self.lock:
+            self.fh.close()
+            with open(self.path + ".tmp", "w") as fh:
+                for key, letter in self.content.items():
+                    fh.write(json.dumps(dict(letter, step="failed", key=key)) + "\n")
+            os.replace(self.path + ".tmp", self.path)
+            self.fh = open(self.path, "a")
+
+    def close(self) -> None:
+        with self.lock:
+            self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
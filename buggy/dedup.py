@@ -0,0 +1,113 @@
+import math
+
+from datetime import datetime, timezone
+
+from .ledger import UploadLedger
+
+EARTH_RADIUS = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+def _timestamp(ts) -> float:
+    if ts is None:
+        return None
+    if isinstance(ts, (int, float)):
+        return float(ts)
+    try:
+        moment = datetime.fromisoformat(ts)
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+def _distance(latitude_a: float, longitude_a: float, latitude_b: float, longitude_b: float) -> float:
+    # haversine, in meters
+    phi_a, phi_b = math.radians(latitude_a), math.radians(latitude_b)
+    d_phi = phi_b - phi_a
+    d_lambda = math.radians(longitude_b - longitude_a)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi_a) * math.cos(phi_b) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+# Grid of observations bucketed by taxa and time window. Two observations of
+# the same taxa within window seconds of each other are duplicates when they
+# are closer than distance plus accuracy_scale times each one's positional
+# accuracy. Every observation is filed under the cells its own accuracy
+# covers and a lookup only visits the cells its own reach covers, so a
+# lookup costs the same however many observations are indexed.
+class DuplicateIndex(object):
+    def __init__(self, distance: float=10.0, window: float=3600.0, accuracy_scale: float=1.0, max_accuracy: float=250.0, cell_size: float=50.0) -> None:
+        self.distance = distance
+        self.window = window
+        self.accuracy_scale = accuracy_scale
+        self.max_accuracy = max_accuracy
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def _point(self, record: dict) -> tuple:
+        latitude, longitude = record.get('latitude'), record.get('longitude')
+        timestamp = _timestamp(record.get('ts'))
+        if latitude is None or longitude is None or timestamp is None or record.get('taxa') is None:
+            return None
+        accuracy = min(record.get('positional_accuracy') or 0.0, self.max_accuracy)
+        return latitude, longitude, timestamp, self.accuracy_scale * accuracy
+
+    def _cells(self, latitude: float, longitude: float, reach: float):
+        # cells are cell_size meters tall, and wide at the latitude of their
+        # row so that a row's cell boundaries only depend on longitude
+        y = latitude * METERS_PER_DEGREE
+        for cell_y in range(math.floor((y - reach) / self.cell_size), math.floor((y + reach) / self.cell_size) + 1):
+            row_latitude = (cell_y + 0.5) * self.cell_size / METERS_PER_DEGREE
+            x = longitude * METERS_PER_DEGREE * math.cos(math.radians(row_latitude))
+            for cell_x in range(math.floor((x - reach) / self.cell_size), math.floor((x + reach) / self.cell_size) + 1):
+                yield cell_y, cell_x
+
+    def add(self, record: dict, reference) -> None:
+        point = self._point(record)
+        if point is None:
+            return
+        latitude, longitude, timestamp, reach = point
+        bucket = (record['taxa'], math.floor(timestamp / self.window))
+        # a cell's worth of slack for the grid bending with latitude
+        for cell in self._cells(latitude, longitude, reach + self.cell_size):
+            self.cells.setdefault(bucket + cell, []).append((point, reference))
+
+    def find(self, record: dict, exclude=None):
+        # the reference of an indexed duplicate of record, or None
+        point = self._point(record)
+        if point is None:
+            return None
+        latitude, longitude, timestamp, reach = point
+        bucket = math.floor(timestamp / self.window)
+        cells = list(self._cells(latitude, longitude, self.distance + reach))
+        for time_bucket in (bucket - 1, bucket, bucket + 1):
+            for cell in cells:
+                for other, reference in self.cells.get((record['taxa'], time_bucket) + cell, ()):
+                    if reference == exclude:
+                        continue
+                    if abs(other[2] - timestamp) > self.window:
+                        continue
+                    if _distance(latitude, longitude, other[0], other[1]) <= self.distance + reach + other[3]:
+                        return reference
+        return None
+
+    def add_history(self, ledger: UploadLedger) -> None:
+        # observations uploaded by earlier runs count as well
+        for observation in ledger.observations():
+            self.add(observation, (observation['uid'], observation['instance']))
+
+def deduplicate(records, uid: str, index: DuplicateIndex, drop: bool=True):
+    # yields the records that are not duplicates of one already seen (or
+    # uploaded); with drop=False duplicates are yielded too, marked with
+    # duplicate_of = [uid, instance] of the earlier one and is_valid False
+    for record in records:
+        if not record.get('is_valid', True):
+            # never uploaded, so never anyone's original either
+            yield record
+            continue
+        reference = (uid, record.get('instance'))
+        duplicate_of = index.find(record, exclude=reference)
+        if duplicate_of is None:
+            index.add(record, reference)
+            yield record
+        elif not drop:
+            yield dict(record, duplicate_of=list(duplicate_of), is_valid=False)
@@ -1,39 +1,232 @@
 import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
 
-from random import choice
+from random import randrange, sample
+
+from .. import instrument
 
 ALPHA = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
 NUMERIC = "0123456789"
 
+ALL_IDS = [
+    a + b + c + d
+    for a in ALPHA
+    for b in ALPHA
+    for c in NUMERIC
+    for d in NUMERIC
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS identifiers (
+    user_kobo_id TEXT PRIMARY KEY,
+    code TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS imports (
+    source TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS leases (
+    code TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    leased_at REAL NOT NULL
+);
+"""
+
+# leases left behind by a process that died without closing are handed out
+# again after this long
+LEASE_TTL = 24 * 60 * 60
+
+def sqlite_path(db: str) -> str:
+    # legacy db.json files are imported once into db.sqlite next to them
+    # and never written again, db.sqlite is the only up to date copy
+    if db.endswith(".json"):
+        return os.path.splitext(db)[0] + ".sqlite"
+    return db
+
 # Four digit, Alpha Numeric Identifier
 class FANIdentifier(object):
-    def __init__(self, db: str) -> None:
+    # With a lease_size, several processes can share one database: each
+    # leases a block of free codes at a time and hands them out itself,
+    # returning whatever is left on close
+    def __init__(self, db: str, lease_size: int=None, lease_ttl: float=LEASE_TTL) -> None:
         self.db = db
-        with open(db, "r") as fh:
-            self.db_content = json.load(fh)
+        self.lock = threading.RLock()
+        self.lease_size = lease_size
+        self.lease_ttl = lease_ttl
+        self.holder = uuid.uuid4().hex
+        self.leased = []
+        if db.endswith(".json") and not os.path.exists(db) and not os.path.exists(sqlite_path(db)):
+            # most likely the wrong directory, rather than a new database
+            # whose codes could clash with those in the real one
+            raise FileNotFoundError(f"no identifier database at {db}")
+        self.connection = sqlite3.connect(sqlite_path(db), timeout=60, check_same_thread=False)
+        if lease_size:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        if db.endswith(".json"):
+            self._import_json(db)
+        self.db_content = dict(self.connection.execute(
+            "SELECT user_kobo_id, code FROM identifiers"
+        ))
+        if lease_size:
+            # codes are only ever claimed from our own leased block
+            self.free_ids = self.leased
+        else:
+            claimed_ids = set(self.db_content.values())
+            self.free_ids = [code for code in ALL_IDS if code not in claimed_ids]
+
+    def _import_json(self, db: str) -> None:
+        source = os.path.abspath(db)
+        with self.connection:
+            imported = self.connection.execute(
+                "SELECT 1 FROM imports WHERE source = ?", (source,)
+            ).fetchone()
+            if imported or not os.path.exists(db):
+                return
+            with open(db, "r") as fh:
+                content = json.load(fh)
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO identifiers (user_kobo_id, code) VALUES (?, ?)",
+                sorted(content.items())
+            )
+            self.connection.execute("INSERT INTO imports (source) VALUES (?)", (source,))
 
     def _check_for_user(self, user_kobo_id: str) -> bool:
-        return user_kobo_id in self.db_content
+        if user_kobo_id in self.db_content:
+            return True
+        if not self.lease_size:
+            return False
+        # another process may have added them since we loaded
+        row = self.connection.execute(
+            "SELECT code FROM identifiers WHERE user_kobo_id = ?", (user_kobo_id,)
+        ).fetchone()
+        if row is None:
+            return False
+        self.db_content[user_kobo_id] = row[0]
+        return True
+
+    def _lease(self) -> None:
+        # the write lock is held from the first read, so two processes can
+        # never lease the same code. Inside get_identifiers the lease commits
+        # with the users it is for
+        if not self.connection.in_transaction:
+            self.connection.execute("BEGIN IMMEDIATE")
+        self.connection.execute(
+            "DELETE FROM leases WHERE leased_at < ?", (time.time() - self.lease_ttl,)
+        )
+        taken = {code for code, in self.connection.execute(
+            "SELECT code FROM identifiers UNION ALL SELECT code FROM leases"
+        )}
+        free_ids = [code for code in ALL_IDS if code not in taken]
+        block = sample(free_ids, min(self.lease_size, len(free_ids)))
+        self.connection.executemany(
+            "INSERT INTO leases (code, holder, leased_at) VALUES (?, ?, ?)",
+            [(code, self.holder, time.time()) for code in block]
+        )
+        self.leased.extend(block)
+        instrument.count("identifier.leased", len(block))
+
+    def _claim_id(self) -> str:
+        if self.lease_size and not self.leased:
+            self._lease()
+        # swap a random free id to the end and pop it, constant time however
+        # full the id space is
+        if not self.free_ids:
+            raise RuntimeError("all identifiers have been claimed")
+        i = randrange(len(self.free_ids))
+        self.free_ids[i], self.free_ids[-1] = self.free_ids[-1], self.free_ids[i]
+        return self.free_ids.pop()
+
+    def _insert_user(self, user_kobo_id: str) -> str:
+        # returns the new code, None if the user turned out to exist already
+        while True:
+            proposed_id = self._claim_id()
+            try:
+                self.connection.execute(
+                    "INSERT INTO identifiers (user_kobo_id, code) VALUES (?, ?)",
+                    (user_kobo_id, proposed_id)
+                )
+            except sqlite3.IntegrityError:
+                if not self.lease_size:
+                    self.free_ids.append(proposed_id)
+                    raise
+                # either another process added this user first, or our lease
+                # on the code expired and it went to someone else
+                if self._check_for_user(user_kobo_id):
+                    self.leased.append(proposed_id)
+                    return None
+                self.connection.execute(
+                    "DELETE FROM leases WHERE code = ? AND holder = ?", (proposed_id, self.holder)
+                )
+                continue
+            except Exception:
+                self.free_ids.append(proposed_id)
+                raise
+            if self.lease_size:
+                self.connection.execute("DELETE FROM leases WHERE code = ?", (proposed_id,))
+            return proposed_id
+
+    def _add_users(self, user_kobo_ids: list) -> None:
+        # new users are added in a single transaction and only reach
+        # db_content once it commits; if it rolls back their codes are free
+        # again, and so are the leases as they were before it, without any
+        # taken inside it
+        added = {}
+        leased = list(self.leased)
+        try:
+            with self.connection:
+                for user_kobo_id in user_kobo_ids:
+                    if user_kobo_id in added or self._check_for_user(user_kobo_id):
+                        continue
+                    code = self._insert_user(user_kobo_id)
+                    if code is not None:
+                        added[user_kobo_id] = code
+        except BaseException:
+            if self.lease_size:
+                self.leased[:] = leased
+            else:
+                self.free_ids.extend(added.values())
+            raise
+        self.db_content.update(added)
 
     def _add_user(self, user_kobo_id: str) -> None:
-        claimed_ids = set(self.db_content.values())
-        already_claimed = True
-        while already_claimed:
-            proposed_id = ''.join([
-                choice(ALPHA),
-                choice(ALPHA),
-                choice(NUMERIC),
-                choice(NUMERIC)
-            ])
-            already_claimed = proposed_id in claimed_ids
-        self.db_content[user_kobo_id] = proposed_id
-        with open(self.db, 'w') as fh:
-            json.dump(self.db_content, fh, sort_keys=True, indent=4)
+        with instrument.timer("identifier.add_user"), self.lock:
+            self._add_users([user_kobo_id])
 
     def _get_identifier(self, user_kobo_id: str) -> str:
         return self.db_content[user_kobo_id]
 
     def get_identifier(self, user_kobo_id: str) -> str:
-        if not self._check_for_user(user_kobo_id):
-            self._add_user(user_kobo_id)
-        return self._get_identifier(user_kobo_id)
+        with self.lock:
+            if not self._check_for_user(user_kobo_id):
+                self._add_user(user_kobo_id)
+            return self._get_identifier(user_kobo_id)
+
+    def get_identifiers(self, user_kobo_ids: list) -> list:
+        with instrument.timer("identifier.get_identifiers"), self.lock:
+            self._add_users(user_kobo_ids)
+            return [self._get_identifier(user_kobo_id) for user_kobo_id in user_kobo_ids]
+
+    def fingerprint(self) -> str:
+        # transform results cached with one database are not served with another
+        return os.path.abspath(sqlite_path(self.db))
+
+    def release(self) -> None:
+        # hand unused leased codes back to the other processes
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM leases WHERE holder = ?", (self.holder,))
+            del self.leased[:]
+
+    def close(self) -> None:
+        if self.lease_size:
+            self.release()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
@@ -2,12 +2,25 @@ import unittest
 import os
 import json
 
+from concurrent.futures import ProcessPoolExecutor
 from time import time
+from unittest import mock
 
 from ..identifier import (
-    FANIdentifier
+    ALL_IDS,
+    FANIdentifier,
+    sqlite_path
 )
 
+def lease_codes(db, users):
+    with FANIdentifier(db, lease_size=16) as identifier:
+        return [identifier.get_identifier(user) for user in users[:50]] + identifier.get_identifiers(users)
+
+def remove_db(db):
+    for path in [db, sqlite_path(db)]:
+        if os.path.exists(path):
+            os.remove(path)
+
 class TestFANIdentifier(unittest.TestCase):
     def test_check_user(self):
         db = f"db_{int(time())}.json"
@@ -21,9 +34,9 @@ class TestFANIdentifier(unittest.TestCase):
             identifier = FANIdentifier(db)
             assert identifier._check_for_user("garlicbread@geemail.com")
             assert not identifier._check_for_user("garlicknots@geemail.com")
-            os.remove(db)
+            remove_db(db)
         except Exception as e:
-            os.remove(db)
+            remove_db(db)
             raise e
 
     def test_add_user(self):
@@ -37,12 +50,11 @@ class TestFANIdentifier(unittest.TestCase):
         try:
             identifier = FANIdentifier(db)
             identifier._add_user("garlicknots@geemail.com")
-            with open(db, 'r') as fh:
-                content = json.load(fh)
+            content = FANIdentifier(db).db_content
             assert "garlicknots@geemail.com" in content
-            os.remove(db)
+            remove_db(db)
         except Exception as e:
-            os.remove(db)
+            remove_db(db)
             raise e
 
     def test_get_identifier(self):
@@ -56,7 +68,203 @@ class TestFANIdentifier(unittest.TestCase):
         try:
             identifier = FANIdentifier(db)
             assert identifier._get_identifier("garlicbread@geemail.com") == 'AX12'
-            os.remove(db)
+            remove_db(db)
+        except Exception as e:
+            remove_db(db)
+            raise e
+
+    def test_json_imported_once(self):
+        db = f"db_{int(time())}.json"
+        with open(db, "w") as fh:
+            json.dump(
+                {"garlicbread@geemail.com": "AX12"},
+                fh
+            )
+
+        try:
+            identifier = FANIdentifier(db)
+            identifier.get_identifier("garlicknots@geemail.com")
+            identifier.close()
+
+            with open(db, "w") as fh:
+                json.dump({"garlicbread@geemail.com": "ZZ99"}, fh)
+
+            identifier = FANIdentifier(db)
+            assert identifier.get_identifier("garlicbread@geemail.com") == "AX12"
+            assert "garlicknots@geemail.com" in identifier.db_content
+            identifier.close()
+            remove_db(db)
         except Exception as e:
-            os.remove(db)
+            remove_db(db)
             raise e
+
+    def test_get_identifiers(self):
+        db = f"db_{int(time())}.json"
+        with open(db, "w") as fh:
+            json.dump(
+                {"garlicbread@geemail.com": "AX12"},
+                fh
+            )
+
+        try:
+            identifier = FANIdentifier(db)
+            users = [f"volunteer{i}@geemail.com" for i in range(500)]
+            codes = identifier.get_identifiers(["garlicbread@geemail.com"] + users + users[:10])
+            assert codes[0] == "AX12"
+            assert len(set(codes[1:501])) == 500
+            assert "AX12" not in codes[1:]
+            assert codes[501:] == codes[1:11]
+            assert codes[1:] == [identifier.get_identifier(user) for user in users + users[:10]]
+            identifier.close()
+            remove_db(db)
+        except Exception as e:
+            remove_db(db)
+            raise e
+
+    def test_codes_exhausted(self):
+        db = f"db_{int(time())}.sqlite"
+
+        try:
+            identifier = FANIdentifier(db)
+            identifier.free_ids = identifier.free_ids[:2]
+            identifier.get_identifiers(["a", "b"])
+            assert sorted(identifier.db_content.values()) == sorted(
+                FANIdentifier(db).db_content.values()
+            )
+            with self.assertRaises(RuntimeError):
+                identifier.get_identifier("c")
+            identifier.close()
+            remove_db(db)
+        except Exception as e:
+            remove_db(db)
+            raise e
+
+    def test_missing_json_raises(self):
+        db = f"db_{int(time())}_missing.json"
+        with self.assertRaises(FileNotFoundError):
+            FANIdentifier(db)
+        assert not os.path.exists(sqlite_path(db))
+
+    def test_failed_batch_leaves_nothing_behind(self):
+        db = f"db_{int(time())}.sqlite"
+
+        try:
+            identifier = FANIdentifier(db)
+            identifier.free_ids = identifier.free_ids[:2]
+            with self.assertRaises(RuntimeError):
+                identifier.get_identifiers(["a", "b", "c"])
+            assert identifier.db_content == {}
+            assert FANIdentifier(db).db_content == {}
+            assert len(identifier.free_ids) == 2
+            assert len(set(identifier.get_identifiers(["a", "b"]))) == 2
+            identifier.close()
+            remove_db(db)
+        except Exception as e:
+            remove_db(db)
+            raise e
+
+class TestLeasedFANIdentifier(unittest.TestCase):
+    def setUp(self):
+        self.db = f"db_{int(time())}_leased.sqlite"
+
+    def tearDown(self):
+        for suffix in ["", "-wal", "-shm"]:
+            remove_db(self.db + suffix)
+
+    def test_leases_returned_on_close(self):
+        identifier = FANIdentifier(self.db, lease_size=10)
+        code = identifier.get_identifier("garlicbread@geemail.com")
+        assert len(identifier.leased) == 9
+        leases = identifier.connection.execute("SELECT code FROM leases").fetchall()
+        assert code not in [row[0] for row in leases]
+        assert len(leases) == 9
+        identifier.close()
+
+        identifier = FANIdentifier(self.db, lease_size=10)
+        assert identifier.connection.execute("SELECT COUNT(*) FROM leases").fetchone()[0] == 0
+        assert identifier.get_identifier("garlicbread@geemail.com") == code
+        identifier.close()
+
+    def test_failed_batch_drops_its_leases(self):
+        identifier = FANIdentifier(self.db, lease_size=2)
+        identifier.get_identifier("a")
+        leased = list(identifier.leased)
+        check_for_user = identifier._check_for_user
+
+        def fail_on_d(user_kobo_id):
+            if user_kobo_id == "d":
+                raise RuntimeError("interrupted")
+            return check_for_user(user_kobo_id)
+
+        # "c" takes a new lease inside the batch, which then rolls back
+        with mock.patch.object(identifier, "_check_for_user", side_effect=fail_on_d):
+            with self.assertRaises(RuntimeError):
+                identifier.get_identifiers(["b", "c", "d"])
+        assert identifier.leased == leased
+        assert identifier.free_ids is identifier.leased
+        held = identifier.connection.execute("SELECT code FROM leases").fetchall()
+        assert [code for code, in held] == leased
+        assert set(identifier.db_content) == {"a"}
+
+        codes = identifier.get_identifiers(["a", "b", "c", "d"])
+        assert len(set(codes)) == 4
+        identifier.close()
+
+    def test_sees_users_added_elsewhere(self):
+        first = FANIdentifier(self.db, lease_size=10)
+        second = FANIdentifier(self.db, lease_size=10)
+        code = first.get_identifier("garlicbread@geemail.com")
+        assert second.get_identifier("garlicbread@geemail.com") == code
+        assert second.get_identifiers(["garlicbread@geemail.com", "garlicknots@geemail.com"])[0] == code
+        assert not set(first.leased) & set(second.leased)
+        first.close()
+        second.close()
+
+    def test_expired_lease_is_not_reused(self):
+        first = FANIdentifier(self.db, lease_size=1)
+        with first.connection:
+            first._lease()
+        code = first.leased[0]
+        # the lease expired and another process gave the code out
+        second = FANIdentifier(self.db, lease_size=1, lease_ttl=0)
+        with second.connection:
+            second.connection.execute("DELETE FROM leases")
+            second.connection.execute(
+                "INSERT INTO identifiers (user_kobo_id, code) VALUES (?, ?)",
+                ("garlicbread@geemail.com", code)
+            )
+        assert first.get_identifier("garlicknots@geemail.com") != code
+        assert first.get_identifier("garlicbread@geemail.com") == code
+        first.close()
+        second.close()
+
+    def test_codes_exhausted(self):
+        identifier = FANIdentifier(self.db, lease_size=10)
+        with identifier.connection:
+            identifier.connection.executemany(
+                "INSERT INTO identifiers (user_kobo_id, code) VALUES (?, ?)",
+                [(code, code) for code in ALL_IDS[2:]]
+            )
+        identifier.get_identifiers(["a", "b"])
+        with self.assertRaises(RuntimeError):
+            identifier.get_identifier("c")
+        identifier.close()
+
+    def test_parallel_workers_never_share_codes(self):
+        users = [f"volunteer{i}@geemail.com" for i in range(300)]
+        # every worker sees the users in a different order
+        orders = [users[i::7] + users for i in range(6)]
+        with ProcessPoolExecutor(6) as executor:
+            results = list(executor.map(lease_codes, [self.db] * len(orders), orders))
+
+        assigned = {}
+        for order, codes in zip(orders, results):
+            for user, code in zip(order[:50] + order, codes):
+                assert assigned.setdefault(user, code) == code
+        assert len(assigned) == 300
+        assert len(set(assigned.values())) == 300
+
+        identifier = FANIdentifier(self.db)
+        assert identifier.db_content == assigned
+        assert identifier.connection.execute("SELECT COUNT(*) FROM leases").fetchone()[0] == 0
+        identifier.close()
@@ -0,0 +1,83 @@
+import os
+
+import requests
+
+from . import instrument
+from .ratelimit import Scheduler
+from .session import make_session
+
+INATURALIST_URL = "https://www.inaturalist.org"
+INATURALIST_API_URL = "https://api.inaturalist.org/v1"
+
+class iNaturalist(object):
+    def __init__(self, client_id: str, client_secret: str, username: str, password: str, url: str=INATURALIST_URL, api_url: str=INATURALIST_API_URL, session: requests.Session=None, scheduler: Scheduler=None) -> None:
+        self.api_url = api_url
+        self.session = session if session is not None else make_session()
+        self.scheduler = scheduler
+        self.headers = {}
+        response = self._request(
+            "POST", f"{url}/oauth/token", "inaturalist.auth",
+            data={
+                "client_id": client_id,
+                "client_secret": client_secret,
+                "grant_type": "password",
+                "username": username,
+                "password": password
+            }
+        )
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        response = self._request("GET", f"{url}/users/api_token", "inaturalist.auth")
+        self.headers = {"Authorization": response.json()["api_token"]}
+
+    def _request(self, method: str, url: str, endpoint: str, **kwargs) -> requests.Response:
+        with instrument.timer(endpoint):
+            if self.scheduler is None:
+                response = self.session.request(method, url, headers=self.headers, **kwargs)
+            else:
+                response = self.scheduler.request(
+                    self.session, method, url, endpoint,
+                    headers=self.headers, **kwargs
+                )
+            response.raise_for_status()
+        return response
+
+    def _post(self, path: str, **kwargs) -> requests.Response:
+        return self._request("POST", f"{self.api_url}/{path}", f"inaturalist.{path}", **kwargs)
+
+    def upload_base_observation(self, taxa: int, longitude: float, latitude: float, ts: str, positional_accuracy: float, notes: str, observation_fields: dict=None) -> int:
+        observation = {
+            "taxon_id": taxa,
+            "longitude": longitude,
+            "latitude": latitude,
+            "observed_on_string": ts,
+            "positional_accuracy": positional_accuracy,
+            "description": notes
+        }
+        if observation_fields:
+            # created along with the observation instead of one call each
+            observation["observation_field_values_attributes"] = [
+                {"observation_field_id": int(field_id), "value": value}
+                for field_id, value in observation_fields.items()
+            ]
+        response = self._post("observations", json={"observation": observation})
+        return response.json()["id"]
+
+    def attach_image(self, observation_id: int, image, filename: str=None) -> None:
+        # image is either a path or a readable binary buffer
+        if isinstance(image, str):
+            with open(image, "rb") as fh:
+                return self.attach_image(observation_id, fh, filename or os.path.basename(image))
+        self._post(
+            "observation_photos",
+            data={"observation_photo[observation_id]": observation_id},
+            files={"file": (filename or "image", image)}
+        )
+
+    def attach_observation_field(self, observation_id: int, field_id: int, value) -> None:
+        self._post("observation_field_values", json={
+            "observation_field_value": {
+                "observation_id": observation_id,
+                "observation_field_id": field_id,
+                "value": value
+            }
+        })
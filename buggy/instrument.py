@@ -0,0 +1,141 @@
+import json
+import threading
+
+from time import perf_counter
+
+# The Instrumentation collecting timings right now, None when disabled.
+# Every hook checks this first so a disabled run pays for one comparison.
+ACTIVE = None
+
+class _Timer(object):
+    __slots__ = ["instrumentation", "name", "start"]
+
+    def __init__(self, instrumentation, name: str) -> None:
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.instrumentation.record(self.name, perf_counter() - self.start)
+        if exc_type is not None:
+            self.instrumentation.count(f"{self.name}.failed")
+
+class _NullTimer(object):
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+NULL_TIMER = _NullTimer()
+
+class Instrumentation(object):
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.counters = {}
+
+    def record(self, name: str, seconds: float) -> None:
+        with self.lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                self.timings[name] = [1, seconds, seconds]
+            else:
+                timing[0] += 1
+                timing[1] += seconds
+                timing[2] = max(timing[2], seconds)
+
+    def count(self, name: str, amount: int=1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def timer(self, name: str) -> _Timer:
+        return _Timer(self, name)
+
+    def report(self) -> dict:
+        with self.lock:
+            return {
+                "timings": {
+                    name: {"calls": calls, "seconds": total, "max_seconds": longest}
+                    for name, (calls, total, longest) in sorted(self.timings.items())
+                },
+                "counters": dict(sorted(self.counters.items()))
+            }
+
+    def summary(self) -> str:
+        report = self.report()
+        lines = [f"{'phase':<60} {'calls':>8} {'seconds':>10} {'mean ms':>9} {'max ms':>9}"]
+        for name, timing in sorted(report["timings"].items(), key=lambda item: -item[1]["seconds"]):
+            lines.append(
+                f"{name:<60} {timing['calls']:>8} {timing['seconds']:>10.3f} "
+                f"{1000 * timing['seconds'] / timing['calls']:>9.2f} {1000 * timing['max_seconds']:>9.2f}"
+            )
+        for name, value in report["counters"].items():
+            lines.append(f"{name:<60} {value:>8}")
+        return "\n".join(lines)
+
+    def to_json(self, path: str) -> None:
+        with open(path, "w") as fh:
+            json.dump(self.report(), fh, sort_keys=True, indent=4)
+
+    def to_prometheus(self, path: str) -> None:
+        # text exposition format, e.g. for the node exporter textfile collector
+        report = self.report()
+        lines = [
+            "# HELP buggy_phase_seconds_total Time spent in each phase.",
+            "# TYPE buggy_phase_seconds_total counter"
+        ]
+        lines += [
+            f'buggy_phase_seconds_total{{phase="{name}"}} {timing["seconds"]}'
+            for name, timing in report["timings"].items()
+        ]
+        lines += [
+            "# HELP buggy_phase_calls_total Number of times each phase ran.",
+            "# TYPE buggy_phase_calls_total counter"
+        ]
+        lines += [
+            f'buggy_phase_calls_total{{phase="{name}"}} {timing["calls"]}'
+            for name, timing in report["timings"].items()
+        ]
+        lines += [
+            "# HELP buggy_phase_max_seconds Longest single run of each phase.",
+            "# TYPE buggy_phase_max_seconds gauge"
+        ]
+        lines += [
+            f'buggy_phase_max_seconds{{phase="{name}"}} {timing["max_seconds"]}'
+            for name, timing in report["timings"].items()
+        ]
+        lines += [
+            "# HELP buggy_events_total Failures and bytes moved.",
+            "# TYPE buggy_events_total counter"
+        ]
+        lines += [
+            f'buggy_events_total{{name="{name}"}} {value}'
+            for name, value in report["counters"].items()
+        ]
+        with open(path, "w") as fh:
+            fh.write("\n".join(lines) + "\n")
+
+def enable() -> Instrumentation:
+    global ACTIVE
+    ACTIVE = Instrumentation()
+    return ACTIVE
+
+def disable() -> Instrumentation:
+    global ACTIVE
+    instrumentation, ACTIVE = ACTIVE, None
+    return instrumentation
+
+def timer(name: str):
+    if ACTIVE is None:
+        return NULL_TIMER
+    return ACTIVE.timer(name)
+
+def count(name: str, amount: int=1) -> None:
+    if ACTIVE is not None:
+        ACTIVE.count(name, amount)
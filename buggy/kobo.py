@@ -0,0 +1,104 @@
+import json
+
+from tempfile import SpooledTemporaryFile
+
+import requests
+
+from . import instrument
+from .ratelimit import Scheduler
+from .session import make_session
+
+KOBO_URL = "https://kf.kobotoolbox.org"
+
+# images larger than this spill from memory to a temporary file
+MAX_IMAGE_MEMORY = 16 * 1024 * 1024
+
+class Kobo(object):
+    def __init__(self, username: str, password: str, url: str=KOBO_URL, session: requests.Session=None, scheduler: Scheduler=None) -> None:
+        self.url = url
+        self.session = session if session is not None else make_session()
+        self.scheduler = scheduler
+        self.headers = {}
+        response = self._get(
+            f"{url}/token?format=json", "kobo.token",
+            auth=(username, password)
+        )
+        self.headers = {"Authorization": f"Token {response.json()['token']}"}
+
+    def _get(self, url: str, endpoint: str, **kwargs) -> requests.Response:
+        with instrument.timer(endpoint):
+            if self.scheduler is None:
+                response = self.session.get(url, headers=self.headers, **kwargs)
+            else:
+                response = self.scheduler.request(
+                    self.session, "GET", url, endpoint,
+                    headers=self.headers, **kwargs
+                )
+            response.raise_for_status()
+        if not kwargs.get("stream"):
+            instrument.count(f"{endpoint}.bytes", len(response.content))
+        return response
+
+    def pull_page(self, uid: str, query: dict=None, fields: list=None, sort: dict=None, start: int=0, limit: int=None) -> dict:
+        params = {}
+        if query is not None:
+            params["query"] = json.dumps(query)
+        if fields is not None:
+            params["fields"] = json.dumps(fields)
+        if sort is not None:
+            params["sort"] = json.dumps(sort)
+        if start:
+            params["start"] = start
+        if limit is not None:
+            params["limit"] = limit
+        return self._get(
+            f"{self.url}/api/v2/assets/{uid}/data.json", "kobo.data",
+            params=params
+        ).json()
+
+    def pull_data(self, uid: str, query: dict=None, fields: list=None, sort: dict=None) -> list:
+        page = self.pull_page(uid, query=query, fields=fields, sort=sort)
+        data = page["results"]
+        while page.get("next"):
+            page = self._get(page["next"], "kobo.data").json()
+            data.extend(page["results"])
+        return data
+
+    def iter_data(self, uid: str, page_size: int=1000, query: dict=None, fields: list=None, sort: dict=None):
+        # a stable sort keeps the pages consistent while new submissions arrive
+        sort = sort if sort is not None else {"_id": 1}
+        start = 0
+        while True:
+            page = self.pull_page(
+                uid, query=query, fields=fields, sort=sort,
+                start=start, limit=page_size
+            )
+            yield from page["results"]
+            if not page.get("next") or not page["results"]:
+                return
+            start += len(page["results"])
+
+    def _pull_attachment(self, fh, uid: str, instance: int, image: int) -> None:
+        response = self._get(
+            f"{self.url}/api/v2/assets/{uid}/data/{instance}/attachments/{image}/",
+            "kobo.attachments",
+            stream=True
+        )
+        with instrument.timer("kobo.attachments.download"):
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                fh.write(chunk)
+                instrument.count("kobo.attachments.bytes", len(chunk))
+
+    def pull_image(self, image_path: str, uid: str, instance: int, image: int) -> None:
+        with open(image_path, "wb") as fh:
+            self._pull_attachment(fh, uid, instance, image)
+
+    def open_image(self, uid: str, instance: int, image: int, max_memory: int=MAX_IMAGE_MEMORY) -> SpooledTemporaryFile:
+        fh = SpooledTemporaryFile(max_size=max_memory)
+        try:
+            self._pull_attachment(fh, uid, instance, image)
+        except BaseException:
+            fh.close()
+            raise
+        fh.seek(0)
+        return fh
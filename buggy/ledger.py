@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+
+def drop_torn_write(path: str) -> None:
+    # cut a line left unfinished by a crash off the end of a JSONL log, so
+    # the next event is not appended onto it
+    with open(path, "rb+") as fh:
+        end = fh.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - 4096)
+            fh.seek(start)
+            chunk = fh.read(position - start)
+            newline = chunk.rfind(b"\n")
+            if newline != -1:
+                position = start + newline + 1
+                break
+            position = start
+        if position != end:
+            fh.truncate(position)
+
+# Append only log of upload steps keyed by (asset uid, instance)
+class UploadLedger(object):
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.content = {}
+        # where, when and what each observation was, for duplicate checks
+        self.points = {}
+        if os.path.exists(path):
+            with open(path, "r") as fh:
+                for line in fh:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        # a write torn by a crash, the step simply gets redone
+                        continue
+                    self._apply(event)
+            drop_torn_write(path)
+        self.fh = open(path, "a")
+
+    @staticmethod
+    def _key(uid: str, instance: int) -> str:
+        return f"{uid}/{instance}"
+
+    def _apply(self, event: dict) -> None:
+        entry = self.content.setdefault(
+            self._key(event["uid"], event["instance"]),
+            {"observation_id": None, "images": set(), "fields": set()}
+        )
+        if event["step"] == "observation":
+            entry["observation_id"] = event["value"]
+            if event.get("point") is not None:
+                self.points[(event["uid"], event["instance"])] = (event["value"], event["point"])
+        elif event["step"] == "image":
+            entry["images"].add(event["value"])
+        elif event["step"] == "field":
+            entry["fields"].add(event["value"])
+
+    def _record(self, uid: str, instance: int, step: str, value, **extra) -> None:
+        event = {"uid": uid, "instance": instance, "step": step, "value": value, **extra}
+        with self.lock:
+            self._apply(event)
+            self.fh.write(json.dumps(event) + "\n")
+            self.fh.flush()
+
+    def get(self, uid: str, instance: int) -> dict:
+        with self.lock:
+            entry = self.content.get(self._key(uid, instance))
+            if entry is None:
+                return None
+            return {
+                "observation_id": entry["observation_id"],
+                "images": set(entry["images"]),
+                "fields": set(entry["fields"])
+            }
+
+    def record_observation(self, uid: str, instance: int, observation_id: int, point: dict=None) -> None:
+        # point holds the taxa, latitude, longitude, ts and positional_accuracy
+        if point is None:
+            self._record(uid, instance, "observation", observation_id)
+        else:
+            self._record(uid, instance, "observation", observation_id, point=point)
+
+    def observations(self) -> list:
+        with self.lock:
+            return [
+                dict(point, uid=uid, instance=instance, observation_id=observation_id)
+                for (uid, instance), (observation_id, point) in self.points.items()
+            ]
+
+    def record_image(self, uid: str, instance: int, image: int) -> None:
+        self._record(uid, instance, "image", image)
+
+    def record_field(self, uid: str, instance: int, field_id: int) -> None:
+        self._record(uid, instance, "field", field_id)
+
+    def close(self) -> None:
+        with self.lock:
+            self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
@@ -0,0 +1,86 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from .kobo import Kobo
+from .record import to_observation
+from .transform import transform_data, validation_query
+
+# Stands in for an identifier inside worker processes. The identifier
+# itself keeps state and writes to disk, so workers only record who needs
+# an identifier and the parent hands them out once the chunks come back.
+class DeferredIdentifier(object):
+    @staticmethod
+    def get_identifier(user_kobo_id: str):
+        return DeferredIdentity(user_kobo_id)
+
+class DeferredIdentity(object):
+    __slots__ = ["user_kobo_id"]
+
+    def __init__(self, user_kobo_id: str) -> None:
+        self.user_kobo_id = user_kobo_id
+
+    def __reduce__(self):
+        return DeferredIdentity, (self.user_kobo_id,)
+
+def _find_deferred(value, found: list) -> None:
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        return
+    for key, item in items:
+        if isinstance(item, DeferredIdentity):
+            found.append((value, key, item.user_kobo_id))
+        else:
+            _find_deferred(item, found)
+
+def _resolve(data: list, identifier) -> None:
+    found = []
+    _find_deferred(data, found)
+    users = [user_kobo_id for _, _, user_kobo_id in found]
+    if hasattr(identifier, "get_identifiers"):
+        codes = identifier.get_identifiers(users)
+    else:
+        codes = [identifier.get_identifier(user_kobo_id) for user_kobo_id in users]
+    for (container, key, _), code in zip(found, codes):
+        container[key] = code
+
+def _transform_chunk(chunk: list, transformers: list, kwargs: dict) -> tuple:
+    return transform_data(chunk, transformers, **kwargs)
+
+def parallel_transform_data(data: list, transformers: list, processes: int=None, chunk_size: int=1000, **kwargs) -> tuple:
+    identifier = kwargs.get("identifier")
+    if identifier is not None:
+        kwargs["identifier"] = DeferredIdentifier()
+    # records are made compact here, once their deferred codes are filled in
+    compact = kwargs.pop("compact", False)
+
+    chunks = [data[start:start + chunk_size] for start in range(0, len(data), chunk_size)]
+    transformed_data = []
+    failed = 0
+    with ProcessPoolExecutor(processes) as executor:
+        # map hands the chunks back in input order
+        for transformed, chunk_failed in executor.map(
+            _transform_chunk, chunks, repeat(transformers), repeat(kwargs)
+        ):
+            transformed_data.extend(transformed)
+            failed += chunk_failed
+
+    if identifier is not None:
+        _resolve(transformed_data, identifier)
+    if compact:
+        transformed_data = [to_observation(record) for record in transformed_data]
+    return transformed_data, failed
+
+def pull_and_parallel_transform_data(kobo: Kobo, uid: str, transformers: list, processes: int=None, chunk_size: int=1000, statuses: list=None, fields: list=None, **kwargs) -> tuple:
+    if statuses is None and fields is None:
+        data = kobo.pull_data(uid)
+    else:
+        query = validation_query(statuses) if statuses is not None else None
+        data = kobo.pull_data(uid, query=query, fields=fields)
+    return parallel_transform_data(
+        data, transformers,
+        processes=processes, chunk_size=chunk_size,
+        **kwargs
+    )
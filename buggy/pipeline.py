@@ -0,0 +1,316 @@
+import queue
+import signal
+import statistics
+import threading
+
+from time import perf_counter
+
+from tqdm import tqdm
+
+from . import instrument
+from .cache import ImageCache
+from .deadletter import DeadLetterStore
+from .dedup import DuplicateIndex
+from .inaturalist import iNaturalist
+from .kobo import Kobo
+from .ledger import UploadLedger
+from .transform import instrument_transformers, transform_entry, validation_query
+from .upload import (
+    attach_recorded_field,
+    attach_recorded_image,
+    create_observation,
+    discard_image,
+    image_puller,
+    remaining_uploads
+)
+
+# put on a stage's queue once everything upstream of it has finished
+_DONE = object()
+
+class _Job(object):
+    __slots__ = ["record", "started", "observation_id", "images", "fields", "image_paths", "remaining"]
+
+    def __init__(self, record: dict, started: float) -> None:
+        self.record = record
+        self.started = started
+        self.image_paths = []
+
+def _discard(job: _Job) -> None:
+    # photos pulled for a record that is not going out after all
+    for image_path in job.image_paths:
+        discard_image(image_path)
+
+class _Stage(object):
+    def __init__(self, pipeline, name: str, work, workers: int, inbox: queue.Queue, outbox: queue.Queue) -> None:
+        self.pipeline = pipeline
+        self.name = name
+        self.work = work
+        self.inbox = inbox
+        self.outbox = outbox
+        self.active = workers
+        self.lock = threading.Lock()
+        self.threads = [
+            threading.Thread(target=self._run, name=f"buggy-{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+
+    def _run(self) -> None:
+        while True:
+            item = self.inbox.get()
+            if item is _DONE:
+                # let the other workers of this stage see it too
+                self.inbox.put(_DONE)
+                break
+            try:
+                with instrument.timer(f"pipeline.{self.name}"):
+                    self.work(item)
+            except Exception as error:
+                self.pipeline._failed(error, item)
+        with self.lock:
+            self.active -= 1
+            last = self.active == 0
+        if last and self.outbox is not None:
+            self.outbox.put(_DONE)
+
+# Kobo pull to iNaturalist upload as a chain of stages (page fetch, transform,
+# image prefetch, observation create and attach) with their own workers and
+# bounded queues in between, so records go out while later pages are still
+# downloading. On SIGTERM the pull stops, records that have not been created
+# yet are dropped and those that have are finished; the ledger lets the next
+# run pick up the rest.
+class Pipeline(object):
+    def __init__(self, kobo_client: Kobo, inaturalist_client: iNaturalist, uid: str, transformers: list, page_size: int=1000, query: dict=None, statuses: list=None, fields: list=None, fetch_workers: int=1, transform_workers: int=2, prefetch_workers: int=8, create_workers: int=4, attach_workers: int=16, queue_size: int=64, ledger: UploadLedger=None, in_memory: bool=False, image_cache: ImageCache=None, embed_fields: bool=False, dead_letters: DeadLetterStore=None, duplicates: DuplicateIndex=None, **kwargs) -> None:
+        self.kobo_client = kobo_client
+        self.inaturalist_client = inaturalist_client
+        self.uid = uid
+        self.transformers = transformers
+        self.page_size = page_size
+        self.query = validation_query(statuses, query) if statuses is not None else query
+        self.fields = fields
+        self.ledger = ledger
+        self.pull_image = image_puller(in_memory, image_cache)
+        self.embed_fields = embed_fields
+        self.dead_letters = dead_letters
+        self.duplicates = duplicates
+        self.kwargs = kwargs
+
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.error = None
+        self.progress = None
+        self.counts = {
+            "fetched": 0, "transformed": 0, "failed": 0, "skipped": 0,
+            "uploaded": 0, "dropped": 0
+        }
+        self.latencies = []
+        self.started = None
+        self.first_upload = None
+        # fetch workers take page numbers in turn until one comes back last
+        self.fetch_workers = fetch_workers
+        self.fetching = fetch_workers
+        self.next_page = 0
+        self.last_page = None
+
+        self.transform_queue = queue.Queue(queue_size)
+        self.prefetch_queue = queue.Queue(queue_size)
+        self.create_queue = queue.Queue(queue_size)
+        self.attach_queue = queue.Queue(queue_size * 4)
+        self.stages = [
+            _Stage(self, "transform", self._transform, transform_workers, self.transform_queue, self.prefetch_queue),
+            _Stage(self, "prefetch", self._prefetch, prefetch_workers, self.prefetch_queue, self.create_queue),
+            _Stage(self, "create", self._create, create_workers, self.create_queue, self.attach_queue),
+            _Stage(self, "attach", self._attach, attach_workers, self.attach_queue, None)
+        ]
+
+    def _count(self, name: str, amount: int=1) -> None:
+        with self.lock:
+            self.counts[name] += amount
+
+    def _failed(self, error: Exception, item) -> None:
+        # the first error stops the run, like upload_data
+        with self.lock:
+            if self.error is None:
+                self.error = error
+        self.stopping.set()
+        # attach items close their own photo, a job is dropped with all of its
+        if isinstance(item, _Job):
+            _discard(item)
+
+    def stop(self) -> None:
+        self.stopping.set()
+
+    def _complete(self, job: _Job) -> None:
+        with self.lock:
+            self.counts["uploaded"] += 1
+            self.latencies.append(perf_counter() - job.started)
+            if self.first_upload is None:
+                self.first_upload = perf_counter() - self.started
+        if self.progress is not None:
+            self.progress.update()
+
+    def _next_page(self) -> int:
+        with self.lock:
+            page = self.next_page
+            if self.last_page is not None and page > self.last_page:
+                return None
+            self.next_page += 1
+            return page
+
+    def _fetch(self) -> None:
+        try:
+            while not self.stopping.is_set():
+                page = self._next_page()
+                if page is None:
+                    break
+                with instrument.timer("pipeline.fetch"):
+                    response = self.kobo_client.pull_page(
+                        self.uid, query=self.query, fields=self.fields,
+                        sort={"_id": 1}, start=page * self.page_size,
+                        limit=self.page_size
+                    )
+                if not response.get("next") or not response["results"]:
+                    with self.lock:
+                        if self.last_page is None or page < self.last_page:
+                            self.last_page = page
+                for entry in response["results"]:
+                    if self.stopping.is_set():
+                        break
+                    self._count("fetched")
+                    self.transform_queue.put((entry, perf_counter()))
+        except Exception as error:
+            self._failed(error, None)
+        finally:
+            with self.lock:
+                self.fetching -= 1
+                last = self.fetching == 0
+            if last:
+                self.transform_queue.put(_DONE)
+
+    def _transform(self, item: tuple) -> None:
+        entry, started = item
+        if self.stopping.is_set():
+            self._count("dropped")
+            return
+        record, failure = transform_entry(entry, self.transformers, **self.kwargs)
+        if failure is not None:
+            self._count("failed")
+            if self.dead_letters is not None:
+                self.dead_letters.add(failure, uid=self.uid)
+            return
+        self._count("transformed")
+        if not record['is_valid']:
+            self._count("skipped")
+            return
+        if self.duplicates is not None:
+            reference = (self.uid, record['instance'])
+            with self.lock:
+                duplicate = self.duplicates.find(record, exclude=reference)
+                if duplicate is None:
+                    self.duplicates.add(record, reference)
+            if duplicate is not None:
+                self._count("skipped")
+                return
+        job = _Job(record, started)
+        job.observation_id, job.images, job.fields = remaining_uploads(record, self.uid, self.ledger)
+        if job.observation_id is not None and not job.images and not job.fields:
+            # a previous run already uploaded all of it
+            self._count("skipped")
+            return
+        self.prefetch_queue.put(job)
+
+    def _prefetch(self, job: _Job) -> None:
+        if self.stopping.is_set():
+            self._count("dropped")
+            return
+        for image in job.images:
+            job.image_paths.append(
+                self.pull_image(self.kobo_client, self.uid, job.record['instance'], image)
+            )
+        self.create_queue.put(job)
+
+    def _create(self, job: _Job) -> None:
+        # after an error nothing more goes out, after SIGTERM created
+        # observations are still finished
+        if self.error is not None or (self.stopping.is_set() and job.observation_id is None):
+            self._count("dropped")
+            _discard(job)
+            return
+        if job.observation_id is None:
+            job.observation_id, job.fields = create_observation(
+                job.record, self.uid, self.inaturalist_client, self.ledger,
+                job.fields, self.embed_fields
+            )
+        job.remaining = len(job.images) + len(job.fields)
+        if job.remaining == 0:
+            self._complete(job)
+            return
+        for image, image_path in zip(job.images, job.image_paths):
+            self.attach_queue.put((job, attach_recorded_image, image, image_path))
+        for field_id, value in job.fields:
+            self.attach_queue.put((job, attach_recorded_field, field_id, value))
+
+    def _attach(self, item: tuple) -> None:
+        job, attach, key, value = item
+        if self.error is not None:
+            if attach is attach_recorded_image:
+                discard_image(value)
+            return
+        attach(
+            self.inaturalist_client, self.ledger, self.uid,
+            job.record['instance'], job.observation_id, key, value
+        )
+        with self.lock:
+            job.remaining -= 1
+            finished = job.remaining == 0
+        if finished:
+            self._complete(job)
+
+    def _on_signal(self, signum, frame) -> None:
+        self.stop()
+
+    def run(self) -> dict:
+        if instrument.ACTIVE is not None:
+            self.transformers = instrument_transformers(self.transformers)
+        handler = None
+        if threading.current_thread() is threading.main_thread():
+            handler = signal.signal(signal.SIGTERM, self._on_signal)
+
+        self.progress = tqdm()
+        self.started = perf_counter()
+        fetchers = [
+            threading.Thread(target=self._fetch, name=f"buggy-fetch-{i}", daemon=True)
+            for i in range(self.fetch_workers)
+        ]
+        threads = fetchers + [thread for stage in self.stages for thread in stage.threads]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    try:
+                        thread.join()
+                    except KeyboardInterrupt:
+                        self.stop()
+        finally:
+            self.progress.close()
+            if handler is not None:
+                signal.signal(signal.SIGTERM, handler)
+
+        if self.error is not None:
+            raise self.error
+        return self.summary()
+
+    def summary(self) -> dict:
+        with self.lock:
+            summary = dict(
+                self.counts, stopped=self.stopping.is_set(),
+                first_upload_seconds=self.first_upload
+            )
+            latencies = sorted(self.latencies)
+        if latencies:
+            summary["latency_seconds"] = {
+                "p50": statistics.median(latencies),
+                "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                "max": latencies[-1]
+            }
+        return summary
@@ -0,0 +1,172 @@
+import random
+import threading
+import time
+
+from email.utils import parsedate_to_datetime
+
+import requests
+
+from urllib3.exceptions import NewConnectionError
+
+from . import instrument
+
+# Token bucket whose refill rate backs off when the server throttles us and
+# creeps back up to max_rate while requests go through
+class TokenBucket(object):
+    def __init__(self, max_rate: float, capacity: float, min_rate: float=None, clock=time.monotonic, sleep=time.sleep) -> None:
+        self.max_rate = max_rate
+        self.min_rate = min_rate if min_rate is not None else max_rate / 16
+        self.rate = max_rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.last = clock()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def acquire(self, cost: float=1) -> None:
+        cost = min(cost, self.capacity)
+        while True:
+            with self.lock:
+                now = self.clock()
+                self._refill(now)
+                if self.paused_until > now:
+                    wait = self.paused_until - now
+                elif self.tokens >= cost:
+                    self.tokens -= cost
+                    return
+                else:
+                    wait = (cost - self.tokens) / self.rate
+            self.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        with self.lock:
+            self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+    def throttled(self) -> None:
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0
+
+    def succeeded(self) -> None:
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+
+# iNaturalist asks for no more than 60 requests a minute (and throttles at
+# 100), photo uploads cost more of that budget than a field value
+INATURALIST_RATE = 1.0
+INATURALIST_BURST = 5
+KOBO_RATE = 5.0
+KOBO_BURST = 10
+
+ENDPOINT_BUDGETS = {
+    "inaturalist.auth": ("inaturalist", 1),
+    "inaturalist.observations": ("inaturalist", 1),
+    "inaturalist.observation_photos": ("inaturalist", 3),
+    "inaturalist.observation_field_values": ("inaturalist", 1),
+    "kobo.token": ("kobo", 1),
+    "kobo.data": ("kobo", 1),
+    "kobo.attachments": ("kobo", 2)
+}
+
+def default_buckets() -> dict:
+    return {
+        "inaturalist": TokenBucket(INATURALIST_RATE, INATURALIST_BURST),
+        "kobo": TokenBucket(KOBO_RATE, KOBO_BURST)
+    }
+
+def retry_after(response: requests.Response) -> float:
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# Requests that do the same thing however often they are sent. A POST that
+# timed out or got a 5xx may still have created an observation or photo, so
+# it is only sent again when it never reached the server, or on a 429
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+def unsent(error: requests.RequestException) -> bool:
+    # the connection was never made, so the server never saw the request
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    # requests wraps urllib3's MaxRetryError, whose reason says what failed
+    cause = error.args[0] if error.args else None
+    return isinstance(getattr(cause, "reason", cause), NewConnectionError)
+
+class Scheduler(object):
+    def __init__(self, buckets: dict=None, budgets: dict=None, max_retries: int=6, backoff: float=1.0, max_backoff: float=120.0, sleep=time.sleep) -> None:
+        self.buckets = buckets if buckets is not None else default_buckets()
+        self.budgets = budgets if budgets is not None else ENDPOINT_BUDGETS
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+
+    def _delay(self, attempt: int) -> float:
+        # full jitter exponential backoff
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    @staticmethod
+    def _rewind(positions: list) -> None:
+        # uploads have to be sent from the start again on a retry
+        for fh, position in positions:
+            fh.seek(position)
+
+    def request(self, session: requests.Session, method: str, url: str, endpoint: str, **kwargs) -> requests.Response:
+        bucket_name, cost = self.budgets.get(endpoint, (endpoint.split(".")[0], 1))
+        bucket = self.buckets[bucket_name]
+        positions = [
+            (value[1], value[1].tell())
+            for value in (kwargs.get("files") or {}).values()
+            if isinstance(value, tuple) and hasattr(value[1], "seek")
+        ]
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        for attempt in range(self.max_retries + 1):
+            bucket.acquire(cost)
+            self._rewind(positions)
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                if not (idempotent or unsent(error)):
+                    raise
+                instrument.count(f"{endpoint}.retries")
+                if attempt == self.max_retries:
+                    raise
+                self.sleep(self._delay(attempt))
+                continue
+
+            if response.status_code != 429 and response.status_code < 500:
+                bucket.succeeded()
+                return response
+            if response.status_code != 429 and not idempotent:
+                return response
+            instrument.count(f"{endpoint}.retries")
+            if attempt == self.max_retries:
+                return response
+            # hand the connection back to the pool before trying again
+            response.close()
+
+            delay = retry_after(response)
+            if delay is None:
+                delay = self._delay(attempt)
+            if response.status_code == 429:
+                # everyone sharing the bucket waits out the throttle
+                instrument.count(f"{endpoint}.throttled")
+                bucket.throttled()
+                bucket.pause(delay)
+            else:
+                self.sleep(delay)
+        return response
@@ -0,0 +1,112 @@
+KEYS = (
+    "instance",
+    "is_valid",
+    "images",
+    "taxa",
+    "longitude",
+    "latitude",
+    "ts",
+    "positional_accuracy",
+    "notes",
+    "observation_fields"
+)
+
+# every record made by the same transformers has the same observation field
+# ids, so records share one tuple of them. Past this many distinct sets
+# (transformers that vary the fields per record) records keep their own.
+MAX_FIELD_ID_SETS = 64
+_FIELD_IDS = {}
+
+def _shared_field_ids(field_ids: tuple) -> tuple:
+    shared = _FIELD_IDS.get(field_ids)
+    if shared is not None:
+        return shared
+    if len(_FIELD_IDS) >= MAX_FIELD_ID_SETS:
+        return field_ids
+    return _FIELD_IDS.setdefault(field_ids, field_ids)
+
+# A transformed record in a fraction of the memory of its dict. Reads like
+# the dict (record['taxa'], record.get(...), dict(record)) so upload_data and
+# friends take either.
+class Observation(object):
+    __slots__ = [
+        "instance",
+        "is_valid",
+        "images",
+        "taxa",
+        "longitude",
+        "latitude",
+        "ts",
+        "positional_accuracy",
+        "notes",
+        "field_ids",
+        "field_values"
+    ]
+
+    def __init__(self, instance: int, is_valid: bool, images: list, taxa: int, longitude: float, latitude: float, ts: str, positional_accuracy: float, notes: str, observation_fields: dict) -> None:
+        self.instance = instance
+        self.is_valid = is_valid
+        self.images = tuple(images)
+        self.taxa = taxa
+        self.longitude = longitude
+        self.latitude = latitude
+        self.ts = ts
+        self.positional_accuracy = positional_accuracy
+        self.notes = notes
+        self.field_ids = _shared_field_ids(tuple(observation_fields))
+        self.field_values = tuple(observation_fields.values())
+
+    @property
+    def observation_fields(self) -> dict:
+        return dict(zip(self.field_ids, self.field_values))
+
+    @classmethod
+    def from_dict(cls, record: dict):
+        if not fits(record):
+            raise ValueError(
+                f"an Observation holds exactly {', '.join(KEYS)}, "
+                f"not {', '.join(record)}"
+            )
+        return cls(*(record[key] for key in KEYS))
+
+    def to_dict(self) -> dict:
+        return {
+            "instance": self.instance,
+            "is_valid": self.is_valid,
+            "images": list(self.images),
+            "taxa": self.taxa,
+            "longitude": self.longitude,
+            "latitude": self.latitude,
+            "ts": self.ts,
+            "positional_accuracy": self.positional_accuracy,
+            "notes": self.notes,
+            "observation_fields": self.observation_fields
+        }
+
+    def keys(self) -> tuple:
+        return KEYS
+
+    def __getitem__(self, key: str):
+        if key not in KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default=None):
+        return self[key] if key in KEYS else default
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Observation):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"Observation({self.to_dict()!r})"
+
+def fits(record: dict) -> bool:
+    return len(record) == len(KEYS) and all(key in record for key in KEYS)
+
+def to_observation(record: dict):
+    # records with other keys (custom transformers, duplicate_of) stay dicts
+    return Observation.from_dict(record) if fits(record) else record
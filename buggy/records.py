@@ -0,0 +1,114 @@
+import json
+import mmap
+import os
+
+from array import array
+
+from .record import Observation
+
+# Transformed records as one compact JSON document per line, with an index
+# file of (instance, byte offset) pairs next to it so a reader can jump
+# straight to a record
+NO_INSTANCE = -1
+
+def index_path(path: str) -> str:
+    return path + ".idx"
+
+class RecordWriter(object):
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.fh = open(path, "wb")
+        self.index = array("q")
+
+    def write(self, record: dict) -> int:
+        if isinstance(record, Observation):
+            record = record.to_dict()
+        offset = self.fh.tell()
+        instance = record.get("instance")
+        self.index.extend((NO_INSTANCE if instance is None else instance, offset))
+        self.fh.write(json.dumps(record, sort_keys=True, separators=(",", ":")).encode() + b"\n")
+        return offset
+
+    def close(self) -> None:
+        self.fh.close()
+        with open(index_path(self.path), "wb") as fh:
+            self.index.tofile(fh)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+def write_records(records, path: str) -> int:
+    count = 0
+    with RecordWriter(path) as writer:
+        for record in records:
+            writer.write(record)
+            count += 1
+    return count
+
+class RecordFile(object):
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.fh = open(path, "rb")
+        size = os.fstat(self.fh.fileno()).st_size
+        # an empty file cannot be mapped
+        self.map = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self._index = None
+        self._offsets = None
+
+    def _load_index(self) -> array:
+        if self._index is None:
+            index = array("q")
+            if os.path.exists(index_path(self.path)):
+                with open(index_path(self.path), "rb") as fh:
+                    index.frombytes(fh.read())
+            else:
+                # no index was written alongside, so read through the file once
+                offset = 0
+                while offset < len(self.map):
+                    record, next_offset = self._read(offset)
+                    instance = record.get("instance")
+                    index.extend((NO_INSTANCE if instance is None else instance, offset))
+                    offset = next_offset
+            self._index = index
+        return self._index
+
+    def _read(self, offset: int) -> tuple:
+        newline = self.map.find(b"\n", offset)
+        end = len(self.map) if newline == -1 else newline
+        return json.loads(self.map[offset:end]), end + 1
+
+    def __len__(self) -> int:
+        return len(self._load_index()) // 2
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def iter_from(self, offset: int):
+        # records from a byte offset (e.g. one from offset()) to the end
+        end = len(self.map)
+        while offset < end:
+            record, offset = self._read(offset)
+            yield record
+
+    def offset(self, instance: int) -> int:
+        if self._offsets is None:
+            index = self._load_index()
+            self._offsets = dict(zip(index[0::2], index[1::2]))
+        return self._offsets[instance]
+
+    def get(self, instance: int) -> dict:
+        return self._read(self.offset(instance))[0]
+
+    def close(self) -> None:
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
@@ -0,0 +1,221 @@
+import hashlib
+import json
+import pickle
+import sqlite3
+import threading
+
+from functools import partial
+from time import time
+from types import BuiltinFunctionType, CodeType, FunctionType, MethodType
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    uid TEXT NOT NULL,
+    entry_id TEXT NOT NULL,
+    submission TEXT NOT NULL,
+    config TEXT NOT NULL,
+    record BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (uid, entry_id)
+);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+"""
+
+def _names(code: CodeType) -> set:
+    # globals a function's code, nested functions included, refers to
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            names |= _names(const)
+    return names
+
+def _globals(function: FunctionType) -> tuple:
+    # module level data (mappings, thresholds) the function reads; other
+    # functions and modules are left out so this never walks a whole module
+    return tuple(
+        (name, function.__globals__[name])
+        for name in sorted(_names(function.__code__))
+        if name in function.__globals__
+        and isinstance(function.__globals__[name], (str, bytes, int, float, bool, list, tuple, dict, set, frozenset))
+    )
+
+def _cells(function: FunctionType) -> tuple:
+    contents = []
+    for cell in function.__closure__ or ():
+        try:
+            contents.append(cell.cell_contents)
+        except ValueError:
+            # a cell that has not been filled in yet
+            contents.append(None)
+    return tuple(contents)
+
+def _describe(value, active: set=None) -> object:
+    # a stable, hashable description of a transformer config: functions are
+    # described by their bytecode, constants, captured variables and the
+    # module level data they read, so changing any of them changes it
+    active = active if active is not None else set()
+    if isinstance(value, partial):
+        return ("partial", _describe(value.func, active), _describe(value.args, active), _describe(value.keywords, active))
+    if isinstance(value, MethodType):
+        return ("method", _describe(value.__func__, active), _describe(value.__self__, active))
+    if isinstance(value, FunctionType):
+        if id(value) in active:
+            # a function that captures itself, e.g. a recursive closure
+            return ("recursive", value.__qualname__)
+        active.add(id(value))
+        try:
+            return (
+                "function", value.__module__, value.__qualname__,
+                _describe(value.__code__, active), _describe(value.__defaults__, active),
+                _describe(value.__kwdefaults__, active), _describe(_cells(value), active),
+                _describe(_globals(value), active)
+            )
+        finally:
+            active.discard(id(value))
+    if isinstance(value, CodeType):
+        return ("code", value.co_code, _describe(value.co_consts, active), value.co_names)
+    if isinstance(value, (BuiltinFunctionType, type)):
+        return ("builtin", value.__module__, value.__qualname__)
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__, tuple(_describe(item, active) for item in value))
+    if isinstance(value, dict):
+        return ("dict", tuple(sorted((repr(k), _describe(v, active)) for k, v in value.items())))
+    if isinstance(value, (set, frozenset)):
+        return ("set", tuple(sorted(repr(item) for item in value)))
+    if value is None or isinstance(value, (str, bytes, int, float, bool)):
+        return value
+    if callable(getattr(value, "fingerprint", None)):
+        # stateful helpers (the identifier database) say what they stand for
+        return (type(value).__module__, type(value).__qualname__, value.fingerprint())
+    if hasattr(value, "__dict__"):
+        return (type(value).__module__, type(value).__qualname__, _describe(vars(value), active))
+    return repr(value)
+
+def transformer_fingerprint(transformers: list, kwargs: dict=None) -> str:
+    # kwargs (e.g. identifier) are passed to every transformer, so records
+    # made with other ones are not served either
+    description = _describe(transformers) if not kwargs else (_describe(transformers), _describe(kwargs))
+    return hashlib.sha256(repr(description).encode()).hexdigest()
+
+# kobo changes at least one of these whenever a submission is edited or
+# its validation status is changed
+VERSION_FIELDS = [
+    "_uuid",
+    "meta/instanceID",
+    "_version",
+    "__version__",
+    "_submission_time",
+    "_validation_status"
+]
+
+def submission_fingerprint(entry: dict) -> str:
+    if "_uuid" in entry or "meta/instanceID" in entry:
+        version = repr([entry.get(field) for field in VERSION_FIELDS])
+    else:
+        # no kobo metadata to go by, so hash the whole submission
+        version = json.dumps(entry, sort_keys=True, default=str)
+    return hashlib.sha256(version.encode()).hexdigest()
+
+# Transformed records by (asset uid, submission _id), only served while both
+# the submission and the transformer config are the ones they were made from.
+# Least recently used records go first once the cache grows past max_bytes.
+class TransformCache(object):
+    def __init__(self, path: str, max_bytes: int=512 * 1024 ** 2) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+
+    def load(self, uid: str) -> dict:
+        # the fingerprints of everything cached for an asset in one query,
+        # entry_id -> (submission, config); records are only read for hits
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT entry_id, submission, config FROM results WHERE uid = ?",
+                (uid,)
+            ).fetchall()
+        return {entry_id: (submission, config) for entry_id, submission, config in rows}
+
+    def records(self, uid: str, entry_ids: list, chunk_size: int=500) -> dict:
+        # entry_id -> record for the given entries, touched as they are read
+        records = {}
+        entry_ids = [str(entry_id) for entry_id in entry_ids]
+        for start in range(0, len(entry_ids), chunk_size):
+            chunk = entry_ids[start:start + chunk_size]
+            with self.lock:
+                rows = self.connection.execute(
+                    f"SELECT entry_id, record FROM results WHERE uid = ? AND entry_id IN ({', '.join('?' * len(chunk))})",
+                    [uid] + chunk
+                ).fetchall()
+            records.update((entry_id, self.decode(record)) for entry_id, record in rows)
+        self.touch(uid, entry_ids)
+        return records
+
+    @staticmethod
+    def decode(record: bytes) -> dict:
+        return pickle.loads(record)
+
+    def get(self, uid: str, entry_id, submission: str, config: str) -> dict:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT record FROM results WHERE uid = ? AND entry_id = ? AND submission = ? AND config = ?",
+                (uid, str(entry_id), submission, config)
+            ).fetchone()
+        if row is None:
+            return None
+        self.touch(uid, [entry_id])
+        return self.decode(row[0])
+
+    def touch(self, uid: str, entry_ids: list) -> None:
+        now = time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "UPDATE results SET last_used = ? WHERE uid = ? AND entry_id = ?",
+                [(now, uid, str(entry_id)) for entry_id in entry_ids]
+            )
+
+    def put_many(self, uid: str, results: list) -> None:
+        # results are (entry_id, submission fingerprint, config fingerprint, record)
+        now = time()
+        rows = []
+        for entry_id, submission, config, record in results:
+            blob = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+            rows.append((uid, str(entry_id), submission, config, blob, len(blob), now))
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO results "
+                "(uid, entry_id, submission, config, record, size, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._evict()
+
+    def put(self, uid: str, entry_id, submission: str, config: str, record: dict) -> None:
+        self.put_many(uid, [(entry_id, submission, config, record)])
+
+    def _evict(self) -> None:
+        total, = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for uid, entry_id, size in self.connection.execute(
+            "SELECT uid, entry_id, size FROM results ORDER BY last_used"
+        ):
+            if total <= self.max_bytes:
+                break
+            evicted.append((uid, entry_id))
+            total -= size
+        self.connection.executemany(
+            "DELETE FROM results WHERE uid = ? AND entry_id = ?", evicted
+        )
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,66 @@
+import json
+import os
+import traceback
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from . import instrument
+from .deadletter import DeadLetterStore
+from .kobo import Kobo
+from .transform import pull_and_transform_data
+
+AssetRun = namedtuple("AssetRun", ["uid", "transformed", "failed", "error", "seconds"])
+
+def _run_asset(kobo: Kobo, uid: str, transformers: list, output_directory: str, dead_letter_directory: str, kwargs: dict) -> AssetRun:
+    start = perf_counter()
+    dead_letters = None
+    try:
+        with instrument.timer(f"runner.{uid}"):
+            if dead_letter_directory is not None:
+                dead_letters = DeadLetterStore(
+                    os.path.join(dead_letter_directory, f"{uid}.dead_letters.jsonl")
+                )
+            transformed, failed = pull_and_transform_data(
+                kobo, uid, transformers, dead_letters=dead_letters, **kwargs
+            )
+            if output_directory is not None:
+                with open(os.path.join(output_directory, f"{uid}.json"), "w") as fh:
+                    json.dump(transformed, fh, sort_keys=True, indent=4)
+    except Exception:
+        # one broken asset should not cost the others their run
+        return AssetRun(uid, None, 0, traceback.format_exc(), perf_counter() - start)
+    finally:
+        if dead_letters is not None:
+            dead_letters.close()
+    return AssetRun(uid, transformed, failed, None, perf_counter() - start)
+
+def run_assets(kobo: Kobo, assets: dict, workers: int=4, output_directory: str=None, dead_letter_directory: str=None, **kwargs) -> dict:
+    # assets maps each asset uid to its transformer list; kwargs (e.g. one
+    # shared FANIdentifier) go to every asset's transformers
+    with ThreadPoolExecutor(workers) as executor:
+        futures = [
+            executor.submit(
+                _run_asset, kobo, uid, transformers,
+                output_directory, dead_letter_directory, kwargs
+            )
+            for uid, transformers in assets.items()
+        ]
+        return {run.uid: run for run in (future.result() for future in futures)}
+
+def summarize(runs: dict) -> dict:
+    return {
+        "assets": len(runs),
+        "transformed": sum(len(run.transformed) for run in runs.values() if run.error is None),
+        "failed": sum(run.failed for run in runs.values()),
+        "errors": sorted(uid for uid, run in runs.items() if run.error is not None),
+        "per_asset": {
+            uid: {
+                "transformed": len(run.transformed) if run.error is None else None,
+                "failed": run.failed,
+                "seconds": run.seconds
+            }
+            for uid, run in runs.items()
+        }
+    }
@@ -0,0 +1,18 @@
+import requests
+
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 16
+
+# One keep-alive, connection pooled session for every client buggy makes.
+# The clients keep their own auth headers so a session can be shared
+# between kobo and iNaturalist and across worker threads.
+def make_session(pool_size: int=DEFAULT_POOL_SIZE, host_pool_sizes: dict=None) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=DEFAULT_POOL_SIZE, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # the longest matching prefix wins, e.g. {"https://api.inaturalist.org": 32}
+    for host, size in (host_pool_sizes or {}).items():
+        session.mount(host, HTTPAdapter(pool_connections=1, pool_maxsize=size))
+    return session
@@ -0,0 +1,66 @@
+import unittest
+
+from ..batch import (
+    batch_transform_data,
+    transform_batch
+)
+from ..transform import (
+    BUGGY_TRANSFORMERS,
+    transform_data
+)
+from .test_compiler import (
+    FakeIdentifier,
+    make_entry
+)
+
+class CountingIdentifier(object):
+    def __init__(self):
+        self.calls = []
+
+    def get_identifier(self, user_id):
+        self.calls.append(user_id)
+        return f"ID{len(self.calls)}"
+
+class TestTransformBatch(unittest.TestCase):
+    def test_mask(self):
+        entries = [
+            make_entry(1),
+            make_entry(2, **{"arthropod_documentation/quantity": "lots"}),
+            make_entry(3, _geolocation=None),
+            make_entry(4, **{"session_info/survey_method": ["walking"]})
+        ]
+        records, mask = transform_batch(entries, BUGGY_TRANSFORMERS, identifier=FakeIdentifier())
+
+        assert mask == [True, False, False, False]
+        assert records[1:] == [None, None, None]
+        assert records[0] == transform_data(entries[:1], BUGGY_TRANSFORMERS, identifier=FakeIdentifier())[0][0]
+
+    def test_matches_row_wise(self):
+        entries = [
+            make_entry(i, **{
+                "session_info/input_email": f"volunteer{i % 7}@geemail.com",
+                "arthropod_documentation/length": "long" if i % 11 == 0 else str(i / 10),
+                "session_info/survey_method": ["incidental", "walking", "nothing"][i % 3]
+            })
+            for i in range(1, 100)
+        ]
+        entries[5] = {
+            key: value for key, value in entries[5].items()
+            if not key.startswith("host_documentation")
+        }
+
+        row_identifier, batch_identifier = CountingIdentifier(), CountingIdentifier()
+        expected = transform_data(entries, BUGGY_TRANSFORMERS, identifier=row_identifier)
+        result = batch_transform_data(entries, BUGGY_TRANSFORMERS, batch_size=30, identifier=batch_identifier)
+
+        assert result == expected
+        assert batch_identifier.calls == row_identifier.calls
+
+    def test_unknown_transformer(self):
+        def transformer(entry: dict, **kwargs) -> tuple:
+            return entry["key"], kwargs["to_pass"]
+
+        records, mask = transform_batch([{"key": "a"}, {}], [transformer], to_pass="check for me")
+
+        assert records == [{"a": "check for me"}, None]
+        assert mask == [True, False]
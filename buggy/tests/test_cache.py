@@ -0,0 +1,119 @@
+import unittest
+import os
+import tempfile
+
+from ..cache import (
+    ImageCache,
+    prefetch_images
+)
+
+class FakeKobo(object):
+    def __init__(self, content=None):
+        self.pulled = []
+        self.content = content or {}
+
+    def pull_image(self, image_path, uid, instance, image):
+        with open(image_path, "wb") as fh:
+            fh.write(self.content.get(image, f"{uid} {instance} {image}".encode()))
+        self.pulled.append((uid, instance, image))
+
+class TestImageCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_fetch_once(self):
+        cache = ImageCache(self.directory.name)
+        kobo = FakeKobo()
+
+        path = cache.fetch(kobo, "5678", 1, 2)
+        assert cache.fetch(kobo, "5678", 1, 2) == path
+        assert ImageCache(self.directory.name).fetch(kobo, "5678", 1, 2) == path
+        with open(path, "rb") as fh:
+            assert fh.read() == b"5678 1 2"
+        assert kobo.pulled == [("5678", 1, 2)]
+
+    def test_corruption_detected(self):
+        cache = ImageCache(self.directory.name)
+        kobo = FakeKobo()
+
+        path = cache.fetch(kobo, "5678", 1, 2)
+        with open(path, "wb") as fh:
+            fh.write(b"scrambled")
+
+        assert cache.get("5678", 1, 2) is None
+        with open(cache.fetch(kobo, "5678", 1, 2), "rb") as fh:
+            assert fh.read() == b"5678 1 2"
+        assert len(kobo.pulled) == 2
+
+    def test_same_size_corruption_detected(self):
+        cache = ImageCache(self.directory.name)
+        kobo = FakeKobo()
+
+        path = cache.fetch(kobo, "5678", 1, 2)
+        stat = os.stat(path)
+        with open(path, "wb") as fh:
+            fh.write(b"5678 1 3")
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+        assert cache.get("5678", 1, 2) is None
+
+    def test_hit_not_hashed(self):
+        cache = ImageCache(self.directory.name)
+        kobo = FakeKobo()
+        path = cache.fetch(kobo, "5678", 1, 2)
+
+        def digest(path):
+            raise AssertionError("hashed on a hit")
+        cache._digest = digest
+        assert cache.get("5678", 1, 2) == path
+
+    def test_open_survives_eviction(self):
+        kobo = FakeKobo({image: bytes([image]) * 10 for image in range(3)})
+        cache = ImageCache(self.directory.name, max_bytes=10)
+
+        with cache.open(kobo, "5678", 1, 0) as fh:
+            cache.fetch(kobo, "5678", 1, 1)
+            assert cache.get("5678", 1, 0) is None
+            assert fh.read() == bytes([0]) * 10
+
+    def test_least_recently_used_evicted(self):
+        kobo = FakeKobo({image: bytes([image]) * 10 for image in range(5)})
+        cache = ImageCache(self.directory.name, max_bytes=30)
+
+        for image in range(3):
+            cache.fetch(kobo, "5678", 1, image)
+        cache.get("5678", 1, 0)
+        cache.fetch(kobo, "5678", 1, 3)
+
+        assert cache.get("5678", 1, 1) is None
+        assert cache.get("5678", 1, 0) is not None
+        assert cache.get("5678", 1, 3) is not None
+        objects = [
+            name
+            for _, _, names in os.walk(os.path.join(self.directory.name, "objects"))
+            for name in names
+        ]
+        assert len(objects) == 3
+
+    def test_same_content_stored_once(self):
+        kobo = FakeKobo({1: b"same", 2: b"same"})
+        cache = ImageCache(self.directory.name)
+
+        assert cache.fetch(kobo, "5678", 1, 1) == cache.fetch(kobo, "5678", 2, 2)
+
+    def test_prefetch(self):
+        kobo = FakeKobo()
+        cache = ImageCache(self.directory.name)
+        data = [
+            {"instance": 1, "is_valid": True, "images": [11, 12]},
+            {"instance": 2, "is_valid": False, "images": [21]},
+            {"instance": 3, "is_valid": True, "images": [31]}
+        ]
+
+        prefetch_images(data, "5678", kobo, cache, workers=2)
+
+        assert sorted(kobo.pulled) == [("5678", 1, 11), ("5678", 1, 12), ("5678", 3, 31)]
+        assert cache.get("5678", 3, 31) is not None
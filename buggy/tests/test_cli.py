@@ -0,0 +1,93 @@
+import unittest
+import os
+import subprocess
+import sys
+import tempfile
+
+from unittest import mock
+
+import httpretty
+
+from ..cache import ImageCache
+from ..cli import main
+from ..identifier import FANIdentifier
+from ..records import RecordFile, write_records
+from ..transform import OBSERVATION_FIELD_IDS
+from .test_compiler import make_entry
+from .test_kobo import register_token_url
+
+class TestCli(unittest.TestCase):
+    def test_help_imports_nothing_heavy(self):
+        output = subprocess.run(
+            [
+                sys.executable, "-c",
+                "import sys; from buggy.cli import main; main([]); "
+                "print(sorted(m for m in sys.modules if m.split('.')[0] in ('buggy', 'requests', 'tqdm', 'gluon')))"
+            ],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        ).stdout
+        assert "usage: buggy" in output
+        assert output.strip().splitlines()[-1] == "['buggy', 'buggy.cli']"
+
+    def test_watermarks_exclude_approved_only(self):
+        with mock.patch("sys.stderr"), self.assertRaises(SystemExit):
+            main(["transform", "5678", "-o", "data.ndjson", "--watermarks", "w.json", "--approved-only"])
+
+    def test_pipeline_rejects_unsupported_flags(self):
+        for flags in [["--watermarks", "w.json"], ["--cache", "cache.sqlite"], ["-o", "data.ndjson"]]:
+            with mock.patch("sys.stderr") as stderr, self.assertRaises(SystemExit):
+                main(["run", "5678", "--pipeline"] + flags)
+            assert "--pipeline cannot be combined" in "".join(call.args[0] for call in stderr.write.call_args_list)
+
+    def test_transform_from_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            raw = os.path.join(directory, "raw.ndjson")
+            output = os.path.join(directory, "data.ndjson")
+            dead_letters = os.path.join(directory, "dead_letters.jsonl")
+            write_records([
+                make_entry(1),
+                make_entry(2, **{"arthropod_documentation/quantity": "lots"}),
+                make_entry(3)
+            ], raw)
+            with open(os.path.join(directory, "db.json"), "w") as fh:
+                fh.write("{}")
+
+            assert main([
+                "transform", "5678", "-i", raw, "-o", output,
+                "--db", os.path.join(directory, "db.json"),
+                "--dead-letters", dead_letters
+            ]) == 0
+
+            with RecordFile(output) as records:
+                assert [record["instance"] for record in records] == [1, 3]
+                observer = records.get(3)["observation_fields"][str(OBSERVATION_FIELD_IDS["EwA - Observer Code"])]
+            identifier = FANIdentifier(os.path.join(directory, "db.json"))
+            assert observer == identifier.get_identifier("garlicbread@geemail.com")
+            identifier.close()
+            with open(dead_letters) as fh:
+                assert len(fh.readlines()) == 1
+
+    @httpretty.activate
+    def test_prefetch(self):
+        register_token_url()
+        httpretty.register_uri(
+            httpretty.GET, "https://kf.kobotoolbox.org/api/v2/assets/5678/data/1/attachments/2/",
+            body=b"a picture of a bug"
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            records = os.path.join(directory, "data.ndjson")
+            image_cache = os.path.join(directory, "image_cache")
+            write_records([
+                {"instance": 1, "is_valid": True, "images": [2]},
+                {"instance": 2, "is_valid": False, "images": [3]}
+            ], records)
+
+            with mock.patch.dict(os.environ, {"KOBO_USERNAME": "user", "KOBO_PASSWORD": "1234"}):
+                assert main(["prefetch", "5678", "-i", records, "--image-cache", image_cache]) == 0
+
+            cache = ImageCache(image_cache)
+            with open(cache.get("5678", 1, 2), "rb") as fh:
+                assert fh.read() == b"a picture of a bug"
+            assert cache.get("5678", 2, 3) is None
+            cache.close()
@@ -0,0 +1,104 @@
+import unittest
+import pickle
+
+from functools import partial
+
+from ..compiler import (
+    compile_transformers
+)
+from ..transform import (
+    BUGGY_TRANSFORMERS,
+    notes_transform,
+    transform_data,
+    transform_entry
+)
+
+class FakeIdentifier(object):
+    @staticmethod
+    def get_identifier(user_id):
+        return user_id.upper()[:4]
+
+def make_entry(_id, **overrides):
+    entry = {
+        "_id": _id,
+        "_geolocation": [61.2, -149.9],
+        "_attachments": [
+            {"filename": "a/long/url/bug.jpg", "instance": _id, "id": 2},
+            {"filename": "a/long/url/plant.jpg", "instance": _id, "id": 3}
+        ],
+        "_validation_status": {"uid": "validation_status_approved"},
+        "session_info/location": "61.2 -149.9 0.0 5.0",
+        "session_info/survey_method": "walking",
+        "session_info/Survey_duration": "15",
+        "session_info/survey_ts": "2022-05-01T12:00:00",
+        "session_info/input_email": "garlicbread@geemail.com",
+        "arthropod_documentation/arthropod_group": "coleoptera",
+        "arthropod_documentation/developmental_stage": "larva",
+        "arthropod_documentation/activity": "feeding",
+        "arthropod_documentation/quantity": "3",
+        "arthropod_documentation/length": "1.5",
+        "arthropod_documentation/arthropod_photo_1": "bug.jpg",
+        "arthropod_documentation/arthropod_more": "on the underside",
+        "host_documentation/host_group": "angiospermae",
+        "host_documentation/host_phenology": "flowers",
+        "host_documentation/wet_support": "no",
+        "host_documentation/host_photo": "plant.jpg"
+    }
+    entry.update(overrides)
+    return entry
+
+class TestCompileTransformers(unittest.TestCase):
+    def test_matches_transformer_list(self):
+        entries = [
+            make_entry(1),
+            make_entry(2, **{"session_info/survey_method": "unknown"}),
+            make_entry(3, _validation_status={}),
+            {
+                key: value for key, value in make_entry(4).items()
+                if not key.startswith("host_documentation")
+            },
+            make_entry(5, **{"arthropod_documentation/quantity": "lots"}),
+            make_entry(6, _geolocation=None)
+        ]
+        compiled = compile_transformers(BUGGY_TRANSFORMERS)
+
+        expected = transform_data(entries, BUGGY_TRANSFORMERS, identifier=FakeIdentifier())
+        result = transform_data(entries, compiled, identifier=FakeIdentifier())
+
+        assert result == expected
+        assert result[1] == 2
+
+    def test_failure_names_transformer(self):
+        compiled = compile_transformers(BUGGY_TRANSFORMERS)
+        entry = make_entry(1, **{"arthropod_documentation/length": "long"})
+
+        transformed, failure = transform_entry(entry, compiled, identifier=FakeIdentifier())
+
+        assert transformed is None
+        assert failure.transformer == "observation_field_transformer"
+
+    def test_unknown_transformer_called(self):
+        def transformer(entry: dict, **kwargs) -> tuple:
+            return "field", kwargs["to_pass"]
+
+        compiled = compile_transformers([transformer])
+
+        assert compiled.compiled({}, {"to_pass": "check for me"}) == {"field": "check for me"}
+
+    def test_notes_validated_once(self):
+        transformers = [
+            partial(
+                notes_transform,
+                {"my note": "My Notes:"},
+                ["my note", "postscript"]
+            )
+        ]
+        with self.assertRaises(ValueError):
+            compile_transformers(transformers)
+
+    def test_pickle(self):
+        compiled = pickle.loads(pickle.dumps(compile_transformers(BUGGY_TRANSFORMERS)))
+        entry = make_entry(1)
+
+        assert transform_entry(entry, compiled, identifier=FakeIdentifier()) == \
+            transform_entry(entry, BUGGY_TRANSFORMERS, identifier=FakeIdentifier())
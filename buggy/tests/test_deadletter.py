@@ -0,0 +1,77 @@
+import unittest
+import os
+import tempfile
+
+from ..deadletter import (
+    DeadLetterStore
+)
+from ..transform import (
+    TransformFailure
+)
+
+class TestDeadLetterStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "dead_letters.jsonl")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_failures_persisted(self):
+        with DeadLetterStore(self.path) as dead_letters:
+            dead_letters.add(TransformFailure({"_id": 1, "a": 1}, "a_transform", "Traceback 1"))
+            dead_letters.add(TransformFailure({"_id": 2}, "b_transform", "Traceback 2"))
+            dead_letters.resolve("None/2")
+
+        with DeadLetterStore(self.path) as dead_letters:
+            assert len(dead_letters) == 1
+            assert dead_letters.get("None/2") is None
+            assert dead_letters.failures() == [{
+                "key": "None/1",
+                "uid": None,
+                "_id": 1,
+                "entry": {"_id": 1, "a": 1},
+                "transformer": "a_transform",
+                "traceback": "Traceback 1"
+            }]
+
+    def test_keyed_by_asset(self):
+        with DeadLetterStore(self.path) as dead_letters:
+            dead_letters.add(TransformFailure({"_id": 1}, "a_transform", "Traceback"), uid="north")
+            dead_letters.add(TransformFailure({"_id": 1}, "b_transform", "Traceback"), uid="south")
+            dead_letters.add(TransformFailure({"a": 1}, "a_transform", "Traceback"), uid="north")
+            dead_letters.add(TransformFailure({"a": 2}, "a_transform", "Traceback"), uid="north")
+            dead_letters.resolve("south/1")
+
+        with DeadLetterStore(self.path) as dead_letters:
+            assert len(dead_letters) == 3
+            assert dead_letters.get("north/1")["transformer"] == "a_transform"
+            assert dead_letters.get(DeadLetterStore.key("north", {"a": 2}))["entry"] == {"a": 2}
+
+    def test_torn_write_ignored(self):
+        with DeadLetterStore(self.path) as dead_letters:
+            dead_letters.add(TransformFailure({"_id": 1}, "a_transform", "Traceback"))
+        with open(self.path, "a") as fh:
+            fh.write('{"step": "resol')
+
+        with DeadLetterStore(self.path) as dead_letters:
+            assert dead_letters.get("None/1")["transformer"] == "a_transform"
+            dead_letters.add(TransformFailure({"_id": 2}, "a_transform", "Traceback"))
+
+        with DeadLetterStore(self.path) as dead_letters:
+            assert dead_letters.get("None/1")["transformer"] == "a_transform"
+            assert dead_letters.get("None/2")["transformer"] == "a_transform"
+
+    def test_compact(self):
+        with DeadLetterStore(self.path) as dead_letters:
+            for _id in range(10):
+                dead_letters.add(TransformFailure({"_id": _id}, "a_transform", "Traceback"))
+            for _id in range(9):
+                dead_letters.resolve(f"None/{_id}")
+            dead_letters.compact()
+            dead_letters.add(TransformFailure({"_id": 10}, "a_transform", "Traceback"))
+
+        with open(self.path) as fh:
+            assert len(fh.readlines()) == 2
+        with DeadLetterStore(self.path) as dead_letters:
+            assert sorted(letter["_id"] for letter in dead_letters.failures()) == [9, 10]
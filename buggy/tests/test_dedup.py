@@ -0,0 +1,86 @@
+import unittest
+import os
+import random
+import tempfile
+
+from ..dedup import (
+    DuplicateIndex,
+    deduplicate
+)
+from ..ledger import UploadLedger
+from .test_upload import make_record
+
+def make_observation(instance, latitude=61.2, longitude=-149.9, ts="2022-05-01T12:00:00", taxa=47208, positional_accuracy=5.0, is_valid=True):
+    return dict(
+        make_record(instance, is_valid=is_valid),
+        latitude=latitude, longitude=longitude, ts=ts,
+        taxa=taxa, positional_accuracy=positional_accuracy
+    )
+
+class TestDeduplicate(unittest.TestCase):
+    def test_near_duplicates_dropped(self):
+        records = [
+            make_observation(1),
+            # ~11m away ten minutes later, inside 10m + 5m + 5m
+            make_observation(2, latitude=61.2001, ts="2022-05-01T12:10:00"),
+            # same place, another taxa
+            make_observation(3, taxa=47157),
+            # same place, the next day
+            make_observation(4, ts="2022-05-02T12:00:00"),
+            # ~110m away
+            make_observation(5, latitude=61.201),
+            # ~110m away but only known to within 100m
+            make_observation(6, latitude=61.201, positional_accuracy=100.0),
+            # invalid records are let through and never count as originals
+            make_observation(7, is_valid=False),
+            make_observation(8, ts=None)
+        ]
+        kept = list(deduplicate(records, "5678", DuplicateIndex()))
+        assert [record['instance'] for record in kept] == [1, 3, 4, 5, 7, 8]
+
+    def test_flag(self):
+        records = [make_observation(1), make_observation(2)]
+        flagged = list(deduplicate(records, "5678", DuplicateIndex(), drop=False))
+        assert flagged[0] == records[0]
+        assert flagged[1]['duplicate_of'] == ["5678", 1]
+        assert flagged[1]['is_valid'] is False
+
+    def test_history(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "ledger.jsonl")
+            with UploadLedger(path) as ledger:
+                record = make_observation(1)
+                ledger.record_observation("5678", 1, 100, point={
+                    key: record[key]
+                    for key in ["taxa", "latitude", "longitude", "ts", "positional_accuracy"]
+                })
+
+            index = DuplicateIndex()
+            with UploadLedger(path) as ledger:
+                index.add_history(ledger)
+
+        # the record itself being rerun is not its own duplicate
+        kept = list(deduplicate([make_observation(1), make_observation(2)], "5678", index))
+        assert [record['instance'] for record in kept] == [1]
+
+    def test_matches_brute_force(self):
+        rng = random.Random(0)
+        records = [
+            make_observation(
+                i,
+                latitude=61.2 + rng.uniform(-0.002, 0.002),
+                longitude=-149.9 + rng.uniform(-0.004, 0.004),
+                ts=f"2022-05-01T{rng.randrange(10, 14)}:{rng.randrange(60):02d}:00",
+                taxa=rng.choice([47208, 47157]),
+                positional_accuracy=rng.choice([3.0, 10.0, 60.0, 400.0])
+            )
+            for i in range(300)
+        ]
+
+        index = DuplicateIndex()
+        kept = [record['instance'] for record in deduplicate(records, "5678", index)]
+
+        brute = DuplicateIndex(cell_size=1e9)
+        expected = [record['instance'] for record in deduplicate(records, "5678", brute)]
+        assert kept == expected
+        assert 0 < len(kept) < 300
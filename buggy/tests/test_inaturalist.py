@@ -0,0 +1,102 @@
+import unittest
+import httpretty
+import io
+import json
+
+from ..inaturalist import (
+    iNaturalist
+)
+
+def register_token_urls():
+    httpretty.register_uri(
+        httpretty.POST, "https://www.inaturalist.org/oauth/token",
+        body=json.dumps({"access_token": "access granted"})
+    )
+    httpretty.register_uri(
+        httpretty.GET, "https://www.inaturalist.org/users/api_token",
+        body=json.dumps({"api_token": "a very tokenistic gesture"})
+    )
+
+class TestiNaturalist(unittest.TestCase):
+
+    @httpretty.activate
+    def test_upload_base_observation(self):
+        register_token_urls()
+        httpretty.register_uri(
+            httpretty.POST, "https://api.inaturalist.org/v1/observations",
+            body=json.dumps({"id": 42})
+        )
+
+        inaturalist = iNaturalist("id", "secret", "user", "1234")
+        observation_id = inaturalist.upload_base_observation(
+            47208, -149.9, 61.2, "2022-05-01T12:00:00", 5.0, "some notes"
+        )
+
+        assert observation_id == 42
+        request = httpretty.last_request()
+        assert request.headers["Authorization"] == "a very tokenistic gesture"
+        assert json.loads(request.body) == {
+            "observation": {
+                "taxon_id": 47208,
+                "longitude": -149.9,
+                "latitude": 61.2,
+                "observed_on_string": "2022-05-01T12:00:00",
+                "positional_accuracy": 5.0,
+                "description": "some notes"
+            }
+        }
+
+    @httpretty.activate
+    def test_embedded_observation_fields(self):
+        register_token_urls()
+        httpretty.register_uri(
+            httpretty.POST, "https://api.inaturalist.org/v1/observations",
+            body=json.dumps({"id": 42})
+        )
+
+        inaturalist = iNaturalist("id", "secret", "user", "1234")
+        inaturalist.upload_base_observation(
+            47208, -149.9, 61.2, "2022-05-01T12:00:00", 5.0, "some notes",
+            observation_fields={"12552": "Other", 15607: 1.5}
+        )
+
+        observation = json.loads(httpretty.last_request().body)["observation"]
+        assert observation["observation_field_values_attributes"] == [
+            {"observation_field_id": 12552, "value": "Other"},
+            {"observation_field_id": 15607, "value": 1.5}
+        ]
+
+    @httpretty.activate
+    def test_attach_image_from_buffer(self):
+        register_token_urls()
+        httpretty.register_uri(
+            httpretty.POST, "https://api.inaturalist.org/v1/observation_photos",
+            body=json.dumps({})
+        )
+
+        inaturalist = iNaturalist("id", "secret", "user", "1234")
+        inaturalist.attach_image(42, io.BytesIO(b"a picture of a bug"), "5678_1_2")
+
+        body = httpretty.last_request().body
+        assert b"a picture of a bug" in body
+        assert b'filename="5678_1_2"' in body
+        assert b"observation_photo[observation_id]" in body
+
+    @httpretty.activate
+    def test_attach_observation_field(self):
+        register_token_urls()
+        httpretty.register_uri(
+            httpretty.POST, "https://api.inaturalist.org/v1/observation_field_values",
+            body=json.dumps({})
+        )
+
+        inaturalist = iNaturalist("id", "secret", "user", "1234")
+        inaturalist.attach_observation_field(42, 12552, "Other")
+
+        assert json.loads(httpretty.last_request().body) == {
+            "observation_field_value": {
+                "observation_id": 42,
+                "observation_field_id": 12552,
+                "value": "Other"
+            }
+        }
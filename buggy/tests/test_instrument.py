@@ -0,0 +1,77 @@
+import json
+import os
+import tempfile
+import unittest
+
+from .. import instrument
+from ..transform import (
+    BUGGY_TRANSFORMERS,
+    TimedTransformer,
+    transform_data
+)
+from .test_compiler import FakeIdentifier, make_entry
+
+class TestInstrumentation(unittest.TestCase):
+    def tearDown(self):
+        instrument.disable()
+
+    def test_disabled_by_default(self):
+        assert instrument.ACTIVE is None
+        assert instrument.timer("anything") is instrument.NULL_TIMER
+        instrument.count("anything")
+        assert instrument.ACTIVE is None
+
+    def test_times_each_transformer(self):
+        instrumentation = instrument.enable()
+        entries = [make_entry(1), make_entry(2, **{"arthropod_documentation/quantity": "lots"})]
+        transformed, failed = transform_data(entries, BUGGY_TRANSFORMERS, identifier=FakeIdentifier)
+        assert len(transformed) == 1 and failed == 1
+
+        report = instrumentation.report()
+        timings = report["timings"]
+        # the failing entry stops at its first failing transformer
+        assert timings["transform.is_valid_transform"]["calls"] == 1
+        assert timings["transform.observation_field_transformer"]["calls"] == 2
+        assert any(
+            name.startswith("transform.observation_field_transformer.mapping_transform[")
+            for name in timings
+        )
+        assert report["counters"]["transform.observation_field_transformer.failed"] == 1
+        assert "transform.is_valid_transform" in instrumentation.summary()
+
+    def test_timer_counts_failures(self):
+        instrumentation = instrument.enable()
+        with self.assertRaises(ValueError):
+            with instrument.timer("phase"):
+                raise ValueError()
+        instrument.count("phase.bytes", 10)
+        instrument.count("phase.bytes", 5)
+        report = instrumentation.report()
+        assert report["timings"]["phase"]["calls"] == 1
+        assert report["counters"] == {"phase.bytes": 15, "phase.failed": 1}
+
+    def test_disable_leaves_transformers_alone(self):
+        instrument.enable()
+        instrumentation = instrument.disable()
+        assert instrument.ACTIVE is None
+        transform_data([make_entry(1)], BUGGY_TRANSFORMERS, identifier=FakeIdentifier)
+        assert instrumentation.report() == {"timings": {}, "counters": {}}
+        assert not any(isinstance(t, TimedTransformer) for t in BUGGY_TRANSFORMERS)
+
+    def test_exports(self):
+        instrumentation = instrument.enable()
+        with instrument.timer("kobo.data"):
+            pass
+        instrument.count("kobo.attachments.bytes", 1024)
+        with tempfile.TemporaryDirectory() as directory:
+            json_path = os.path.join(directory, "timings.json")
+            prometheus_path = os.path.join(directory, "timings.prom")
+            instrumentation.to_json(json_path)
+            instrumentation.to_prometheus(prometheus_path)
+            with open(json_path) as fh:
+                report = json.load(fh)
+            with open(prometheus_path) as fh:
+                prometheus = fh.read()
+        assert report["timings"]["kobo.data"]["calls"] == 1
+        assert 'buggy_phase_calls_total{phase="kobo.data"} 1' in prometheus
+        assert 'buggy_events_total{name="kobo.attachments.bytes"} 1024' in prometheus
@@ -0,0 +1,132 @@
+import unittest
+import httpretty
+import json
+import os
+import tempfile
+
+from ..kobo import (
+    Kobo
+)
+
+def register_token_url():
+    httpretty.register_uri(
+        httpretty.GET, "https://kf.kobotoolbox.org/token?format=json",
+        body=json.dumps({"token": "what are you token about?"})
+    )
+
+class TestKobo(unittest.TestCase):
+
+    @httpretty.activate
+    def test_token_sent(self):
+        register_token_url()
+        httpretty.register_uri(
+            httpretty.GET, "https://kf.kobotoolbox.org/api/v2/assets/5678/data.json",
+            body=json.dumps({"results": []})
+        )
+
+        kobo = Kobo("user", "1234")
+        kobo.pull_data("5678")
+
+        assert httpretty.last_request().headers["Authorization"] == "Token what are you token about?"
+
+    @httpretty.activate
+    def test_query_passed(self):
+        register_token_url()
+        httpretty.register_uri(
+            httpretty.GET, "https://kf.kobotoolbox.org/api/v2/assets/5678/data.json",
+            body=json.dumps({"results": [{"_id": 3}]})
+        )
+
+        kobo = Kobo("user", "1234")
+        data = kobo.pull_data(
+            "5678",
+            query={"_id": {"$gt": 2}},
+            fields=["_id"],
+            sort={"_id": 1}
+        )
+
+        assert data == [{"_id": 3}]
+        querystring = httpretty.last_request().querystring
+        assert json.loads(querystring["query"][0]) == {"_id": {"$gt": 2}}
+        assert json.loads(querystring["fields"][0]) == ["_id"]
+        assert json.loads(querystring["sort"][0]) == {"_id": 1}
+
+    @httpretty.activate
+    def test_pages_followed(self):
+        register_token_url()
+
+        def respond(request, uri, headers):
+            start = int(request.querystring.get("start", ["0"])[0])
+            body = {"results": [{"_id": start + 1}, {"_id": start + 2}]}
+            if start < 4:
+                body["next"] = f"https://kf.kobotoolbox.org/api/v2/assets/5678/data.json?start={start + 2}"
+            return 200, headers, json.dumps(body)
+
+        httpretty.register_uri(
+            httpretty.GET, "https://kf.kobotoolbox.org/api/v2/assets/5678/data.json",
+            body=respond
+        )
+
+        kobo = Kobo("user", "1234")
+        data = kobo.pull_data("5678")
+
+        assert [entry["_id"] for entry in data] == [1, 2, 3, 4, 5, 6]
+
+    @httpretty.activate
+    def test_iter_data(self):
+        register_token_url()
+        kobo_data = [{"_id": i} for i in range(1, 8)]
+
+        def respond(request, uri, headers):
+            start = int(request.querystring.get("start", ["0"])[0])
+            limit = int(request.querystring["limit"][0])
+            body = {"results": kobo_data[start:start + limit]}
+            if start + limit < len(kobo_data):
+                body["next"] = "more"
+            return 200, headers, json.dumps(body)
+
+        httpretty.register_uri(
+            httpretty.GET, "https://kf.kobotoolbox.org/api/v2/assets/5678/data.json",
+            body=respond
+        )
+
+        kobo = Kobo("user", "1234")
+        data = list(kobo.iter_data("5678", page_size=3))
+
+        assert data == kobo_data
+        requests = [
+            request for request in httpretty.latest_requests()
+            if "data.json" in request.path
+        ]
+        assert len(requests) == 3
+        assert json.loads(requests[0].querystring["sort"][0]) == {"_id": 1}
+
+    @httpretty.activate
+    def test_pull_image(self):
+        register_token_url()
+        httpretty.register_uri(
+            httpretty.GET, "https://kf.kobotoolbox.org/api/v2/assets/5678/data/1/attachments/2/",
+            body=b"a picture of a bug"
+        )
+
+        kobo = Kobo("user", "1234")
+        with tempfile.TemporaryDirectory() as directory:
+            image_path = os.path.join(directory, "5678_1_2")
+            kobo.pull_image(image_path, "5678", 1, 2)
+            with open(image_path, "rb") as fh:
+                assert fh.read() == b"a picture of a bug"
+
+    @httpretty.activate
+    def test_open_image(self):
+        register_token_url()
+        httpretty.register_uri(
+            httpretty.GET, "https://kf.kobotoolbox.org/api/v2/assets/5678/data/1/attachments/2/",
+            body=b"a picture of a bug"
+        )
+
+        kobo = Kobo("user", "1234")
+        with kobo.open_image("5678", 1, 2) as fh:
+            assert fh.read() == b"a picture of a bug"
+        # past max_memory it spills to a temporary file and reads the same
+        with kobo.open_image("5678", 1, 2, max_memory=4) as fh:
+            assert fh.read() == b"a picture of a bug"
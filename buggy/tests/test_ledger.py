@@ -0,0 +1,52 @@
+import unittest
+import os
+import tempfile
+
+from ..ledger import (
+    UploadLedger
+)
+
+class TestUploadLedger(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "ledger.jsonl")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_missing_entry(self):
+        with UploadLedger(self.path) as ledger:
+            assert ledger.get("5678", 1) is None
+
+    def test_steps_persisted(self):
+        with UploadLedger(self.path) as ledger:
+            ledger.record_observation("5678", 1, 100)
+            ledger.record_image("5678", 1, 11)
+            ledger.record_field("5678", 1, 12552)
+            ledger.record_observation("1234", 1, 200)
+
+        with UploadLedger(self.path) as ledger:
+            assert ledger.get("5678", 1) == {
+                "observation_id": 100,
+                "images": {11},
+                "fields": {12552}
+            }
+            assert ledger.get("1234", 1) == {
+                "observation_id": 200,
+                "images": set(),
+                "fields": set()
+            }
+
+    def test_torn_write_ignored(self):
+        with UploadLedger(self.path) as ledger:
+            ledger.record_observation("5678", 1, 100)
+        with open(self.path, "a") as fh:
+            fh.write('{"uid": "5678", "inst')
+
+        with UploadLedger(self.path) as ledger:
+            assert ledger.get("5678", 1)["observation_id"] == 100
+            ledger.record_observation("5678", 2, 200)
+
+        with UploadLedger(self.path) as ledger:
+            assert ledger.get("5678", 1)["observation_id"] == 100
+            assert ledger.get("5678", 2)["observation_id"] == 200
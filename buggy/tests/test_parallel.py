@@ -0,0 +1,57 @@
+import unittest
+
+from ..compiler import compile_transformers
+from ..parallel import (
+    parallel_transform_data
+)
+from ..record import Observation
+from ..transform import (
+    BUGGY_TRANSFORMERS,
+    transform_data
+)
+from .test_batch import CountingIdentifier
+from .test_compiler import make_entry
+
+def sum_transform(entry: dict, **kwargs) -> tuple:
+    return "field", entry["field1"] + entry["field2"]
+
+class TestParallelTransformData(unittest.TestCase):
+    def test_order_and_failures(self):
+        data = [{"field1": i, "field2": i} for i in range(50)]
+        data[7] = {"field1": 1}
+        data[33] = {}
+
+        transformed_data, failed = parallel_transform_data(
+            data, [sum_transform], processes=3, chunk_size=4
+        )
+
+        assert transformed_data == transform_data(data, [sum_transform])[0]
+        assert failed == 2
+
+    def test_identifier_resolved_in_parent(self):
+        entries = [
+            make_entry(i, **{"session_info/input_email": f"volunteer{i % 5}@geemail.com"})
+            for i in range(1, 40)
+        ]
+
+        serial_identifier, parallel_identifier = CountingIdentifier(), CountingIdentifier()
+        expected = transform_data(entries, BUGGY_TRANSFORMERS, identifier=serial_identifier)
+        result = parallel_transform_data(
+            entries, compile_transformers(BUGGY_TRANSFORMERS),
+            processes=2, chunk_size=10,
+            identifier=parallel_identifier
+        )
+
+        assert result == expected
+        assert parallel_identifier.calls == serial_identifier.calls
+
+    def test_compact_records_resolved(self):
+        entries = [make_entry(i) for i in range(1, 10)]
+        expected, _ = transform_data(entries, BUGGY_TRANSFORMERS, identifier=CountingIdentifier())
+        transformed_data, failed = parallel_transform_data(
+            entries, BUGGY_TRANSFORMERS, processes=2, chunk_size=4,
+            compact=True, identifier=CountingIdentifier()
+        )
+
+        assert all(isinstance(record, Observation) for record in transformed_data)
+        assert [record.to_dict() for record in transformed_data] == expected
@@ -0,0 +1,151 @@
+import unittest
+import os
+import signal
+import tempfile
+
+from ..deadletter import DeadLetterStore
+from ..ledger import UploadLedger
+from ..pipeline import Pipeline
+from ..transform import BUGGY_TRANSFORMERS
+from .test_compiler import FakeIdentifier, make_entry
+from .test_upload import FakeiNaturalist, FakeKobo
+
+class PagingKobo(FakeKobo):
+    def __init__(self, entries, interrupt_after=None):
+        super().__init__()
+        self.entries = entries
+        self.interrupt_after = interrupt_after
+
+        self.pages = []
+
+    def pull_page(self, uid, query=None, fields=None, sort=None, start=0, limit=None):
+        self.pages.append(start)
+        if self.interrupt_after is not None and start <= self.interrupt_after < start + limit:
+            os.kill(os.getpid(), signal.SIGTERM)
+        results = self.entries[start:start + limit]
+        return {"results": results, "next": "more" if start + limit < len(self.entries) else None}
+
+class FailingiNaturalist(FakeiNaturalist):
+    def attach_observation_field(self, observation_id, field_id, value):
+        raise RuntimeError("iNaturalist is down")
+
+class FailingOnceiNaturalist(FakeiNaturalist):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.failed = False
+        self.after_failure = 0
+
+    def attach_image(self, observation_id, image_path, filename=None):
+        self.after_failure += self.failed
+        super().attach_image(observation_id, image_path, filename)
+
+    def attach_observation_field(self, observation_id, field_id, value):
+        self.after_failure += self.failed
+        if not self.failed:
+            self.failed = True
+            raise RuntimeError("iNaturalist is down")
+        super().attach_observation_field(observation_id, field_id, value)
+
+def make_entries(count):
+    entries = [make_entry(i) for i in range(1, count + 1)]
+    entries[3] = make_entry(4, **{"arthropod_documentation/quantity": "lots"})
+    entries[5] = make_entry(6, _validation_status={})
+    return entries
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.directory.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def test_all_records_uploaded(self):
+        kobo, inaturalist = PagingKobo(make_entries(30)), FakeiNaturalist()
+        with DeadLetterStore("dead_letters.jsonl") as dead_letters:
+            summary = Pipeline(
+                kobo, inaturalist, "5678", BUGGY_TRANSFORMERS,
+                transform_workers=2, prefetch_workers=3, create_workers=2, attach_workers=4,
+                queue_size=2, dead_letters=dead_letters, identifier=FakeIdentifier
+            ).run()
+            assert [letter["_id"] for letter in dead_letters.failures()] == [4]
+
+        assert summary["fetched"] == 30
+        assert summary["failed"] == 1
+        assert summary["skipped"] == 1
+        assert summary["uploaded"] == 28
+        assert summary["stopped"] is False
+        assert len(inaturalist.observations) == 28
+        assert len(inaturalist.images) == 2 * 28
+        fields_per_record = len(inaturalist.fields) // 28
+        assert fields_per_record > 0 and len(inaturalist.fields) == fields_per_record * 28
+        assert os.listdir(".") == ["dead_letters.jsonl"]
+
+    def test_resumes_from_ledger(self):
+        with UploadLedger("ledger.jsonl") as ledger:
+            Pipeline(
+                PagingKobo(make_entries(10)), FakeiNaturalist(), "5678", BUGGY_TRANSFORMERS,
+                ledger=ledger, in_memory=True, identifier=FakeIdentifier
+            ).run()
+
+        inaturalist = FakeiNaturalist()
+        with UploadLedger("ledger.jsonl") as ledger:
+            summary = Pipeline(
+                PagingKobo(make_entries(10)), inaturalist, "5678", BUGGY_TRANSFORMERS,
+                ledger=ledger, in_memory=True, identifier=FakeIdentifier
+            ).run()
+        assert summary["uploaded"] == 0
+        assert summary["skipped"] == 9
+        assert inaturalist.observations == []
+
+    def test_sigterm_drains(self):
+        kobo, inaturalist = PagingKobo(make_entries(200), interrupt_after=20), FakeiNaturalist(delay=0.001)
+        with UploadLedger("ledger.jsonl") as ledger:
+            summary = Pipeline(
+                kobo, inaturalist, "5678", BUGGY_TRANSFORMERS,
+                page_size=10, queue_size=4, ledger=ledger, in_memory=True, identifier=FakeIdentifier
+            ).run()
+
+            assert summary["stopped"] is True
+            assert summary["fetched"] < 200
+            # every observation that was created got all of its photos and fields
+            created = [
+                ledger.get("5678", instance) for instance in range(1, 201)
+                if ledger.get("5678", instance) is not None
+            ]
+        assert len(created) == summary["uploaded"] == len(inaturalist.observations)
+        assert all(len(done["images"]) == 2 for done in created)
+        assert signal.getsignal(signal.SIGTERM) is signal.SIG_DFL
+
+    def test_error_raised(self):
+        kobo = PagingKobo(make_entries(10))
+        with self.assertRaises(RuntimeError):
+            Pipeline(
+                kobo, FailingiNaturalist(), "5678", BUGGY_TRANSFORMERS,
+                in_memory=True, identifier=FakeIdentifier
+            ).run()
+
+    def test_pages_fetched_concurrently(self):
+        kobo, inaturalist = PagingKobo(make_entries(45)), FakeiNaturalist()
+        summary = Pipeline(
+            kobo, inaturalist, "5678", BUGGY_TRANSFORMERS,
+            page_size=10, fetch_workers=3, in_memory=True, identifier=FakeIdentifier
+        ).run()
+        assert summary["fetched"] == 45
+        assert summary["uploaded"] == 43
+        assert sorted(set(kobo.pages))[:5] == [0, 10, 20, 30, 40]
+        # workers stop soon after the last page instead of paging on forever
+        assert max(kobo.pages) <= 60
+
+    def test_error_stops_attach(self):
+        kobo, inaturalist = PagingKobo(make_entries(50)), FailingOnceiNaturalist(delay=0.001)
+        with self.assertRaises(RuntimeError):
+            Pipeline(
+                kobo, inaturalist, "5678", BUGGY_TRANSFORMERS,
+                attach_workers=1, queue_size=4, in_memory=True, identifier=FakeIdentifier
+            ).run()
+        # nothing queued behind the failure went out, and its photos were closed
+        assert inaturalist.after_failure == 0
+        assert all(buffer.closed for buffer in kobo.buffers)
@@ -0,0 +1,219 @@
+import unittest
+import io
+import json
+import socket
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep
+
+import requests
+
+from ..ratelimit import (
+    Scheduler,
+    TokenBucket
+)
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+class ThrottlingServer(ThreadingHTTPServer):
+    # answers the first `throttle` requests with a 429 and the rest with 200
+    def __init__(self, throttle, retry_after=None, status=429, delay=0):
+        super().__init__(("127.0.0.1", 0), ThrottlingHandler)
+        self.throttle = throttle
+        self.delay = delay
+        self.retry_after = retry_after
+        self.status = status
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+class ThrottlingHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        sleep(self.server.delay)
+        with self.server.lock:
+            self.server.requests.append((monotonic(), body))
+            throttled = len(self.server.requests) <= self.server.throttle
+        if throttled:
+            self.send_response(self.server.status)
+            if self.server.retry_after is not None:
+                self.send_header("Retry-After", str(self.server.retry_after))
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps({"id": 1}).encode())
+
+    do_GET = do_POST
+
+    def log_message(self, *args):
+        pass
+
+class TestTokenBucket(unittest.TestCase):
+    def test_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(2.0, 4, clock=clock, sleep=clock.sleep)
+        for _ in range(12):
+            bucket.acquire()
+
+        # four go out in the burst, the other eight at two a second
+        assert clock.now == 4.0
+
+    def test_cost(self):
+        clock = FakeClock()
+        bucket = TokenBucket(1.0, 3, clock=clock, sleep=clock.sleep)
+        bucket.acquire(3)
+        bucket.acquire(3)
+
+        assert clock.now == 3.0
+
+    def test_pause_and_recover(self):
+        clock = FakeClock()
+        bucket = TokenBucket(4.0, 4, clock=clock, sleep=clock.sleep)
+        bucket.pause(10)
+        bucket.throttled()
+        bucket.acquire()
+
+        assert clock.now == 10.0
+        assert bucket.rate == 2.0
+        for _ in range(500):
+            bucket.succeeded()
+        assert bucket.rate == 4.0
+
+class TestScheduler(unittest.TestCase):
+    def serve(self, server):
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def test_retry_after_honoured(self):
+        server = self.serve(ThrottlingServer(throttle=2, retry_after=0.2))
+        scheduler = Scheduler(buckets={"inaturalist": TokenBucket(100.0, 10)})
+
+        response = scheduler.request(
+            requests.Session(), "POST", f"{server.url}/observations",
+            "inaturalist.observations", json={}
+        )
+
+        assert response.status_code == 200
+        times = [t for t, _ in server.requests]
+        assert len(times) == 3
+        assert times[1] - times[0] >= 0.2
+        assert times[2] - times[1] >= 0.2
+
+    def test_backoff_on_server_error(self):
+        server = self.serve(ThrottlingServer(throttle=2, status=503))
+        sleeps = []
+        scheduler = Scheduler(
+            buckets={"kobo": TokenBucket(100.0, 10)},
+            backoff=0.01, sleep=sleeps.append
+        )
+
+        response = scheduler.request(
+            requests.Session(), "GET", f"{server.url}/data.json", "kobo.data"
+        )
+
+        assert response.status_code == 200
+        assert len(sleeps) == 2
+        assert 0 <= sleeps[0] <= 0.01 and 0 <= sleeps[1] <= 0.02
+
+    def test_post_not_repeated_on_server_error(self):
+        server = self.serve(ThrottlingServer(throttle=2, status=503))
+        scheduler = Scheduler(buckets={"inaturalist": TokenBucket(100.0, 10)}, backoff=0.01)
+
+        response = scheduler.request(
+            requests.Session(), "POST", f"{server.url}/observations",
+            "inaturalist.observations", json={}
+        )
+
+        assert response.status_code == 503
+        assert len(server.requests) == 1
+
+    def test_post_not_repeated_on_read_timeout(self):
+        server = self.serve(ThrottlingServer(throttle=0, delay=0.5))
+        scheduler = Scheduler(buckets={"inaturalist": TokenBucket(100.0, 10)}, backoff=0.01)
+
+        with self.assertRaises(requests.ReadTimeout):
+            scheduler.request(
+                requests.Session(), "POST", f"{server.url}/observations",
+                "inaturalist.observations", json={}, timeout=0.1
+            )
+        sleep(0.5)
+        assert len(server.requests) == 1
+
+    def test_post_repeated_when_never_sent(self):
+        with socket.socket() as closed:
+            closed.bind(("127.0.0.1", 0))
+            port = closed.getsockname()[1]
+        sleeps = []
+        scheduler = Scheduler(
+            buckets={"inaturalist": TokenBucket(100.0, 10)},
+            max_retries=2, backoff=0.01, sleep=sleeps.append
+        )
+
+        with self.assertRaises(requests.ConnectionError):
+            scheduler.request(
+                requests.Session(), "POST", f"http://127.0.0.1:{port}/observations",
+                "inaturalist.observations", json={}
+            )
+        assert len(sleeps) == 2
+
+    def test_gives_up(self):
+        server = self.serve(ThrottlingServer(throttle=100, retry_after=0))
+        scheduler = Scheduler(buckets={"inaturalist": TokenBucket(100.0, 10)}, max_retries=2)
+
+        response = scheduler.request(
+            requests.Session(), "POST", f"{server.url}/observations",
+            "inaturalist.observations", json={}
+        )
+
+        assert response.status_code == 429
+        assert len(server.requests) == 3
+
+    def test_upload_rewound(self):
+        server = self.serve(ThrottlingServer(throttle=1, retry_after=0))
+        scheduler = Scheduler(buckets={"inaturalist": TokenBucket(100.0, 10)})
+
+        scheduler.request(
+            requests.Session(), "POST", f"{server.url}/observation_photos",
+            "inaturalist.observation_photos",
+            files={"file": ("5678_1_2", io.BytesIO(b"a picture of a bug"))}
+        )
+
+        assert all(b"a picture of a bug" in body for _, body in server.requests)
+
+    def test_throughput_under_ceiling(self):
+        server = self.serve(ThrottlingServer(throttle=0))
+        scheduler = Scheduler(buckets={"inaturalist": TokenBucket(20.0, 2)})
+        session = requests.Session()
+
+        def post():
+            for _ in range(5):
+                scheduler.request(
+                    session, "POST", f"{server.url}/observation_field_values",
+                    "inaturalist.observation_field_values", json={}
+                )
+        threads = [threading.Thread(target=post) for _ in range(4)]
+        start = monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # 2 in the burst then 18 more at 20 a second
+        assert len(server.requests) == 20
+        assert monotonic() - start >= 0.85
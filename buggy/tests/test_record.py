@@ -0,0 +1,87 @@
+import unittest
+import os
+import pickle
+import tempfile
+
+from unittest import mock
+
+from ..record import (
+    _FIELD_IDS,
+    MAX_FIELD_ID_SETS,
+    Observation,
+    to_observation
+)
+from ..records import RecordFile, write_records
+from ..transform import (
+    BUGGY_TRANSFORMERS,
+    transform_data
+)
+from ..upload import upload_data
+from .test_compiler import FakeIdentifier, make_entry
+from .test_upload import FakeiNaturalist, FakeKobo, make_record
+
+class TestObservation(unittest.TestCase):
+    def test_reads_like_a_dict(self):
+        record = make_record(1)
+        observation = Observation.from_dict(record)
+
+        assert observation.to_dict() == record
+        assert observation == record
+        assert set(dict(observation)) == set(record)
+        assert observation['taxa'] == 47208
+        assert observation.get('duplicate_of') is None
+        assert pickle.loads(pickle.dumps(observation)) == observation
+        with self.assertRaises(KeyError):
+            observation['duplicate_of']
+        with self.assertRaises(AttributeError):
+            observation.extra = 1
+
+    def test_field_ids_shared(self):
+        first, second = Observation.from_dict(make_record(1)), Observation.from_dict(make_record(2))
+        assert first.field_ids is second.field_ids
+
+    def test_field_ids_bounded(self):
+        with mock.patch.dict(_FIELD_IDS, clear=True):
+            for i in range(MAX_FIELD_ID_SETS + 10):
+                record = make_record(1)
+                record["observation_fields"] = {f"{i}": 1}
+                assert Observation.from_dict(record)["observation_fields"] == {f"{i}": 1}
+            assert len(_FIELD_IDS) == MAX_FIELD_ID_SETS
+
+    def test_other_shapes_stay_dicts(self):
+        duplicate = dict(make_record(1), duplicate_of=["5678", 2], is_valid=False)
+        with self.assertRaises(ValueError):
+            Observation.from_dict(duplicate)
+        assert to_observation(duplicate) is duplicate
+
+        custom = [lambda entry, **kwargs: ("instance", entry["_id"])]
+        records, _ = transform_data([make_entry(1)], custom, compact=True)
+        assert records == [{"instance": 1}]
+
+    def test_compact_transform(self):
+        entries = [make_entry(i) for i in range(1, 6)]
+        entries.append(make_entry(6, **{"arthropod_documentation/quantity": "lots"}))
+        records, failed = transform_data(entries, BUGGY_TRANSFORMERS, identifier=FakeIdentifier)
+        observations, compact_failed = transform_data(entries, BUGGY_TRANSFORMERS, identifier=FakeIdentifier, compact=True)
+
+        assert all(isinstance(observation, Observation) for observation in observations)
+        assert [observation.to_dict() for observation in observations] == records
+        assert compact_failed == failed == 1
+
+    def test_upload_and_write(self):
+        observations = [Observation.from_dict(make_record(i)) for i in range(1, 6)]
+        kobo, inaturalist = FakeKobo(), FakeiNaturalist()
+        with tempfile.TemporaryDirectory() as directory:
+            cwd = os.getcwd()
+            os.chdir(directory)
+            try:
+                upload_data(observations, "5678", inaturalist, kobo, workers=2)
+                write_records(observations, "data.ndjson")
+                with RecordFile("data.ndjson") as records:
+                    assert records.get(3) == make_record(3)
+            finally:
+                os.chdir(cwd)
+
+        assert len(inaturalist.observations) == 5
+        assert len(inaturalist.images) == 10
+        assert sorted(inaturalist.fields)[:2] == [(1, 12552, "Other"), (1, 15607, 1.5)]
@@ -0,0 +1,63 @@
+import unittest
+import os
+import tempfile
+
+from ..records import (
+    RecordFile,
+    RecordWriter,
+    index_path,
+    write_records
+)
+from ..upload import upload_data
+from .test_upload import FakeiNaturalist, FakeKobo, make_record
+
+class TestRecords(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "data.ndjson")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        records = [make_record(i) for i in range(1, 51)]
+        assert write_records(records, self.path) == 50
+
+        with open(self.path) as fh:
+            assert len(fh.readlines()) == 50
+        with RecordFile(self.path) as record_file:
+            assert len(record_file) == 50
+            assert list(record_file) == records
+            assert record_file.get(17) == records[16]
+            assert list(record_file.iter_from(record_file.offset(48))) == records[47:]
+
+    def test_without_index(self):
+        with RecordWriter(self.path) as writer:
+            offsets = [writer.write(make_record(i)) for i in range(1, 6)]
+        os.remove(index_path(self.path))
+
+        with RecordFile(self.path) as record_file:
+            assert len(record_file) == 5
+            assert record_file.offset(3) == offsets[2]
+            assert record_file.get(5) == make_record(5)
+
+    def test_empty(self):
+        write_records([], self.path)
+        with RecordFile(self.path) as record_file:
+            assert len(record_file) == 0
+            assert list(record_file) == []
+
+    def test_upload_from_file(self):
+        write_records([make_record(i) for i in range(1, 11)], self.path)
+        kobo, inaturalist = FakeKobo(), FakeiNaturalist()
+        cwd = os.getcwd()
+        os.chdir(self.directory.name)
+        try:
+            with RecordFile(self.path) as record_file:
+                upload_data(record_file, "5678", inaturalist, kobo, workers=2)
+        finally:
+            os.chdir(cwd)
+
+        assert len(inaturalist.observations) == 10
+        assert len(inaturalist.images) == 20
+        assert len(inaturalist.fields) == 20
@@ -0,0 +1,168 @@
+import unittest
+import os
+import tempfile
+
+from functools import partial
+
+from ..identifier import FANIdentifier
+from ..resultcache import (
+    TransformCache,
+    submission_fingerprint,
+    transformer_fingerprint
+)
+from ..transform import (
+    BUGGY_TRANSFORMERS,
+    OBSERVATION_FIELD_IDS,
+    cached_transform_data,
+    mapping_transform,
+    transform_data
+)
+from .test_compiler import FakeIdentifier, make_entry
+
+THRESHOLD = 1
+
+def threshold_transform(entry, **kwargs):
+    return "field", entry["a"] > THRESHOLD
+
+class TestFingerprints(unittest.TestCase):
+    def test_transformer_fingerprint(self):
+        assert transformer_fingerprint(BUGGY_TRANSFORMERS) == transformer_fingerprint(list(BUGGY_TRANSFORMERS))
+
+        a = partial(mapping_transform, "key", "output", {"a": 1}, None)
+        b = partial(mapping_transform, "key", "output", {"a": 2}, None)
+        assert transformer_fingerprint([a]) != transformer_fingerprint([b])
+
+        one = lambda entry, **kwargs: ("field", entry["field"] + 1)
+        two = lambda entry, **kwargs: ("field", entry["field"] + 2)
+        assert transformer_fingerprint([one]) != transformer_fingerprint([two])
+
+    def test_closures_fingerprinted(self):
+        def make(key):
+            def transform(entry, **kwargs):
+                return "field", entry[key]
+            return transform
+        assert transformer_fingerprint([make("a")]) == transformer_fingerprint([make("a")])
+        assert transformer_fingerprint([make("a")]) != transformer_fingerprint([make("b")])
+
+        def recursive(entry, **kwargs):
+            return "field", len(recursive.__name__)
+        def outer():
+            def inner(entry, **kwargs):
+                return "field", inner
+            return inner
+        transformer_fingerprint([recursive, outer()])
+
+    def test_module_data_fingerprinted(self):
+        global THRESHOLD
+        before = transformer_fingerprint([threshold_transform])
+        THRESHOLD = 2
+        try:
+            assert transformer_fingerprint([threshold_transform]) != before
+        finally:
+            THRESHOLD = 1
+
+    def test_submission_fingerprint(self):
+        assert submission_fingerprint({"a": 1, "b": 2}) == submission_fingerprint({"b": 2, "a": 1})
+        assert submission_fingerprint({"a": 1}) != submission_fingerprint({"a": 2})
+
+        entry = make_entry(1, _uuid="1234", _submission_time="2022-05-01T13:00:00")
+        edited = make_entry(1, _uuid="5678", _submission_time="2022-05-01T13:00:00")
+        reviewed = make_entry(1, _uuid="1234", _submission_time="2022-05-01T13:00:00", _validation_status={})
+        assert submission_fingerprint(entry) == submission_fingerprint(dict(entry))
+        assert submission_fingerprint(entry) != submission_fingerprint(edited)
+        assert submission_fingerprint(entry) != submission_fingerprint(reviewed)
+
+class TestCachedTransformData(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "transform_cache.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_matches_transform_data(self):
+        entries = [make_entry(i) for i in range(1, 6)]
+        entries.append(make_entry(6, **{"arthropod_documentation/quantity": "lots"}))
+        expected = transform_data(entries, BUGGY_TRANSFORMERS, identifier=FakeIdentifier)
+
+        cache = TransformCache(self.path)
+        assert cached_transform_data(entries, "5678", BUGGY_TRANSFORMERS, cache, identifier=FakeIdentifier) == expected
+        assert len(cache) == 5
+        cache.close()
+
+        cache = TransformCache(self.path)
+        assert cached_transform_data(entries, "5678", BUGGY_TRANSFORMERS, cache, identifier=FakeIdentifier) == expected
+        cache.close()
+
+    def test_invalidation(self):
+        calls = []
+        def field_transform(entry, **kwargs):
+            calls.append(entry["_id"])
+            return "field", entry["field"] + 1
+        def fixed_field_transform(entry, **kwargs):
+            calls.append(entry["_id"])
+            return "field", entry["field"] + 2
+
+        data = [{"_id": i, "field": i} for i in range(10)]
+        cache = TransformCache(self.path)
+        cached_transform_data(data, "5678", [field_transform], cache)
+        assert len(calls) == 10
+
+        # unchanged submissions are served from the cache
+        calls.clear()
+        data[3] = {"_id": 3, "field": 30}
+        transformed_data, failed = cached_transform_data(data, "5678", [field_transform], cache)
+        assert calls == [3]
+        assert transformed_data[3] == {"field": 31}
+
+        # another asset with the same _ids is cached separately
+        calls.clear()
+        cached_transform_data(data, "1234", [field_transform], cache)
+        assert len(calls) == 10
+
+        # a changed transformer invalidates everything it made
+        calls.clear()
+        transformed_data, failed = cached_transform_data(data, "5678", [fixed_field_transform], cache)
+        assert len(calls) == 10
+        assert transformed_data[0] == {"field": 2}
+
+    def test_identifier_database_in_config(self):
+        entries = [make_entry(i) for i in range(1, 4)]
+        cache = TransformCache(self.path)
+        first = FANIdentifier(os.path.join(self.directory.name, "first.sqlite"))
+        second = FANIdentifier(os.path.join(self.directory.name, "second.sqlite"))
+        cached_transform_data(entries, "5678", BUGGY_TRANSFORMERS, cache, identifier=first)
+
+        # the other database has never seen this observer, so the records
+        # are transformed again and the code comes from it
+        transformed_data, _ = cached_transform_data(entries, "5678", BUGGY_TRANSFORMERS, cache, identifier=second)
+        observer = OBSERVATION_FIELD_IDS["EwA - Observer Code"]
+        codes = {record["observation_fields"][observer] for record in transformed_data}
+        assert codes == {second.db_content["garlicbread@geemail.com"]}
+        first.close()
+        second.close()
+        cache.close()
+
+    def test_only_hits_touched(self):
+        def field_transform(entry, **kwargs):
+            return "field", entry["field"]
+
+        cache = TransformCache(self.path)
+        cached_transform_data([{"_id": i, "field": i} for i in range(4)], "5678", [field_transform], cache)
+        with cache.connection:
+            cache.connection.execute("UPDATE results SET last_used = 0")
+
+        cached_transform_data([{"_id": 0, "field": 0}, {"_id": 1, "field": 1}], "5678", [field_transform], cache)
+        last_used = dict(cache.connection.execute("SELECT entry_id, last_used FROM results"))
+        assert last_used["0"] > 0 and last_used["1"] > 0
+        assert last_used["2"] == 0 and last_used["3"] == 0
+        cache.close()
+
+    def test_eviction(self):
+        cache = TransformCache(self.path, max_bytes=2000)
+        for i in range(100):
+            cache.put("5678", i, "submission", "config", {"field": "x" * 50})
+        assert 0 < len(cache) < 100
+        assert cache.get("5678", 99, "submission", "config") == {"field": "x" * 50}
+        assert cache.get("5678", 0, "submission", "config") is None
+        assert cache.get("5678", 99, "changed", "config") is None
@@ -0,0 +1,79 @@
+import unittest
+import httpretty
+import json
+import os
+import tempfile
+
+from functools import partial
+
+from ..identifier import FANIdentifier
+from ..kobo import Kobo
+from ..runner import (
+    run_assets,
+    summarize
+)
+from ..transform import identifier_transform
+
+def register_asset(uid, results):
+    httpretty.register_uri(
+        httpretty.GET, f"https://kf.kobotoolbox.org/api/v2/assets/{uid}/data.json",
+        body=json.dumps({"results": results})
+    )
+
+class TestRunAssets(unittest.TestCase):
+
+    @httpretty.activate
+    def test_assets_run_together(self):
+        httpretty.register_uri(
+            httpretty.GET, "https://kf.kobotoolbox.org/token?format=json",
+            body=json.dumps({"token": "what are you token about?"})
+        )
+        register_asset("north", [
+            {"_id": i, "email": f"volunteer{i % 7}@geemail.com"} for i in range(20)
+        ] + [{"email": "volunteer0@geemail.com"}])
+        register_asset("south", [
+            {"_id": i, "email": f"volunteer{i % 11}@geemail.com"} for i in range(30)
+        ])
+        httpretty.register_uri(
+            httpretty.GET, "https://kf.kobotoolbox.org/api/v2/assets/gone/data.json",
+            status=404
+        )
+
+        observer = partial(identifier_transform, "email", "observer")
+        instance = lambda entry, **kwargs: ("instance", entry["_id"])
+        assets = {
+            "north": [observer, instance],
+            "south": [instance, observer],
+            "gone": [instance]
+        }
+
+        with tempfile.TemporaryDirectory() as directory:
+            identifier = FANIdentifier(os.path.join(directory, "db.sqlite"))
+            runs = run_assets(
+                Kobo("user", "1234"), assets, workers=3,
+                output_directory=directory, dead_letter_directory=directory,
+                identifier=identifier
+            )
+            with open(os.path.join(directory, "south.json")) as fh:
+                south = json.load(fh)
+            assert os.path.exists(os.path.join(directory, "north.dead_letters.jsonl"))
+
+        assert runs["north"].failed == 1
+        assert len(runs["north"].transformed) == 20
+        assert south == runs["south"].transformed
+
+        # the shared identifier gives each volunteer one code across assets
+        for record in runs["north"].transformed:
+            assert record["observer"] == identifier.get_identifier(f"volunteer{record['instance'] % 7}@geemail.com")
+        for record in runs["south"].transformed:
+            assert record["observer"] == identifier.get_identifier(f"volunteer{record['instance'] % 11}@geemail.com")
+        assert len(identifier.db_content) == 11
+        assert len(set(identifier.db_content.values())) == 11
+
+        assert "HTTPError" in runs["gone"].error
+        summary = summarize(runs)
+        assert summary["assets"] == 3
+        assert summary["transformed"] == 50
+        assert summary["failed"] == 1
+        assert summary["errors"] == ["gone"]
+        assert summary["per_asset"]["gone"]["transformed"] is None
@@ -0,0 +1,41 @@
+import unittest
+import httpretty
+import json
+
+from ..inaturalist import iNaturalist
+from ..kobo import Kobo
+from ..session import (
+    make_session
+)
+from .test_inaturalist import register_token_urls
+from .test_kobo import register_token_url
+
+class TestMakeSession(unittest.TestCase):
+    def test_pool_sizes(self):
+        session = make_session(pool_size=4, host_pool_sizes={"https://api.inaturalist.org": 32})
+
+        assert session.get_adapter("https://kf.kobotoolbox.org/api").poolmanager.connection_pool_kw["maxsize"] == 4
+        assert session.get_adapter("https://api.inaturalist.org/v1").poolmanager.connection_pool_kw["maxsize"] == 32
+
+    @httpretty.activate
+    def test_shared_between_clients(self):
+        register_token_url()
+        register_token_urls()
+        httpretty.register_uri(
+            httpretty.GET, "https://kf.kobotoolbox.org/api/v2/assets/5678/data.json",
+            body=json.dumps({"results": []})
+        )
+        httpretty.register_uri(
+            httpretty.POST, "https://api.inaturalist.org/v1/observation_field_values",
+            body=json.dumps({})
+        )
+
+        session = make_session()
+        kobo = Kobo("user", "1234", session=session)
+        inaturalist = iNaturalist("id", "secret", "user", "1234", session=session)
+
+        kobo.pull_data("5678")
+        assert httpretty.last_request().headers["Authorization"] == "Token what are you token about?"
+        inaturalist.attach_observation_field(42, 12552, "Other")
+        assert httpretty.last_request().headers["Authorization"] == "a very tokenistic gesture"
+        assert "Authorization" not in session.headers
@@ -1,12 +1,21 @@
 import unittest
 import httpretty
 import json
+import os
+import tempfile
 
 from functools import partial
 
 from ..transform import (
+    APPROVED,
+    BUGGY_FIELDS,
+    BUGGY_TRANSFORMERS,
     notes_transform,
     pull_and_transform_data,
+    pull_and_transform_new_data,
+    reprocess_dead_letters,
+    stream_and_transform_data,
+    transform_data,
     mapping_transform,
     convert_key_transform,
     observation_field_transformer,
@@ -14,6 +23,11 @@ from ..transform import (
     identifier_transform
 )
 
+from ..deadletter import DeadLetterStore
+from ..kobo import Kobo as BuggyKobo
+from .test_compiler import FakeIdentifier as EmailPrefixIdentifier, make_entry
+from ..watermark import Watermarks
+
 from gluon.kobo.client import KoboClient as Kobo
 
 def register_token_url():
@@ -85,6 +99,258 @@ class TestPullAndTransformData(unittest.TestCase):
         assert transformed_data == expected_data
         assert failed == 0
 
+class TestValidationPushdown(unittest.TestCase):
+
+    @httpretty.activate
+    def test_statuses_and_fields_sent(self):
+        register_token_url()
+
+        kobo_data = [
+            make_entry(1, extra="not needed"),
+            make_entry(2, _validation_status={"uid": "validation_status_on_hold"}),
+            make_entry(3, _validation_status={}),
+            make_entry(4)
+        ]
+        queries = []
+
+        def respond(request, uri, headers):
+            query = json.loads(request.querystring["query"][0])
+            fields = json.loads(request.querystring["fields"][0])
+            queries.append(query)
+            statuses = query["$and"][1]["_validation_status.uid"]["$in"] if "$and" in query else query["_validation_status.uid"]["$in"]
+            results = [
+                {key: value for key, value in entry.items() if key in fields}
+                for entry in kobo_data
+                if entry["_validation_status"].get("uid") in statuses
+            ]
+            return 200, headers, json.dumps({"results": results})
+
+        httpretty.register_uri(
+            httpretty.GET, "https://kf.kobotoolbox.org/api/v2/assets/5678/data.json",
+            body=respond
+        )
+
+        kobo = BuggyKobo("user", "1234")
+        transformed_data, failed = pull_and_transform_data(
+            kobo, "5678", BUGGY_TRANSFORMERS,
+            statuses=APPROVED, fields=BUGGY_FIELDS, identifier=EmailPrefixIdentifier
+        )
+        expected, _ = transform_data([kobo_data[0], kobo_data[3]], BUGGY_TRANSFORMERS, identifier=EmailPrefixIdentifier)
+        assert transformed_data == expected
+        assert queries[-1] == {"_validation_status.uid": {"$in": ["validation_status_approved"]}}
+
+        with tempfile.TemporaryDirectory() as directory:
+            watermarks = Watermarks(os.path.join(directory, "watermarks.json"))
+            watermarks.set("5678", 1)
+            # submissions approved after the mark moved past them would be lost
+            with self.assertRaises(ValueError):
+                pull_and_transform_new_data(
+                    kobo, "5678", BUGGY_TRANSFORMERS, watermarks,
+                    statuses=APPROVED, fields=BUGGY_FIELDS, identifier=EmailPrefixIdentifier
+                )
+        assert len(queries) == 1
+
+class TestPullAndTransformNewData(unittest.TestCase):
+
+    @httpretty.activate
+    def test_watermark(self):
+        register_token_url()
+
+        kobo_data = [
+            {"_id": 1, "field1": 1},
+            {"_id": 2, "field1": 3},
+            {"_id": 3, "field1": 5},
+        ]
+
+        def respond(request, uri, headers):
+            query = json.loads(request.querystring.get("query", ["{}"])[0])
+            mark = query.get("_id", {}).get("$gt", 0)
+            results = [entry for entry in kobo_data if entry["_id"] > mark]
+            return 200, headers, json.dumps({"results": results})
+
+        httpretty.register_uri(
+            httpretty.GET, "https://kf.kobotoolbox.org/api/v2/assets/5678/data.json",
+            body=respond
+        )
+
+        kobo = BuggyKobo("user", "1234")
+        uid = "5678"
+        transformers = [lambda entry, **kwargs: ("field", entry["field1"])]
+
+        with tempfile.TemporaryDirectory() as directory:
+            watermarks = Watermarks(os.path.join(directory, "watermarks.json"))
+
+            transformed_data, failed = pull_and_transform_new_data(kobo, uid, transformers, watermarks)
+            assert transformed_data == [{"field": 1}, {"field": 3}, {"field": 5}]
+            assert failed == 0
+            watermarks.commit()
+
+            kobo_data.append({"_id": 4, "field1": 7})
+            watermarks = Watermarks(os.path.join(directory, "watermarks.json"))
+            transformed_data, failed = pull_and_transform_new_data(kobo, uid, transformers, watermarks)
+            assert transformed_data == [{"field": 7}]
+            # nothing moves until the records are saved
+            assert watermarks.get(uid) == 3
+            watermarks.commit()
+            assert watermarks.get(uid) == 4
+
+            transformed_data, failed = pull_and_transform_new_data(kobo, uid, transformers, watermarks)
+            watermarks.commit()
+            assert transformed_data == []
+            assert watermarks.get(uid) == 4
+
+    @httpretty.activate
+    def test_watermark_stops_before_failures(self):
+        register_token_url()
+
+        kobo_data = [{"_id": i, "field1": i} for i in range(1, 6)]
+
+        def respond(request, uri, headers):
+            query = json.loads(request.querystring.get("query", ["{}"])[0])
+            mark = query.get("_id", {}).get("$gt", 0)
+            results = [entry for entry in kobo_data if entry["_id"] > mark]
+            return 200, headers, json.dumps({"results": results})
+
+        httpretty.register_uri(
+            httpretty.GET, "https://kf.kobotoolbox.org/api/v2/assets/5678/data.json",
+            body=respond
+        )
+
+        kobo = BuggyKobo("user", "1234")
+        broken = {3}
+        def transformer(entry, **kwargs):
+            if entry["_id"] in broken:
+                raise ValueError("bad entry")
+            return "field", entry["field1"]
+
+        with tempfile.TemporaryDirectory() as directory:
+            watermarks = Watermarks(os.path.join(directory, "watermarks.json"))
+            transformed_data, failed = pull_and_transform_new_data(kobo, "5678", [transformer], watermarks)
+            watermarks.commit()
+            assert failed == 1
+            assert transformed_data == [{"field": 1}, {"field": 2}]
+            assert watermarks.get("5678") == 2
+
+            # still broken: 4 and 5 are held back rather than sent twice
+            transformed_data, failed = pull_and_transform_new_data(kobo, "5678", [transformer], watermarks)
+            watermarks.commit()
+            assert failed == 1
+            assert transformed_data == []
+            assert watermarks.get("5678") == 2
+
+            # fixed, so 3 comes through with 4 and 5, each of them once
+            broken.clear()
+            transformed_data, failed = pull_and_transform_new_data(kobo, "5678", [transformer], watermarks)
+            watermarks.commit()
+            assert transformed_data == [{"field": 3}, {"field": 4}, {"field": 5}]
+            assert watermarks.get("5678") == 5
+
+            # with a dead letter store the failure waits there instead
+            kobo_data.append({"_id": 6, "field1": 6})
+            broken.add(6)
+            with DeadLetterStore(os.path.join(directory, "dead_letters.jsonl")) as dead_letters:
+                transformed_data, failed = pull_and_transform_new_data(
+                    kobo, "5678", [transformer], watermarks, dead_letters=dead_letters
+                )
+                watermarks.commit()
+                assert failed == 1
+                assert len(dead_letters) == 1
+            assert watermarks.get("5678") == 6
+
+class TestStreamAndTransformData(unittest.TestCase):
+
+    @httpretty.activate
+    def test_failures_yielded(self):
+        register_token_url()
+
+        kobo_data = [
+            {"_id": 1, "field1": 1},
+            {"_id": 2},
+            {"_id": 3, "field1": 5},
+        ]
+
+        def respond(request, uri, headers):
+            start = int(request.querystring.get("start", ["0"])[0])
+            limit = int(request.querystring["limit"][0])
+            body = {"results": kobo_data[start:start + limit]}
+            if start + limit < len(kobo_data):
+                body["next"] = "more"
+            return 200, headers, json.dumps(body)
+
+        httpretty.register_uri(
+            httpretty.GET, "https://kf.kobotoolbox.org/api/v2/assets/5678/data.json",
+            body=respond
+        )
+
+        kobo = BuggyKobo("user", "1234")
+
+        def field_transform(entry, **kwargs):
+            return "field", entry["field1"] + kwargs["offset"]
+        transformers = [field_transform]
+
+        results = list(stream_and_transform_data(kobo, "5678", transformers, page_size=2, offset=10))
+
+        assert results[0] == ({"field": 11}, None)
+        assert results[2] == ({"field": 15}, None)
+        transformed, failure = results[1]
+        assert transformed is None
+        assert failure.entry == {"_id": 2}
+        assert failure.transformer == "field_transform"
+        assert "KeyError" in failure.traceback
+
+class TestReprocessDeadLetters(unittest.TestCase):
+
+    @httpretty.activate
+    def test_only_failures_rerun(self):
+        register_token_url()
+
+        kobo_data = [
+            {"_id": 1, "field1": 1},
+            {"_id": 2, "field1": "2"},
+            {"_id": 3, "field1": 5},
+            {"_id": 4},
+        ]
+
+        httpretty.register_uri(
+            httpretty.GET, "https://kf.kobotoolbox.org/api/v2/assets/5678/data.json",
+            body=json.dumps({"results": kobo_data})
+        )
+
+        kobo = BuggyKobo("user", "1234")
+        calls = []
+
+        def field_transform(entry, **kwargs):
+            calls.append(entry["_id"])
+            return "field", entry["field1"] + 1
+
+        def fixed_field_transform(entry, **kwargs):
+            calls.append(entry["_id"])
+            return "field", int(entry["field1"]) + 1
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "dead_letters.jsonl")
+            with DeadLetterStore(path) as dead_letters:
+                transformed_data, failed = pull_and_transform_data(
+                    kobo, "5678", [field_transform], dead_letters=dead_letters
+                )
+                assert transformed_data == [{"field": 2}, {"field": 6}]
+                assert failed == 2
+
+            with DeadLetterStore(path) as dead_letters:
+                assert dead_letters.get("5678/2")["transformer"] == "field_transform"
+                assert "TypeError" in dead_letters.get("5678/2")["traceback"]
+                assert dead_letters.get("5678/4")["entry"] == {"_id": 4}
+
+                calls.clear()
+                transformed_data, failed = reprocess_dead_letters(dead_letters, [fixed_field_transform])
+                assert sorted(calls) == [2, 4]
+                assert transformed_data == [{"field": 3}]
+                assert failed == 1
+
+            with DeadLetterStore(path) as dead_letters:
+                assert len(dead_letters) == 1
+                assert "KeyError" in dead_letters.get("5678/4")["traceback"]
+
 class TestMappingTransform(unittest.TestCase):
     def setUp(self):
         entry_key = "survey_field"
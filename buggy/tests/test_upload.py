@@ -0,0 +1,240 @@
+import unittest
+import io
+import os
+import tempfile
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+
+from ..cache import ImageCache
+from ..ledger import UploadLedger
+from ..upload import (
+    upload_data,
+    upload_record
+)
+
+class FakeKobo(object):
+    def __init__(self):
+        self.pulled = []
+        self.buffers = []
+
+    def pull_image(self, image_path, uid, instance, image):
+        with open(image_path, "w") as fh:
+            fh.write(f"{uid} {instance} {image}")
+        self.pulled.append((uid, instance, image))
+
+    def open_image(self, uid, instance, image):
+        self.pulled.append((uid, instance, image))
+        buffer = io.BytesIO(f"{uid} {instance} {image}".encode())
+        self.buffers.append(buffer)
+        return buffer
+
+class FakeiNaturalist(object):
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.observations = []
+        self.images = []
+        self.fields = []
+        self.embedded = []
+
+    def upload_base_observation(self, taxa, longitude, latitude, ts, positional_accuracy, notes, observation_fields=None):
+        sleep(self.delay)
+        with self.lock:
+            self.observations.append((taxa, longitude, latitude, ts, positional_accuracy, notes))
+            if observation_fields is not None:
+                self.embedded.append((len(self.observations), observation_fields))
+            return len(self.observations)
+
+    def attach_image(self, observation_id, image_path, filename=None):
+        sleep(self.delay)
+        if isinstance(image_path, str):
+            with open(image_path, "r") as fh:
+                content = fh.read()
+        else:
+            content = image_path.read().decode()
+            assert filename == "_".join(content.split(" "))
+        with self.lock:
+            self.images.append((observation_id, content))
+
+    def attach_observation_field(self, observation_id, field_id, value):
+        sleep(self.delay)
+        with self.lock:
+            self.fields.append((observation_id, field_id, value))
+
+class InTemporaryDirectory(unittest.TestCase):
+    # photos are pulled into the working directory
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+def make_record(instance, is_valid=True):
+    return {
+        "instance": instance,
+        "is_valid": is_valid,
+        "images": [instance * 10 + 1, instance * 10 + 2],
+        "taxa": 47208,
+        "longitude": -149.9,
+        "latitude": 61.2,
+        "ts": "2022-05-01T12:00:00",
+        "positional_accuracy": 5.0,
+        "notes": f"record {instance}",
+        "observation_fields": {"12552": "Other", "15607": 1.5}
+    }
+
+class TestUploadRecord(InTemporaryDirectory):
+    def test_base_case(self):
+        kobo, inaturalist = FakeKobo(), FakeiNaturalist()
+        upload_record(make_record(1), "5678", inaturalist, kobo)
+
+        assert kobo.pulled == [("5678", 1, 11), ("5678", 1, 12)]
+        assert inaturalist.observations == [(47208, -149.9, 61.2, "2022-05-01T12:00:00", 5.0, "record 1")]
+        assert inaturalist.images == [(1, "5678 1 11"), (1, "5678 1 12")]
+        assert inaturalist.fields == [(1, 12552, "Other"), (1, 15607, 1.5)]
+        assert not os.path.exists("5678_1_11")
+        assert not os.path.exists("5678_1_12")
+
+    def test_in_memory(self):
+        kobo, inaturalist = FakeKobo(), FakeiNaturalist()
+        before = set(os.listdir("."))
+        upload_record(make_record(1), "5678", inaturalist, kobo, in_memory=True)
+
+        assert inaturalist.images == [(1, "5678 1 11"), (1, "5678 1 12")]
+        assert set(os.listdir(".")) == before
+
+    def test_image_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ImageCache(directory)
+            kobo = FakeKobo()
+            upload_record(make_record(1), "5678", FakeiNaturalist(), kobo, image_cache=cache)
+
+            inaturalist = FakeiNaturalist()
+            upload_record(make_record(1), "5678", inaturalist, kobo, image_cache=cache)
+
+            assert inaturalist.images == [(1, "5678 1 11"), (1, "5678 1 12")]
+            assert kobo.pulled == [("5678", 1, 11), ("5678", 1, 12)]
+
+    def test_none_fields_skipped(self):
+        record = make_record(1)
+        record["observation_fields"]["16000"] = None
+        inaturalist = FakeiNaturalist()
+        upload_record(record, "5678", inaturalist, FakeKobo())
+
+        assert inaturalist.fields == [(1, 12552, "Other"), (1, 15607, 1.5)]
+
+    def test_embed_fields(self):
+        record = make_record(1)
+        record["observation_fields"]["16000"] = None
+        inaturalist = FakeiNaturalist()
+        with tempfile.TemporaryDirectory() as directory:
+            with UploadLedger(os.path.join(directory, "ledger.jsonl")) as ledger:
+                upload_record(record, "5678", inaturalist, FakeKobo(), ledger=ledger, embed_fields=True)
+
+                assert inaturalist.fields == []
+                assert inaturalist.embedded == [(1, {12552: "Other", 15607: 1.5})]
+                assert ledger.get("5678", 1)["fields"] == {12552, 15607}
+
+    def test_pulled_images_removed_on_failure(self):
+        class BrokenKobo(FakeKobo):
+            def pull_image(self, image_path, uid, instance, image):
+                if image == 12:
+                    raise ConnectionError("timed out")
+                super().pull_image(image_path, uid, instance, image)
+
+        inaturalist = FakeiNaturalist()
+        with ThreadPoolExecutor(2) as executor:
+            with self.assertRaises(ConnectionError):
+                upload_record(make_record(1), "5678", inaturalist, BrokenKobo(), executor)
+
+        assert inaturalist.observations == []
+        assert os.listdir(".") == []
+
+    def test_buffers_closed_when_create_fails(self):
+        class BrokeniNaturalist(FakeiNaturalist):
+            def upload_base_observation(self, *args, **kwargs):
+                raise ValueError("nope")
+
+        kobo = FakeKobo()
+        with self.assertRaises(ValueError):
+            upload_record(make_record(1), "5678", BrokeniNaturalist(), kobo, in_memory=True)
+
+        assert len(kobo.buffers) == 2
+        assert all(buffer.closed for buffer in kobo.buffers)
+
+    def test_invalid_skipped(self):
+        kobo, inaturalist = FakeKobo(), FakeiNaturalist()
+        upload_record(make_record(1, is_valid=False), "5678", inaturalist, kobo)
+
+        assert kobo.pulled == []
+        assert inaturalist.observations == []
+
+class TestUploadData(InTemporaryDirectory):
+    def test_concurrent_matches_serial(self):
+        data = [make_record(i, is_valid=i % 3 != 0) for i in range(1, 13)]
+
+        kobo, serial = FakeKobo(), FakeiNaturalist()
+        upload_data(data, "5678", serial, kobo)
+
+        kobo, concurrent = FakeKobo(), FakeiNaturalist(delay=0.01)
+        upload_data(data, "5678", concurrent, kobo, workers=4)
+
+        assert sorted(serial.observations) == sorted(concurrent.observations)
+        assert len(serial.images) == len(concurrent.images) == 16
+        assert len(serial.fields) == len(concurrent.fields) == 16
+
+        # every attachment lands on the observation made for its own record
+        notes = {i + 1: observation[-1] for i, observation in enumerate(concurrent.observations)}
+        for observation_id, content in concurrent.images:
+            assert notes[observation_id] == f"record {content.split(' ')[1]}"
+
+    def test_stream_consumed(self):
+        data = (make_record(i) for i in range(1, 21))
+
+        kobo, inaturalist = FakeKobo(), FakeiNaturalist()
+        upload_data(data, "5678", inaturalist, kobo, workers=3)
+
+        assert len(inaturalist.observations) == 20
+
+    def test_error_raised(self):
+        class BrokeniNaturalist(FakeiNaturalist):
+            def attach_observation_field(self, observation_id, field_id, value):
+                raise ValueError("nope")
+
+        data = [make_record(i) for i in range(1, 4)]
+        with self.assertRaises(ValueError):
+            upload_data(data, "5678", BrokeniNaturalist(), FakeKobo(), workers=2)
+
+    def test_resume_from_ledger(self):
+        class FlakyiNaturalist(FakeiNaturalist):
+            def attach_observation_field(self, observation_id, field_id, value):
+                if field_id == 15607:
+                    raise ConnectionError("timed out")
+                super().attach_observation_field(observation_id, field_id, value)
+
+        data = [make_record(1)]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "ledger.jsonl")
+
+            with UploadLedger(path) as ledger:
+                with self.assertRaises(ConnectionError):
+                    upload_data(data, "5678", FlakyiNaturalist(), FakeKobo(), ledger=ledger)
+
+            kobo, inaturalist = FakeKobo(), FakeiNaturalist()
+            with UploadLedger(path) as ledger:
+                upload_data(data, "5678", inaturalist, kobo, ledger=ledger)
+
+                assert kobo.pulled == []
+                assert inaturalist.observations == []
+                assert inaturalist.images == []
+                assert inaturalist.fields == [(1, 15607, 1.5)]
+                assert ledger.get("5678", 1) == {
+                    "observation_id": 1,
+                    "images": {11, 12},
+                    "fields": {12552, 15607}
+                }
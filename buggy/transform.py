@@ -1,6 +1,14 @@
+import traceback
+
+from collections import namedtuple
 from functools import partial
 
-from gluon.kobo.client import KoboClient as Kobo
+from . import instrument
+from .deadletter import DeadLetterStore
+from .kobo import Kobo
+from .record import to_observation
+from .resultcache import TransformCache, submission_fingerprint, transformer_fingerprint
+from .watermark import Watermarks
 
 OBSERVATION_FIELD_IDS = {
     "EwA - Arthropod Developmental Stage": 15639,
@@ -283,17 +291,252 @@ BUGGY_TRANSFORMERS = [
     is_valid_transform
 ]
 
-def pull_and_transform_data(kobo: Kobo, uid: str, transformers: list, **kwargs) -> dict:
-    data = kobo.pull_data(uid)
+# the submission fields BUGGY_TRANSFORMERS read, plus what the watermark,
+# dead letters and transform cache go by; everything else kobo holds can
+# be left on the server
+BUGGY_FIELDS = [
+    "_id",
+    "_uuid",
+    "_version",
+    "__version__",
+    "_submission_time",
+    "_validation_status",
+    "_geolocation",
+    "_attachments",
+    "session_info/location",
+    "session_info/survey_method",
+    "session_info/survey_method_other",
+    "session_info/Survey_duration",
+    "session_info/survey_ts",
+    "session_info/input_email",
+    "arthropod_documentation/arthropod_group",
+    "arthropod_documentation/arthropod_group_other",
+    "arthropod_documentation/developmental_stage",
+    "arthropod_documentation/developmental_stage_other",
+    "arthropod_documentation/activity",
+    "arthropod_documentation/activity_other",
+    "arthropod_documentation/quantity",
+    "arthropod_documentation/length",
+    "arthropod_documentation/arthropod_photo_1",
+    "arthropod_documentation/arthropod_photo_2",
+    "arthropod_documentation/arthropod_photo_3",
+    "arthropod_documentation/arthropod_more",
+    "host_documentation/host_group",
+    "host_documentation/host_group_other",
+    "host_documentation/host_phenology",
+    "host_documentation/host_phenology_other",
+    "host_documentation/wet_support",
+    "host_documentation/host_photo",
+    "host_documentation/host_more"
+]
+
+APPROVED = ["validation_status_approved"]
+
+def validation_query(statuses: list, query: dict=None) -> dict:
+    # lets kobo drop submissions whose validation status is not in statuses
+    status_query = {"_validation_status.uid": {"$in": list(statuses)}}
+    if not query:
+        return status_query
+    return {"$and": [query, status_query]}
+
+TransformFailure = namedtuple("TransformFailure", ["entry", "transformer", "traceback"])
+
+def transformer_name(transformer) -> str:
+    while isinstance(transformer, partial):
+        transformer = transformer.func
+    return getattr(transformer, "__name__", repr(transformer))
+
+def transform_entry(entry: dict, transformers: list, **kwargs) -> tuple:
+    compiled = getattr(transformers, "compiled", None)
+    if compiled is not None:
+        try:
+            return compiled(entry, kwargs), None
+        except Exception:
+            # rerun one transformer at a time to find out which one failed
+            pass
+    transformed = {}
+    for transformer in transformers:
+        try:
+            key, value = transformer(entry, **kwargs)
+        except Exception:
+            return None, TransformFailure(
+                entry, transformer_name(transformer), traceback.format_exc()
+            )
+        transformed[key] = value
+    return transformed, None
+
+class TimedTransformer(object):
+    def __init__(self, name: str, transformer) -> None:
+        self.name = name
+        self.transformer = transformer
+        # failures are still reported under the wrapped transformer's name
+        self.__name__ = transformer_name(transformer)
+
+    def __call__(self, entry: dict, **kwargs) -> tuple:
+        with instrument.timer(self.name):
+            return self.transformer(entry, **kwargs)
+
+def _transformer_label(transformer) -> str:
+    name = transformer_name(transformer)
+    if isinstance(transformer, partial) and transformer.func in (
+        mapping_transform, convert_key_transform, identifier_transform
+    ):
+        return f"{name}[{transformer.args[1]}]"
+    return name
+
+def instrument_transformers(transformers: list, prefix: str="transform") -> list:
+    # wraps every transformer, nested observation field ones included, in
+    # a timer; the compiled plan is given up for the per transformer view
+    instrumented = []
+    for transformer in transformers:
+        name = f"{prefix}.{_transformer_label(transformer)}"
+        if (
+            isinstance(transformer, partial)
+            and transformer.func is observation_field_transformer
+            and len(transformer.args) == 1
+        ):
+            transformer = partial(
+                observation_field_transformer,
+                instrument_transformers(transformer.args[0], name),
+                **transformer.keywords
+            )
+        instrumented.append(TimedTransformer(name, transformer))
+    return instrumented
+
+def transform_data(data: list, transformers: list, dead_letters: DeadLetterStore=None, compact: bool=False, **kwargs) -> tuple:
+    # with compact the records come out as Observations rather than dicts,
+    # where they have the shape of one
+    if instrument.ACTIVE is not None:
+        transformers = instrument_transformers(transformers)
     transformed_data = []
     failed = 0
     for entry in data:
-        try:
-            transformed = {}
-            for transformer in transformers:
-                key, value = transformer(entry, **kwargs)
-                transformed[key] = value
+        transformed, failure = transform_entry(entry, transformers, **kwargs)
+        if failure is None:
+            transformed_data.append(to_observation(transformed) if compact else transformed)
+        else:
+            failed += 1
+            if dead_letters is not None:
+                dead_letters.add(failure)
+    return transformed_data, failed
+
+def cached_transform_data(data: list, uid: str, transformers: list, cache: TransformCache, dead_letters: DeadLetterStore=None, compact: bool=False, **kwargs) -> tuple:
+    # submissions that have not changed since they were last transformed by
+    # the same transformers come out of the cache, the rest are transformed
+    # and stored
+    config = transformer_fingerprint(transformers, kwargs)
+    cached = cache.load(uid)
+    if instrument.ACTIVE is not None:
+        transformers = instrument_transformers(transformers)
+    entries = []
+    hits = []
+    for entry in data:
+        entry_id = entry.get("_id")
+        submission = submission_fingerprint(entry)
+        hit = entry_id is not None and cached.get(str(entry_id)) == (submission, config)
+        entries.append((entry, entry_id, submission, hit))
+        if hit:
+            hits.append(entry_id)
+    records = cache.records(uid, hits)
+    transformed_data = []
+    failed = 0
+    results = []
+    for entry, entry_id, submission, hit in entries:
+        record = records.get(str(entry_id)) if hit else None
+        if record is not None:
+            transformed_data.append(to_observation(record) if compact else record)
+            continue
+        transformed, failure = transform_entry(entry, transformers, **kwargs)
+        if failure is None:
+            transformed_data.append(to_observation(transformed) if compact else transformed)
+            if entry_id is not None:
+                results.append((entry_id, submission, config, transformed))
+        else:
+            failed += 1
+            if dead_letters is not None:
+                dead_letters.add(failure, uid=uid)
+    cache.put_many(uid, results)
+    instrument.count("transform.cache.hits", len(hits))
+    instrument.count("transform.cache.misses", len(entries) - len(hits))
+    return transformed_data, failed
+
+class _FailureLog(object):
+    # notes which submissions failed on the way to the dead letter store,
+    # and files them under their asset
+    def __init__(self, dead_letters: DeadLetterStore, uid: str) -> None:
+        self.dead_letters = dead_letters
+        self.uid = uid
+        self.entry_ids = []
+
+    def add(self, failure: TransformFailure, uid: str=None) -> None:
+        self.entry_ids.append(failure.entry.get("_id"))
+        if self.dead_letters is not None:
+            self.dead_letters.add(failure, uid=self.uid)
+
+def _transform_data(data: list, uid: str, transformers: list, dead_letters: _FailureLog, cache: TransformCache, kwargs: dict) -> tuple:
+    if cache is not None:
+        return cached_transform_data(data, uid, transformers, cache, dead_letters=dead_letters, **kwargs)
+    return transform_data(data, transformers, dead_letters=dead_letters, **kwargs)
+
+def pull_and_transform_data(kobo: Kobo, uid: str, transformers: list, dead_letters: DeadLetterStore=None, cache: TransformCache=None, statuses: list=None, fields: list=None, **kwargs) -> dict:
+    # with statuses (e.g. APPROVED) and fields (e.g. BUGGY_FIELDS) kobo only
+    # sends those submissions, and only those parts of them
+    if statuses is None and fields is None:
+        data = kobo.pull_data(uid)
+    else:
+        query = validation_query(statuses) if statuses is not None else None
+        data = kobo.pull_data(uid, query=query, fields=fields)
+    return _transform_data(data, uid, transformers, _FailureLog(dead_letters, uid), cache, kwargs)
+
+def pull_and_transform_new_data(kobo: Kobo, uid: str, transformers: list, watermarks: Watermarks, dead_letters: DeadLetterStore=None, cache: TransformCache=None, statuses: list=None, fields: list=None, **kwargs) -> dict:
+    # only ask kobo for submissions past the last one we have seen
+    if statuses is not None:
+        # the mark would move past submissions that are approved later on
+        raise ValueError("statuses cannot be combined with watermarks")
+    mark = watermarks.get(uid)
+    query = {"_id": {"$gt": mark}} if mark is not None else None
+    data = kobo.pull_data(uid, query=query, fields=fields, sort={"_id": 1})
+    failures = _FailureLog(dead_letters, uid)
+    transformed_data, failed = _transform_data(data, uid, transformers, failures, cache, kwargs)
+    mark = max((entry["_id"] for entry in data), default=mark)
+    if dead_letters is None and failures.entry_ids:
+        # a failure with nowhere else to go is pulled again next run, and so
+        # is everything after it, so only the records before it go out now.
+        # data is sorted by _id and everything before the failure made it
+        first = min(failures.entry_ids)
+        held = [entry["_id"] for entry in data if entry["_id"] < first]
+        mark = max(held, default=watermarks.get(uid))
+        transformed_data = transformed_data[:len(held)]
+    # the caller commits the mark once the records are saved
+    if mark is not None:
+        watermarks.stage(uid, mark)
+    return transformed_data, failed
+
+def stream_and_transform_data(kobo: Kobo, uid: str, transformers: list, page_size: int=1000, query: dict=None, dead_letters: DeadLetterStore=None, statuses: list=None, fields: list=None, **kwargs):
+    # yields (transformed, None) or (None, TransformFailure) one entry at a time
+    if instrument.ACTIVE is not None:
+        transformers = instrument_transformers(transformers)
+    if statuses is not None:
+        query = validation_query(statuses, query)
+    for entry in kobo.iter_data(uid, page_size=page_size, query=query, fields=fields):
+        transformed, failure = transform_entry(entry, transformers, **kwargs)
+        if failure is not None and dead_letters is not None:
+            dead_letters.add(failure, uid=uid)
+        yield transformed, failure
+
+def reprocess_dead_letters(dead_letters: DeadLetterStore, transformers: list, **kwargs) -> tuple:
+    # reruns only the stored failures; the ones that now go through are
+    # resolved, the rest are stored again with their new traceback
+    if instrument.ACTIVE is not None:
+        transformers = instrument_transformers(transformers)
+    transformed_data = []
+    failed = 0
+    for letter in dead_letters.failures():
+        transformed, failure = transform_entry(letter["entry"], transformers, **kwargs)
+        if failure is None:
             transformed_data.append(transformed)
-        except Exception:
+            dead_letters.resolve(letter["key"])
+        else:
             failed += 1
+            dead_letters.add(failure, uid=letter["uid"])
     return transformed_data, failed
@@ -1,43 +1,216 @@
 import os
 
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from functools import partial
+
 from tqdm import tqdm
 
-from gluon.inaturalist.client import iNaturalistClient as iNaturalist
-from gluon.kobo.client import KoboClient as Kobo
+from . import instrument
+from .cache import ImageCache
+from .inaturalist import iNaturalist
+from .kobo import Kobo
+from .ledger import UploadLedger
 
-def upload_data(data: dict, uid: str, inaturalist_client: iNaturalist, kobo_client: Kobo) -> None:
-    for record in tqdm(data):
-        if not record['is_valid']: continue
+def _run_all(executor: ThreadPoolExecutor, calls: list, discard=None) -> list:
+    results = []
+    try:
+        if executor is None:
+            for call in calls:
+                results.append(call())
+            return results
+        futures = [executor.submit(call) for call in calls]
+        wait(futures)
+        results = [future.result() for future in futures if future.exception() is None]
+        for future in futures:
+            future.result()
+        return results
+    finally:
+        # if a call failed, clean up after the ones that did not
+        if discard is not None and len(results) < len(calls):
+            for result in results:
+                discard(result)
 
-        # start by downloading the images
-        image_paths = []
-        instance = record['instance']
-        for image in record['images']:
-            image_path = f'{uid}_{instance}_{image}'
-            kobo_client.pull_image(
-                image_path, uid, instance, image
-            )
-            image_paths.append(image_path)
-        
-        # upload the base observation
-        observation_id = inaturalist_client.upload_base_observation(
-            record['taxa'], 
-            record['longitude'], 
-            record['latitude'], 
-            record['ts'], 
-            record['positional_accuracy'], 
-            record['notes']
+def _pull_image(kobo_client: Kobo, uid: str, instance: int, image: int) -> str:
+    image_path = f'{uid}_{instance}_{image}'
+    with instrument.timer("upload.pull_image"):
+        kobo_client.pull_image(
+            image_path, uid, instance, image
         )
+    return image_path
+
+def _open_image(kobo_client: Kobo, uid: str, instance: int, image: int):
+    with instrument.timer("upload.pull_image"):
+        return kobo_client.open_image(uid, instance, image), f'{uid}_{instance}_{image}'
 
-        # attach the images
-        for image_path in image_paths:
+def _cached_image(image_cache: ImageCache, kobo_client: Kobo, uid: str, instance: int, image: int):
+    with instrument.timer("upload.pull_image"):
+        return image_cache.open(kobo_client, uid, instance, image), f'{uid}_{instance}_{image}'
+
+def _attach_image(inaturalist_client: iNaturalist, observation_id: int, image_path) -> None:
+    with instrument.timer("upload.attach_image"):
+        _send_image(inaturalist_client, observation_id, image_path)
+
+def _send_image(inaturalist_client: iNaturalist, observation_id: int, image_path) -> None:
+    # image_path is either a file on disk or an (in memory buffer, filename) pair
+    try:
+        if isinstance(image_path, str):
             inaturalist_client.attach_image(
                 observation_id, image_path
             )
+        else:
+            buffer, filename = image_path
+            inaturalist_client.attach_image(
+                observation_id, buffer, filename
+            )
+    finally:
+        discard_image(image_path)
+
+def discard_image(image_path) -> None:
+    if isinstance(image_path, str):
+        if os.path.exists(image_path):
             os.remove(image_path)
+    else:
+        image_path[0].close()
+
+def upload_record(record: dict, uid: str, inaturalist_client: iNaturalist, kobo_client: Kobo, executor: ThreadPoolExecutor=None, ledger: UploadLedger=None, in_memory: bool=False, image_cache: ImageCache=None, embed_fields: bool=False) -> None:
+    if not record['is_valid']: return
+    with instrument.timer("upload.record"):
+        _upload_record(
+            record, uid, inaturalist_client, kobo_client, executor,
+            ledger, in_memory, image_cache, embed_fields
+        )
+
+def remaining_uploads(record: dict, uid: str, ledger: UploadLedger) -> tuple:
+    # find out what a previous run already did for this record
+    done = ledger.get(uid, record['instance']) if ledger is not None else None
+    if done is None:
+        done = {"observation_id": None, "images": set(), "fields": set()}
+    images = [image for image in record['images'] if image not in done['images']]
+    fields = [
+        (int(field_id), value)
+        for field_id, value in record['observation_fields'].items()
+        if value is not None and int(field_id) not in done['fields']
+    ]
+    return done['observation_id'], images, fields
+
+def image_puller(in_memory: bool, image_cache: ImageCache):
+    if image_cache is not None:
+        return partial(_cached_image, image_cache)
+    return _open_image if in_memory else _pull_image
 
-        # attach the observation field values
-        for field_id, value in record['observation_fields'].items():
-            inaturalist_client.attach_observation_field(
-                observation_id, int(field_id), value
+def create_observation(record: dict, uid: str, inaturalist_client: iNaturalist, ledger: UploadLedger, fields: list, embed_fields: bool) -> tuple:
+    # returns the new observation id and the fields still to be attached
+    instance = record['instance']
+    observation = (
+        record['taxa'],
+        record['longitude'],
+        record['latitude'],
+        record['ts'],
+        record['positional_accuracy'],
+        record['notes']
+    )
+    # with embed_fields the field values go out with the observation
+    embedded = dict(fields) if embed_fields else {}
+    with instrument.timer("upload.create_observation"):
+        if embed_fields:
+            observation_id = inaturalist_client.upload_base_observation(
+                *observation, observation_fields=embedded
             )
+        else:
+            observation_id = inaturalist_client.upload_base_observation(*observation)
+    if ledger is not None:
+        ledger.record_observation(uid, instance, observation_id, point={
+            "taxa": record['taxa'],
+            "latitude": record['latitude'],
+            "longitude": record['longitude'],
+            "ts": record['ts'],
+            "positional_accuracy": record['positional_accuracy']
+        })
+        for field_id in embedded:
+            ledger.record_field(uid, instance, field_id)
+    return observation_id, [(field_id, value) for field_id, value in fields if field_id not in embedded]
+
+def attach_recorded_image(inaturalist_client: iNaturalist, ledger: UploadLedger, uid: str, instance: int, observation_id: int, image: int, image_path) -> None:
+    _attach_image(inaturalist_client, observation_id, image_path)
+    if ledger is not None:
+        ledger.record_image(uid, instance, image)
+
+def attach_recorded_field(inaturalist_client: iNaturalist, ledger: UploadLedger, uid: str, instance: int, observation_id: int, field_id: int, value) -> None:
+    with instrument.timer("upload.attach_field"):
+        inaturalist_client.attach_observation_field(
+            observation_id, field_id, value
+        )
+    if ledger is not None:
+        ledger.record_field(uid, instance, field_id)
+
+def _upload_record(record: dict, uid: str, inaturalist_client: iNaturalist, kobo_client: Kobo, executor: ThreadPoolExecutor, ledger: UploadLedger, in_memory: bool, image_cache: ImageCache, embed_fields: bool) -> None:
+    instance = record['instance']
+    observation_id, images, fields = remaining_uploads(record, uid, ledger)
+
+    # start by downloading the images
+    pull_image = image_puller(in_memory, image_cache)
+    image_paths = _run_all(executor, [
+        lambda image=image: pull_image(kobo_client, uid, instance, image)
+        for image in images
+    ], discard=discard_image)
+
+    # upload the base observation
+    if observation_id is None:
+        try:
+            observation_id, fields = create_observation(
+                record, uid, inaturalist_client, ledger, fields, embed_fields
+            )
+        except BaseException:
+            for image_path in image_paths:
+                discard_image(image_path)
+            raise
+
+    # attach the images and the observation field values
+    _run_all(executor, [
+        partial(attach_recorded_image, inaturalist_client, ledger, uid, instance, observation_id, image, image_path)
+        for image, image_path in zip(images, image_paths)
+    ] + [
+        partial(attach_recorded_field, inaturalist_client, ledger, uid, instance, observation_id, field_id, value)
+        for field_id, value in fields
+    ])
+
+def upload_data(data: dict, uid: str, inaturalist_client: iNaturalist, kobo_client: Kobo, workers: int=1, attach_workers: int=None, ledger: UploadLedger=None, in_memory: bool=False, image_cache: ImageCache=None, embed_fields: bool=False) -> None:
+    if workers <= 1 and not attach_workers:
+        for record in tqdm(data):
+            upload_record(
+                record, uid, inaturalist_client, kobo_client,
+                ledger=ledger, in_memory=in_memory, image_cache=image_cache,
+                embed_fields=embed_fields
+            )
+        return
+
+    # records go out on one pool while their images and fields go out on
+    # another so a record waiting on its attachments never starves them
+    attach_workers = attach_workers or 4 * workers
+    progress = tqdm(total=len(data) if hasattr(data, '__len__') else None)
+    with ThreadPoolExecutor(attach_workers) as attach_executor:
+        with ThreadPoolExecutor(workers) as record_executor:
+            # only a window of records is in flight so data can be a stream
+            in_flight = set()
+            try:
+                for record in data:
+                    if len(in_flight) >= 2 * workers:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                            progress.update()
+                    in_flight.add(record_executor.submit(
+                        upload_record, record, uid,
+                        inaturalist_client, kobo_client,
+                        attach_executor, ledger, in_memory, image_cache,
+                        embed_fields
+                    ))
+                for future in in_flight:
+                    future.result()
+                    progress.update()
+            except BaseException:
+                for future in in_flight:
+                    future.cancel()
+                raise
+            finally:
+                progress.close()
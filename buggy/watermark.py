@@ -0,0 +1,31 @@
+import json
+import os
+
+# High water mark (largest submission _id seen) per Kobo asset uid
+class Watermarks(object):
+    def __init__(self, db: str) -> None:
+        self.db = db
+        self.db_content = {}
+        # marks that only move on once the records they cover are saved
+        self.staged = {}
+        if os.path.exists(db):
+            with open(db, "r") as fh:
+                self.db_content = json.load(fh)
+
+    def get(self, uid: str) -> int:
+        return self.db_content.get(uid)
+
+    def set(self, uid: str, mark: int) -> None:
+        self.db_content[uid] = mark
+        with open(self.db, "w") as fh:
+            json.dump(self.db_content, fh, sort_keys=True, indent=4)
+
+    def stage(self, uid: str, mark: int) -> None:
+        self.staged[uid] = mark
+
+    def commit(self) -> None:
+        for uid, mark in sorted(self.staged.items()):
+            self.db_content[uid] = mark
+        self.staged = {}
+        with open(self.db, "w") as fh:
+            json.dump(self.db_content, fh, sort_keys=True, indent=4)
@@ -10,7 +10,11 @@ setup(
     install_requires=[
         'httpretty',
         'pytest',
+        'requests',
         'gluon @ git+ssh://git@github.com/networkearth/gluon',
         'tqdm'
-    ]
+    ],
+    entry_points={
+        'console_scripts': ['buggy=buggy.cli:main']
+    }
 )
\ No newline at end of file